@@ -0,0 +1,142 @@
+import asyncio
+import os
+from datetime import datetime
+
+import models
+import writer
+
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "200"))
+
+hits = 0
+misses = 0
+
+def lookup(db, key: tuple):
+    """Cached analysis for (suspect_id, filter_signature, data_version, model, prompt_version), or None."""
+    global hits, misses
+    row = db.get(models.AIAnalysisCache, key)
+    if row is None:
+        misses += 1
+        return None
+    hits += 1
+    writer.submit(lambda db: _touch(db, key))
+    return row.analysis
+
+def _touch(db, key: tuple):
+    row = db.get(models.AIAnalysisCache, key)
+    if row is not None:
+        row.last_used_at = datetime.now()
+
+def store(db, key: tuple, analysis: str):
+    """Writer op: insert or refresh the analysis for `key`, then evict beyond AI_CACHE_MAX_ENTRIES."""
+    suspect_id, signature, data_version, model, prompt_version = key
+    row = db.get(models.AIAnalysisCache, key)
+    if row is None:
+        row = models.AIAnalysisCache(
+            suspect_id=suspect_id,
+            filter_signature=signature,
+            data_version=data_version,
+            model=model,
+            prompt_version=prompt_version,
+        )
+        db.add(row)
+    row.analysis = analysis
+    row.last_used_at = datetime.now()
+    db.flush()
+    _evict(db)
+
+def _evict(db):
+    cache = models.AIAnalysisCache
+    overflow = db.query(cache).count() - AI_CACHE_MAX_ENTRIES
+    if overflow <= 0:
+        return
+    oldest = db.query(cache.suspect_id, cache.filter_signature, cache.data_version, cache.model, cache.prompt_version)
+    for key in oldest.order_by(cache.last_used_at).limit(overflow).all():
+        db.query(cache).filter(
+            cache.suspect_id == key[0],
+            cache.filter_signature == key[1],
+            cache.data_version == key[2],
+            cache.model == key[3],
+            cache.prompt_version == key[4],
+        ).delete(synchronize_session=False)
+
+def remove_suspect(db, suspect_id: int):
+    db.query(models.AIAnalysisCache).filter(models.AIAnalysisCache.suspect_id == suspect_id).delete(
+        synchronize_session=False
+    )
+
+def stats(db):
+    entries = db.query(models.AIAnalysisCache).count()
+    return {"entries": entries, "max_entries": AI_CACHE_MAX_ENTRIES, "hits": hits, "misses": misses}
+
+class Flight:
+    """One in-progress generation that any number of identical requests listen to.
+
+    Lives on the event loop: publish() must be called from the loop thread. A listener that joins
+    late first receives everything produced so far as one token.
+    """
+
+    def __init__(self, keep_running: bool = False):
+        # Background pre-analysis finishes even if everyone who joined it has left
+        self.keep_running = keep_running
+        self.parts: list[str] = []
+        self.listeners: set[asyncio.Queue] = set()
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Set once nobody is listening any more; cancelling `task` stops the generation
+        self.cancelled = False
+        self.task = None
+        self._refs = 0
+
+    def publish(self, kind: str, payload=None):
+        if kind == "token":
+            self.parts.append(payload)
+        for queue in self.listeners:
+            queue.put_nowait((kind, payload))
+
+    def subscribe(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        if self.parts:
+            queue.put_nowait(("token", "".join(self.parts)))
+        if self.done.done():
+            # Finished before this listener arrived; nothing more will be published
+            error = self.done.exception()
+            queue.put_nowait(("error", str(error)) if error else ("done", self.done.result()))
+        self.listeners.add(queue)
+        self._refs += 1
+        return queue
+
+    def unsubscribe(self, queue):
+        self.listeners.discard(queue)
+        self._refs -= 1
+        if self._refs <= 0 and not self.keep_running and not self.done.done():
+            self.cancelled = True
+            if self.task is not None:
+                self.task.cancel()
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[tuple, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def current(self, key: tuple):
+        """The live flight for `key`, if any; joining it costs no LLM call."""
+        flight = self._flights.get(key)
+        if flight is None or flight.cancelled:
+            return None
+        self.joined += 1
+        return flight
+
+    def start(self, key: tuple, keep_running: bool = False):
+        flight = Flight(keep_running)
+        self._flights[key] = flight
+        self.started += 1
+        return flight
+
+    def finish(self, key: tuple, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
+
+flights = SingleFlight()
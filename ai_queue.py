@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+
+# Generations allowed at once; a local model is CPU/VRAM bound, so more rarely means faster
+AI_CONCURRENCY = max(1, int(os.getenv("AI_CONCURRENCY", "2")))
+# Disable to only run analyses someone asked for
+AI_BACKGROUND_ANALYSIS = os.getenv("AI_BACKGROUND_ANALYSIS", "1").strip().lower() not in ("0", "false", "no")
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+class _Job:
+    __slots__ = ("key", "priority", "run", "enqueued_at", "started", "then")
+
+    def __init__(self, key, priority, run):
+        self.key = key
+        self.priority = priority
+        self.run = run
+        self.enqueued_at = time.monotonic()
+        self.started = False
+        # (priority, run) submitted for the key while this job was already running
+        self.then = None
+
+class AIScheduler:
+    """Priority queue in front of the LLM: interactive requests run before background pre-analysis.
+
+    Workers are created on first use inside the running event loop. A queued background job that
+    an interactive request starts waiting on is promoted by pushing it again at the higher
+    priority; whichever copy comes out first runs it, the other is skipped.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._queue = None
+        self._workers = []
+        self._seq = itertools.count()
+        self._pending: dict[tuple, _Job] = {}
+        self.running = 0
+        self.completed = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.failed = 0
+        self._waits = {name: deque(maxlen=200) for name in PRIORITY_NAMES.values()}
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._workers:
+            self._workers = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def submit(self, key: tuple, priority: int, run):
+        """Queue `run` (a coroutine function) for `key`; returns False if the key already has a job.
+
+        A newer submission supersedes the older one: a job that hasn't started runs the new `run`
+        instead, and one that is running is followed by it.
+        """
+        self._ensure_workers()
+        job = self._pending.get(key)
+        if job is not None:
+            if job.started:
+                job.then = (min(priority, job.then[0]) if job.then else priority, run)
+            else:
+                job.run = run
+                self.promote(key, priority)
+            return False
+        job = _Job(key, priority, run)
+        self._pending[key] = job
+        self._queue.put_nowait((priority, next(self._seq), job))
+        return True
+
+    def promote(self, key: tuple, priority: int):
+        job = self._pending.get(key)
+        if job is None or job.started or priority >= job.priority:
+            return
+        job.priority = priority
+        self._queue.put_nowait((priority, next(self._seq), job))
+
+    def is_pending(self, key: tuple):
+        return key in self._pending
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.started:
+                continue
+            job.started = True
+            name = PRIORITY_NAMES[job.priority]
+            self._waits[name].append(time.monotonic() - job.enqueued_at)
+            self.running += 1
+            try:
+                await job.run()
+                self.completed[name] += 1
+            except Exception:
+                self.failed += 1
+            finally:
+                self.running -= 1
+                if self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+                if job.then is not None:
+                    self.submit(job.key, *job.then)
+
+    def stats(self):
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for job in self._pending.values():
+            if not job.started:
+                queued[PRIORITY_NAMES[job.priority]] += 1
+        waits = {}
+        for name, samples in self._waits.items():
+            ordered = sorted(samples)
+            waits[name] = {
+                "samples": len(ordered),
+                "p50_seconds": round(ordered[len(ordered) // 2], 3) if ordered else None,
+                "p95_seconds": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else None,
+                "max_seconds": round(ordered[-1], 3) if ordered else None,
+            }
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": queued,
+            "completed": dict(self.completed),
+            "failed": self.failed,
+            "wait": waits,
+        }
+
+scheduler = AIScheduler(AI_CONCURRENCY)
@@ -0,0 +1,228 @@
+import os
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import linkage
+import models
+
+# Amounts with a symbolic meaning in Chinese (520 = "I love you", 1314 = "forever", ...)
+AMOUNT_WATCHLIST = os.getenv("AMOUNT_WATCHLIST", "5.2,13.14,52,131.4,520,521,1314,1314.52,5200,5201,6666,8888,9999")
+PERCENTILES = (10, 25, 50, 75, 90, 95, 99)
+# SQLite's bound-parameter limit is low on older builds
+IN_CHUNK_SIZE = 500
+
+def to_cents(amount):
+    return int(round(float(amount or 0) * 100))
+
+def parse_amount_list(raw: str):
+    cents = []
+    for part in (raw or "").replace("，", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            cents.append(to_cents(part))
+        except ValueError:
+            continue
+    return list(dict.fromkeys(cents))
+
+def group_items(items):
+    """Aggregate raw transaction dicts into (amount_cents, counterparty, category, count) rows."""
+    grouped = defaultdict(int)
+    for item in items:
+        grouped[(to_cents(item.get("amount")), item.get("counterparty"), item.get("category"))] += 1
+    return [(cents, cp, cat, cnt) for (cents, cp, cat), cnt in grouped.items()]
+
+def grouped_for_query(query):
+    """Same shape as group_items, computed in SQL for rows about to be deleted."""
+    cents = cast(func.round(models.Transaction.amount * 100), Integer)
+    return (
+        query.with_entities(cents, models.Transaction.counterparty, models.Transaction.category, func.count(models.Transaction.id))
+        .group_by(cents, models.Transaction.counterparty, models.Transaction.category)
+        .all()
+    )
+
+def apply_delta(db, suspect_id: int, grouped_rows, sign: int = 1):
+    per_amount: dict[int, list] = {}
+    per_counterparty: dict[tuple, int] = defaultdict(int)
+    for cents, counterparty, category, count in grouped_rows:
+        cents = int(cents or 0)
+        count = int(count or 0)
+        acc = per_amount.setdefault(cents, [0, 0, 0])
+        acc[0] += count
+        if category == "收入":
+            acc[1] += count
+        elif category == "支出":
+            acc[2] += count
+        key = linkage.normalize_counterparty(counterparty)
+        if key:
+            per_counterparty[(cents, key)] += count
+
+    if not per_amount:
+        return
+
+    stats = models.AmountStat.__table__
+    stmt = sqlite_insert(stats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[stats.c.suspect_id, stats.c.amount_cents],
+        set_={
+            "tx_count": stats.c.tx_count + stmt.excluded.tx_count,
+            "income_count": stats.c.income_count + stmt.excluded.income_count,
+            "expense_count": stats.c.expense_count + stmt.excluded.expense_count,
+        },
+    )
+    db.execute(
+        stmt,
+        [
+            {
+                "suspect_id": suspect_id,
+                "amount_cents": cents,
+                "tx_count": sign * acc[0],
+                "income_count": sign * acc[1],
+                "expense_count": sign * acc[2],
+                "counterparty_count": 0,
+            }
+            for cents, acc in per_amount.items()
+        ],
+    )
+
+    if per_counterparty:
+        links = models.AmountCounterparty.__table__
+        stmt = sqlite_insert(links)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[links.c.suspect_id, links.c.amount_cents, links.c.counterparty_key],
+            set_={"tx_count": links.c.tx_count + stmt.excluded.tx_count},
+        )
+        db.execute(
+            stmt,
+            [
+                {"suspect_id": suspect_id, "amount_cents": cents, "counterparty_key": key, "tx_count": sign * count}
+                for (cents, key), count in per_counterparty.items()
+            ],
+        )
+
+    if sign < 0:
+        db.query(models.AmountCounterparty).filter(
+            models.AmountCounterparty.suspect_id == suspect_id,
+            models.AmountCounterparty.tx_count <= 0,
+        ).delete(synchronize_session=False)
+        db.query(models.AmountStat).filter(
+            models.AmountStat.suspect_id == suspect_id,
+            models.AmountStat.tx_count <= 0,
+        ).delete(synchronize_session=False)
+
+    # Refresh the distinct-counterparty count of the touched amounts only
+    links = models.AmountCounterparty
+    distinct = (
+        select(func.count())
+        .where(links.suspect_id == suspect_id, links.amount_cents == models.AmountStat.amount_cents)
+        .scalar_subquery()
+    )
+    touched = list(per_amount)
+    for i in range(0, len(touched), IN_CHUNK_SIZE):
+        db.execute(
+            update(models.AmountStat)
+            .where(
+                models.AmountStat.suspect_id == suspect_id,
+                models.AmountStat.amount_cents.in_(touched[i : i + IN_CHUNK_SIZE]),
+            )
+            .values(counterparty_count=distinct)
+            .execution_options(synchronize_session=False)
+        )
+
+def remove_suspect(db, suspect_id: int):
+    db.query(models.AmountCounterparty).filter(models.AmountCounterparty.suspect_id == suspect_id).delete(
+        synchronize_session=False
+    )
+    db.query(models.AmountStat).filter(models.AmountStat.suspect_id == suspect_id).delete(synchronize_session=False)
+
+def rebuild_for_suspect(db, suspect_id: int):
+    remove_suspect(db, suspect_id)
+    query = db.query(models.Transaction).filter(models.Transaction.suspect_id == suspect_id)
+    apply_delta(db, suspect_id, grouped_for_query(query), 1)
+
+def unbuilt_suspects(db):
+    indexed = {r[0] for r in db.query(models.AmountStat.suspect_id).distinct().all()}
+    with_rows = {r[0] for r in db.query(models.Transaction.suspect_id).distinct().all()}
+    return sorted(with_rows - indexed)
+
+def _stat_row(r):
+    return {
+        "amount": r.amount_cents / 100,
+        "tx_count": r.tx_count,
+        "income_count": r.income_count,
+        "expense_count": r.expense_count,
+        "counterparty_count": r.counterparty_count,
+        "total": r.amount_cents * r.tx_count / 100,
+    }
+
+def top_amounts(db, suspect_id: int, limit: int = 20, min_count: int = 2):
+    rows = (
+        db.query(models.AmountStat)
+        .filter(models.AmountStat.suspect_id == suspect_id, models.AmountStat.tx_count >= min_count)
+        .order_by(models.AmountStat.tx_count.desc(), models.AmountStat.amount_cents.desc())
+        .limit(limit)
+        .all()
+    )
+    return [_stat_row(r) for r in rows]
+
+def watchlist(db, suspect_id: int, amounts_cents: list[int]):
+    found = {}
+    for i in range(0, len(amounts_cents), IN_CHUNK_SIZE):
+        chunk = amounts_cents[i : i + IN_CHUNK_SIZE]
+        for r in db.query(models.AmountStat).filter(
+            models.AmountStat.suspect_id == suspect_id, models.AmountStat.amount_cents.in_(chunk)
+        ):
+            found[r.amount_cents] = _stat_row(r)
+    empty = {"tx_count": 0, "income_count": 0, "expense_count": 0, "counterparty_count": 0, "total": 0.0}
+    return [found.get(c) or {"amount": c / 100, **empty} for c in amounts_cents]
+
+def percentile_bands(db, suspect_id: int):
+    rows = (
+        db.query(models.AmountStat.amount_cents, models.AmountStat.tx_count)
+        .filter(models.AmountStat.suspect_id == suspect_id)
+        .order_by(models.AmountStat.amount_cents)
+        .all()
+    )
+    if not rows:
+        return {"total": 0, "percentiles": {}, "bands": []}
+
+    cents = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    counts = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    cumulative = np.cumsum(counts)
+    total = int(cumulative[-1])
+    # Nearest-rank percentile over the expanded (amount repeated tx_count times) distribution
+    ranks = np.ceil(np.array(PERCENTILES) / 100 * total).astype(np.int64)
+    cut_cents = cents[np.searchsorted(cumulative, np.maximum(ranks, 1), side="left")]
+
+    edges = [int(cents[0])] + [int(c) for c in cut_cents] + [int(cents[-1])]
+    labels = ["min"] + [f"p{p}" for p in PERCENTILES] + ["max"]
+    weighted = np.cumsum(cents * counts)
+    bands = []
+    prev_pos = 0
+    for k in range(1, len(edges)):
+        # Band k holds amounts in (edges[k-1], edges[k]]; the first one also includes the minimum
+        pos = int(np.searchsorted(cents, edges[k], side="right"))
+        count = int(cumulative[pos - 1] - (cumulative[prev_pos - 1] if prev_pos else 0)) if pos > prev_pos else 0
+        amount = int(weighted[pos - 1] - (weighted[prev_pos - 1] if prev_pos else 0)) if pos > prev_pos else 0
+        bands.append(
+            {
+                "from": labels[k - 1],
+                "to": labels[k],
+                "min_amount": edges[k - 1] / 100,
+                "max_amount": edges[k] / 100,
+                "tx_count": count,
+                "total": amount / 100,
+            }
+        )
+        prev_pos = max(prev_pos, pos)
+
+    return {
+        "total": total,
+        "distinct_amounts": len(rows),
+        "percentiles": {f"p{p}": int(c) / 100 for p, c in zip(PERCENTILES, cut_cents)},
+        "bands": bands,
+    }
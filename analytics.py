@@ -0,0 +1,555 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import models
+
+# "columnar" serves per-suspect stats from the in-memory arrays, "sql" keeps the aggregate queries
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "columnar").strip().lower()
+ANALYTICS_CACHE_MB = int(os.getenv("ANALYTICS_CACHE_MB", "256"))
+ANALYTICS_RESULT_CACHE_SIZE = int(os.getenv("ANALYTICS_RESULT_CACHE_SIZE", "512"))
+
+# Sentinel for rows without a transaction_time (same bit pattern as NaT)
+NO_TIME = np.iinfo(np.int64).min
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+BUCKETS = ("hour", "day", "week", "month")
+# Approximate bucket widths, only used to pick a bucket for bucket=auto
+BUCKET_SECONDS = {
+    "hour": SECONDS_PER_HOUR,
+    "day": SECONDS_PER_DAY,
+    "week": SECONDS_PER_WEEK,
+    "month": 30 * SECONDS_PER_DAY,
+}
+TREND_TARGET_POINTS = int(os.getenv("TREND_TARGET_POINTS", "120"))
+
+INCOME = "收入"
+EXPENSE = "支出"
+
+# time_range=day covers [DAY_START_HOUR, NIGHT_START_HOUR); night is the rest of the clock
+DAY_START_HOUR = int(os.getenv("DAY_START_HOUR", "6"))
+NIGHT_START_HOUR = int(os.getenv("NIGHT_START_HOUR", "18"))
+
+# Upper edges (yuan) of the amount bands used by the heatmap; the last band is open-ended
+AMOUNT_BANDS = [float(v) for v in os.getenv("AMOUNT_BANDS", "10,100,500,1000,5000,10000,50000").split(",") if v.strip()]
+HEATMAP_AXES = ("weekday", "hour", "amount_band", "category")
+WEEKDAY_LABELS = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+
+def time_range_mask(hours, time_range: str):
+    """Day/night condition on an hour-of-day value; works on NumPy arrays and SQL expressions alike."""
+    if DAY_START_HOUR <= NIGHT_START_HOUR:
+        day = (hours >= DAY_START_HOUR) & (hours < NIGHT_START_HOUR)
+        night = (hours >= NIGHT_START_HOUR) | (hours < DAY_START_HOUR)
+    else:
+        day = (hours >= DAY_START_HOUR) | (hours < NIGHT_START_HOUR)
+        night = (hours >= NIGHT_START_HOUR) & (hours < DAY_START_HOUR)
+    return day if time_range == "day" else night
+
+def time_range_label(time_range: str):
+    start, end = (DAY_START_HOUR, NIGHT_START_HOUR) if time_range == "day" else (NIGHT_START_HOUR, DAY_START_HOUR)
+    return f"{start:02d}:00-{end:02d}:00"
+
+def amount_band_labels():
+    edges = [0.0] + AMOUNT_BANDS
+    labels = [f"{edges[i]:g}-{edges[i + 1]:g}" for i in range(len(AMOUNT_BANDS))]
+    return labels + [f"{AMOUNT_BANDS[-1]:g}+" if AMOUNT_BANDS else "全部"]
+
+def _code_dtype(size: int):
+    if size <= np.iinfo(np.int8).max:
+        return np.int8
+    if size <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+def _encode(values: list):
+    # Dictionary-encode a string column; None keeps its own code so it groups like SQL NULL
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+    labels = [None if (v is None or (isinstance(v, float) and np.isnan(v))) else str(v) for v in uniques]
+    return codes.astype(_code_dtype(len(labels))), labels
+
+def to_epoch_seconds(dt: datetime):
+    # Naive local times are stored as if they were UTC, so bucket arithmetic never sees DST
+    return int(np.datetime64(dt, "s").astype(np.int64))
+
+class SuspectFrame:
+    """Column arrays for one suspect's transactions, sorted by transaction_time."""
+
+    def __init__(self, suspect_id: int, data_version: int, rows: list):
+        self.suspect_id = suspect_id
+        self.data_version = data_version
+
+        ids, times, tx_types, categories, methods, amounts, counterparties, sources = (
+            list(zip(*rows)) if rows else ([], [], [], [], [], [], [], [])
+        )
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.times = np.asarray([NO_TIME if t is None else t for t in times], dtype=np.int64)
+        raw_amounts = np.asarray([np.nan if a is None else a for a in amounts], dtype=np.float64)
+        self.amounts = np.rint(np.nan_to_num(raw_amounts) * 100).astype(np.int64)
+        self.category_codes, self.categories = _encode(categories)
+        self.counterparty_codes, self.counterparties = _encode(counterparties)
+        self.type_codes, self.types = _encode(tx_types)
+        self.method_codes, self.methods = _encode(methods)
+        self.source_codes, self.sources = _encode(sources)
+        self.nbytes = self._estimate_nbytes()
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    def _estimate_nbytes(self):
+        arrays = (
+            self.ids, self.times, self.amounts, self.category_codes, self.counterparty_codes,
+            self.type_codes, self.method_codes, self.source_codes,
+        )
+        total = sum(a.nbytes for a in arrays)
+        for labels in (self.categories, self.counterparties, self.types, self.methods, self.sources):
+            # Rough per-entry cost of a short Python str plus its list slot
+            total += sum(len(v or "") * 4 + 57 for v in labels)
+        return total
+
+    @property
+    def has_time(self):
+        return self.times != NO_TIME
+
+    def code_of(self, labels: list, value):
+        try:
+            return labels.index(value)
+        except ValueError:
+            return -1
+
+    def codes_containing(self, labels: list, needle: str):
+        return [i for i, v in enumerate(labels) if v is not None and needle in v]
+
+    def category_mask(self, category: str):
+        return self.category_codes == self.code_of(self.categories, category)
+
+    def hours(self):
+        return (self.times // SECONDS_PER_HOUR) % 24
+
+    def build_mask(
+        self,
+        start: datetime = None,
+        end: datetime = None,
+        category: str = None,
+        specific_amount: float = None,
+        time_range: str = None,
+        counterparties: list = None,
+        transaction_type: str = None,
+        method: str = None,
+        min_amount: float = None,
+        max_amount: float = None,
+    ):
+        """Vectorized equivalent of the SQL filters; `end` is exclusive like parse_filter_time's."""
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None or end is not None or time_range in ("day", "night"):
+            mask &= self.has_time
+        if start is not None:
+            mask &= self.times >= to_epoch_seconds(start)
+        if end is not None:
+            mask &= self.times < to_epoch_seconds(end)
+        if category:
+            mask &= self.category_mask(category)
+        if specific_amount is not None:
+            mask &= self.amounts == int(round(specific_amount * 100))
+        if min_amount is not None:
+            mask &= self.amounts >= int(round(min_amount * 100))
+        if max_amount is not None:
+            mask &= self.amounts <= int(round(max_amount * 100))
+        if counterparties:
+            codes = [self.code_of(self.counterparties, c) for c in counterparties]
+            mask &= np.isin(self.counterparty_codes, codes)
+        if transaction_type:
+            mask &= np.isin(self.type_codes, self.codes_containing(self.types, transaction_type))
+        if method:
+            mask &= np.isin(self.method_codes, self.codes_containing(self.methods, method))
+        if time_range in ("day", "night"):
+            mask &= time_range_mask(self.hours(), time_range)
+        return mask
+
+    def axis_codes(self, axis: str):
+        """(codes, labels, valid rows) for one heatmap axis."""
+        if axis == "weekday":
+            # 1970-01-01 was a Thursday; shift so Monday is 0
+            return (self.times // SECONDS_PER_DAY + 3) % 7, WEEKDAY_LABELS, self.has_time
+        if axis == "hour":
+            return self.hours(), [f"{h:02d}" for h in range(24)], self.has_time
+        if axis == "amount_band":
+            edges = np.rint(np.asarray(AMOUNT_BANDS) * 100).astype(np.int64)
+            codes = np.searchsorted(edges, np.abs(self.amounts), side="right")
+            return codes, amount_band_labels(), np.ones(len(self), dtype=bool)
+        labels = sorted(v for v in self.categories if v is not None)
+        remap = np.array([labels.index(v) if v is not None else -1 for v in self.categories] or [-1], dtype=np.int64)
+        codes = remap[self.category_codes]
+        return codes, labels, codes >= 0
+
+    def heatmap(self, mask, x: str, y: str):
+        x_codes, x_labels, x_valid = self.axis_codes(x)
+        y_codes, y_labels, y_valid = self.axis_codes(y)
+        mask = mask & x_valid & y_valid
+        nx, ny = len(x_labels), len(y_labels)
+        cell = y_codes[mask].astype(np.int64) * nx + x_codes[mask]
+        counts = np.bincount(cell, minlength=nx * ny).reshape(ny, nx)
+        sums = np.bincount(cell, weights=self.amounts[mask], minlength=nx * ny).reshape(ny, nx)
+        return {
+            "x": {"axis": x, "labels": x_labels},
+            "y": {"axis": y, "labels": y_labels},
+            "count": counts.tolist(),
+            "amount": (np.round(sums) / 100).tolist(),
+        }
+
+    def facets(self, base_mask, filter_masks: dict):
+        """Value counts per facet; each dimension ignores its own filter so sibling values stay visible.
+
+        `filter_masks` maps a dimension name to the mask of the filter set on it, if any.
+        """
+        hours = np.where(self.has_time, self.hours(), 24)
+        dimensions = {
+            "category": (self.category_codes, self.categories),
+            "transaction_type": (self.type_codes, self.types),
+            "method": (self.method_codes, self.methods),
+            "source_file": (self.source_codes, self.sources),
+            # Slot 24 collects rows without a time and is dropped below
+            "hour": (hours, [f"{h:02d}" for h in range(25)]),
+        }
+        result = {}
+        for name, (codes, labels) in dimensions.items():
+            mask = base_mask
+            for other, other_mask in filter_masks.items():
+                if other != name:
+                    mask = mask & other_mask
+            selected = codes[mask]
+            counts = np.bincount(selected, minlength=len(labels))
+            sums = np.bincount(selected, weights=self.amounts[mask], minlength=len(labels))
+            if name == "hour":
+                counts[24] = 0
+            values = [
+                {"value": labels[i], "count": int(counts[i]), "amount": round(sums[i] / 100, 2)}
+                for i in np.flatnonzero(counts).tolist()
+            ]
+            if name != "hour":
+                values.sort(key=lambda v: -v["count"])
+            result[name] = values
+        return result
+
+    def summary(self, mask):
+        income = int(self.amounts[mask & self.category_mask(INCOME)].sum())
+        expense = int(self.amounts[mask & self.category_mask(EXPENSE)].sum())
+        return {"total_income": income / 100, "total_expense": expense / 100}
+
+    def by_counterparty(self, mask, limit: int, groups=None):
+        """`groups` is an optional (group index per counterparty code, group labels) pair, e.g. entities."""
+        codes = self.counterparty_codes[mask]
+        if codes.size == 0:
+            return []
+        labels = self.counterparties
+        if groups is not None:
+            group_of, labels = groups
+            codes = group_of[codes]
+        minlength = len(labels)
+        totals = np.bincount(codes, weights=self.amounts[mask], minlength=minlength)
+        present = np.bincount(codes, minlength=minlength) > 0
+        order = [i for i in np.argsort(-totals, kind="stable") if present[i]]
+        if limit is not None and limit >= 0:
+            order = order[:limit]
+        return [{"name": labels[i], "value": round(totals[i] / 100, 2)} for i in order]
+
+    def by_date(self, mask, bucket: str = "day", target_points: int = TREND_TARGET_POINTS):
+        mask = mask & self.has_time
+        times = self.times[mask]
+        if bucket == "auto":
+            bucket = choose_bucket(int(times.min()), int(times.max()), target_points) if times.size else "day"
+        cats = self.category_codes[mask]
+        amounts = self.amounts[mask]
+        income = np.where(cats == self.code_of(self.categories, INCOME), amounts, 0)
+        expense = np.where(cats == self.code_of(self.categories, EXPENSE), amounts, 0)
+        return trend_series(times, income, expense, bucket)
+
+def choose_bucket(min_ts: int, max_ts: int, target_points: int):
+    span = max(0, max_ts - min_ts)
+    target = max(1, target_points)
+    for bucket in BUCKETS:
+        if span // BUCKET_SECONDS[bucket] + 1 <= target:
+            return bucket
+    return "month"
+
+def bucket_keys(times, bucket: str):
+    """Integer bucket number for each epoch-second timestamp."""
+    days = times // SECONDS_PER_DAY
+    if bucket == "hour":
+        return times // SECONDS_PER_HOUR
+    if bucket == "week":
+        # 1970-01-01 was a Thursday; shift by 3 days so weeks start on Monday
+        return (days + 3) // 7
+    if bucket == "month":
+        return times.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+    return days
+
+def bucket_bounds(keys, bucket: str):
+    """Inclusive (start, end) filter strings per bucket, usable as start_date/end_date."""
+    if bucket == "hour":
+        starts = (keys * SECONDS_PER_HOUR).astype("datetime64[s]")
+        start_txt = np.datetime_as_string(starts, unit="m")
+        labels = [t.replace("T", " ") for t in start_txt.tolist()]
+        ends = [t[:-2] + "59" for t in labels]
+        return labels, labels, ends
+    if bucket == "week":
+        first = (keys * 7 - 3).astype("datetime64[D]")
+        starts = np.datetime_as_string(first, unit="D").tolist()
+        ends = np.datetime_as_string(first + np.timedelta64(6, "D"), unit="D").tolist()
+        return starts, starts, ends
+    if bucket == "month":
+        months = keys.astype("datetime64[M]")
+        labels = np.datetime_as_string(months, unit="M").tolist()
+        starts = np.datetime_as_string(months.astype("datetime64[D]"), unit="D").tolist()
+        ends = np.datetime_as_string((months + np.timedelta64(1, "M")).astype("datetime64[D]") - np.timedelta64(1, "D"), unit="D").tolist()
+        return labels, starts, ends
+    labels = np.datetime_as_string(keys.astype("datetime64[D]"), unit="D").tolist()
+    return labels, labels, labels
+
+def trend_series(times, income, expense, bucket: str):
+    """Sum income/expense cents per bucket; `times` may be row times or pre-grouped bucket starts."""
+    if times.size == 0:
+        return {"bucket": bucket, "dates": [], "income": [], "expense": [], "starts": [], "ends": []}
+    uniq, inverse = np.unique(bucket_keys(times, bucket), return_inverse=True)
+    income_sum = np.bincount(inverse, weights=income, minlength=uniq.size)
+    expense_sum = np.bincount(inverse, weights=expense, minlength=uniq.size)
+    labels, starts, ends = bucket_bounds(uniq, bucket)
+    return {
+        "bucket": bucket,
+        "dates": labels,
+        "income": [round(v / 100, 2) for v in income_sum.tolist()],
+        "expense": [round(v / 100, 2) for v in expense_sum.tolist()],
+        "starts": starts,
+        "ends": ends,
+    }
+
+def trend_from_grouped_rows(rows: list, unit: int, bucket: str):
+    """Build a trend series from SQL rows of (unit number, category, amount sum)."""
+    times = np.asarray([r[0] * unit for r in rows], dtype=np.int64)
+    cents = [round((r[2] or 0) * 100) for r in rows]
+    income = np.asarray([c if r[1] == INCOME else 0 for r, c in zip(rows, cents)], dtype=np.float64)
+    expense = np.asarray([c if r[1] == EXPENSE else 0 for r, c in zip(rows, cents)], dtype=np.float64)
+    return trend_series(times, income, expense, bucket)
+
+def aligned_trends(rows: list, unit: int, bucket: str, suspect_ids: list):
+    """Per-suspect series on one shared bucket axis, from SQL rows of (suspect, unit number, category, amount sum, count).
+
+    Every suspect gets a value for every bucket any of them has, so the curves line up point by point.
+    """
+    slot = {sid: i for i, sid in enumerate(suspect_ids)}
+    rows = [r for r in rows if r[0] in slot]
+    empty = {"bucket": bucket, "dates": [], "starts": [], "ends": [], "series": {}}
+    if not rows:
+        empty["series"] = {sid: {"income": [], "expense": [], "count": []} for sid in suspect_ids}
+        return empty
+    keys = bucket_keys(np.asarray([r[1] * unit for r in rows], dtype=np.int64), bucket)
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    n = uniq.size
+    cell = np.asarray([slot[r[0]] for r in rows], dtype=np.int64) * n + inverse
+    cents = np.asarray([round((r[3] or 0) * 100) for r in rows], dtype=np.float64)
+    is_income = np.asarray([r[2] == INCOME for r in rows])
+    is_expense = np.asarray([r[2] == EXPENSE for r in rows])
+    size = len(suspect_ids) * n
+    income = np.bincount(cell, weights=np.where(is_income, cents, 0), minlength=size).reshape(-1, n)
+    expense = np.bincount(cell, weights=np.where(is_expense, cents, 0), minlength=size).reshape(-1, n)
+    count = np.bincount(cell, weights=np.asarray([r[4] for r in rows], dtype=np.float64), minlength=size).reshape(-1, n)
+    labels, starts, ends = bucket_bounds(uniq, bucket)
+    return {
+        "bucket": bucket,
+        "dates": labels,
+        "starts": starts,
+        "ends": ends,
+        "series": {
+            sid: {
+                "income": np.round(income[i] / 100, 2).tolist(),
+                "expense": np.round(expense[i] / 100, 2).tolist(),
+                "count": count[i].astype(np.int64).tolist(),
+            }
+            for sid, i in slot.items()
+        },
+    }
+
+def lttb_indices(y, threshold: int):
+    """Largest-Triangle-Three-Buckets: indices of the points to keep (x is the point index)."""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        next_lo = hi
+        next_hi = min(int((i + 2) * every) + 1, n)
+        if i == threshold - 3:
+            next_lo, next_hi = n - 1, n
+        avg_x = (next_lo + next_hi - 1) / 2.0
+        avg_y = y[next_lo:next_hi].mean()
+        xs = np.arange(lo, hi)
+        areas = np.abs((a - avg_x) * (y[lo:hi] - y[a]) - (a - xs) * (avg_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        keep[i + 1] = a
+    return keep
+
+def downsample_series(series: dict, max_points: int):
+    """Apply LTTB on total volume so income and expense keep the same x positions."""
+    n = len(series["dates"])
+    if n <= max_points:
+        return series
+    volume = np.asarray(series["income"]) + np.asarray(series["expense"])
+    keep = lttb_indices(volume, max_points).tolist()
+    out = dict(series)
+    for key in ("dates", "income", "expense", "starts", "ends"):
+        out[key] = [series[key][i] for i in keep]
+    out["downsampled_from"] = n
+    return out
+
+def load_frame(db, suspect_id: int, data_version: int):
+    rows = (
+        db.query(
+            models.Transaction.id,
+            models.Transaction.transaction_ts,
+            models.Transaction.transaction_type,
+            models.Transaction.category,
+            models.Transaction.method,
+            models.Transaction.amount,
+            models.Transaction.counterparty,
+            models.Transaction.source_file,
+        )
+        .filter(models.Transaction.suspect_id == suspect_id)
+        .order_by(models.Transaction.transaction_ts, models.Transaction.id)
+        .all()
+    )
+    return SuspectFrame(suspect_id, data_version, rows)
+
+class FrameCache:
+    """LRU of SuspectFrame objects bounded by an approximate memory budget."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._frames: "OrderedDict[int, SuspectFrame]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: dict[int, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _build_lock(self, suspect_id: int):
+        with self._lock:
+            lock = self._build_locks.get(suspect_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._build_locks[suspect_id] = lock
+            return lock
+
+    def _lookup(self, suspect_id: int, data_version: int):
+        with self._lock:
+            frame = self._frames.get(suspect_id)
+            if frame is not None and frame.data_version == data_version:
+                self._frames.move_to_end(suspect_id)
+                self.hits += 1
+                return frame
+        return None
+
+    def get(self, db, suspect_id: int):
+        # Read the version before the rows: a concurrent insert then only causes a rebuild, never a stale hit
+        data_version = (
+            db.query(models.Suspect.data_version).filter(models.Suspect.id == suspect_id).scalar()
+        ) or 0
+        frame = self._lookup(suspect_id, data_version)
+        if frame is not None:
+            return frame
+
+        with self._build_lock(suspect_id):
+            frame = self._lookup(suspect_id, data_version)
+            if frame is not None:
+                return frame
+            frame = load_frame(db, suspect_id, data_version)
+            with self._lock:
+                self.misses += 1
+                self._frames[suspect_id] = frame
+                self._frames.move_to_end(suspect_id)
+                self._evict_unlocked()
+            return frame
+
+    def _evict_unlocked(self):
+        # Always keep the most recently used frame, even if it alone exceeds the budget
+        while len(self._frames) > 1 and self._used_unlocked() > self.budget_bytes:
+            self._frames.popitem(last=False)
+            self.evictions += 1
+
+    def _used_unlocked(self):
+        return sum(f.nbytes for f in self._frames.values())
+
+    def invalidate(self, suspect_id: int):
+        with self._lock:
+            self._frames.pop(suspect_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": len(self._frames),
+                "rows": sum(len(f) for f in self._frames.values()),
+                "used_bytes": self._used_unlocked(),
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class ResultCache:
+    """LRU of derived results keyed by (suspect, data version, request key)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, frame, key: tuple, compute):
+        return self.get_or_compute_version(frame.suspect_id, frame.data_version, key, compute)
+
+    def get_or_compute_version(self, suspect_id: int, data_version: int, key: tuple, compute):
+        """For results computed straight from SQL, without loading the suspect's frame."""
+        # Keying on data_version means changed data simply stops matching old entries
+        full_key = (suspect_id, data_version) + tuple(key)
+        with self._lock:
+            if full_key in self._entries:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return self._entries[full_key]
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            self._entries[full_key] = value
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, suspect_id: int):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == suspect_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+frame_cache = FrameCache(ANALYTICS_CACHE_MB * 1024 * 1024)
+result_cache = ResultCache(ANALYTICS_RESULT_CACHE_SIZE)
+
+def use_columnar(suspect_id) -> bool:
+    return bool(suspect_id) and ANALYTICS_ENGINE == "columnar"
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+from sqlalchemy import insert
+
+import analytics
+import models
+
+BURST_WINDOW_SECONDS = int(os.getenv("ANOMALY_BURST_WINDOW_SECONDS", "600"))
+BURST_MIN_COUNT = int(os.getenv("ANOMALY_BURST_MIN_COUNT", "5"))
+VOLUME_WINDOW_DAYS = int(os.getenv("ANOMALY_VOLUME_WINDOW_DAYS", "30"))
+# Hours counted as "dead of night" activity, [start, end)
+LATE_NIGHT_START_HOUR = int(os.getenv("ANOMALY_LATE_NIGHT_START_HOUR", "0"))
+LATE_NIGHT_END_HOUR = int(os.getenv("ANOMALY_LATE_NIGHT_END_HOUR", "5"))
+ROUND_AMOUNT_CENTS = 100 * 100
+Z_THRESHOLD = 3.0
+MIN_HISTORY_DAYS = 7
+
+FLAG_WEIGHTS = {
+    "large_amount": 25.0,
+    "burst": 20.0,
+    "volume_jump": 15.0,
+    "late_night": 15.0,
+    "new_counterparty": 15.0,
+    "round_amount": 10.0,
+}
+
+def _robust_z(values):
+    if values.size == 0:
+        return values.astype(np.float64)
+    median = np.median(values)
+    mad = np.median(np.abs(values - median)) * 1.4826
+    scale = mad if mad > 0 else (values.std() or 1.0)
+    return (values - median) / scale
+
+def _trailing_z(series, window: int, min_history: int):
+    """z-score of each point against the `window` points before it (not including itself)."""
+    n = series.size
+    csum = np.concatenate(([0.0], np.cumsum(series)))
+    csq = np.concatenate(([0.0], np.cumsum(series * series)))
+    idx = np.arange(n)
+    lo = np.maximum(0, idx - window)
+    count = idx - lo
+    total = csum[idx] - csum[lo]
+    total_sq = csq[idx] - csq[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / np.maximum(count, 1), 0.0)
+        var = np.where(count > 0, total_sq / np.maximum(count, 1) - mean * mean, 0.0)
+        std = np.sqrt(np.maximum(var, 0.0))
+        z = np.where((count >= min_history) & (std > 0), (series - mean) / np.where(std > 0, std, 1.0), 0.0)
+    return z
+
+def score_frame(frame):
+    """Return (per-transaction arrays, per-day arrays) for one SuspectFrame."""
+    valid = frame.has_time
+    ids = frame.ids[valid]
+    t = frame.times[valid]
+    cents = frame.amounts[valid]
+    cp = frame.counterparty_codes[valid]
+    n = t.size
+
+    flags = {name: np.zeros(n, dtype=bool) for name in FLAG_WEIGHTS}
+    if n == 0:
+        return {"ids": ids, "score": np.zeros(0), "flags": flags}, None
+
+    # Amount outliers on a log scale so a few huge transfers don't hide everything else
+    log_amount = np.log1p(np.abs(cents) / 100.0)
+    amount_z = _robust_z(log_amount)
+    flags["large_amount"] = amount_z >= Z_THRESHOLD
+
+    # Bursts: number of transactions within +/- window of each one (times are sorted)
+    window_count = np.searchsorted(t, t + BURST_WINDOW_SECONDS, side="right") - np.searchsorted(
+        t, t - BURST_WINDOW_SECONDS, side="left"
+    )
+    # Relative to the suspect's own baseline rate so busy merchants' accounts aren't all "bursts"
+    span = max(int(t[-1] - t[0]), 1)
+    expected = n * (2 * BURST_WINDOW_SECONDS) / span
+    burst_threshold = max(BURST_MIN_COUNT, expected + 4.0 * np.sqrt(expected))
+    flags["burst"] = window_count >= burst_threshold
+
+    flags["round_amount"] = (cents >= ROUND_AMOUNT_CENTS) & (cents % ROUND_AMOUNT_CENTS == 0)
+
+    hours = (t // analytics.SECONDS_PER_HOUR) % 24
+    flags["late_night"] = (hours >= LATE_NIGHT_START_HOUR) & (hours < LATE_NIGHT_END_HOUR)
+
+    # First appearance of each counterparty, once there is some history to compare against
+    _, first_idx = np.unique(cp, return_index=True)
+    first_seen = np.zeros(n, dtype=bool)
+    first_seen[first_idx] = True
+    blank_codes = [i for i, v in enumerate(frame.counterparties) if not (v or "").strip() or v.strip() == "/"]
+    if blank_codes:
+        first_seen &= ~np.isin(cp, blank_codes)
+    established = t >= t[0] + MIN_HISTORY_DAYS * analytics.SECONDS_PER_DAY
+    flags["new_counterparty"] = first_seen & established & (amount_z >= 1.0)
+
+    # Daily volume against the trailing window, on a dense calendar so quiet days count as zero
+    days = t // analytics.SECONDS_PER_DAY
+    day0 = int(days[0])
+    day_idx = days - day0
+    n_days = int(day_idx[-1]) + 1
+    volume = np.bincount(day_idx, weights=np.abs(cents) / 100.0, minlength=n_days)
+    tx_count = np.bincount(day_idx, minlength=n_days)
+    volume_z = _trailing_z(volume, VOLUME_WINDOW_DAYS, MIN_HISTORY_DAYS)
+    flags["volume_jump"] = volume_z[day_idx] >= Z_THRESHOLD
+
+    score = np.zeros(n, dtype=np.float64)
+    for name, weight in FLAG_WEIGHTS.items():
+        score += np.where(flags[name], weight, 0.0)
+    # Scale the large-amount contribution with how extreme it is
+    score += np.where(flags["large_amount"], np.minimum(15.0, 3.0 * (amount_z - Z_THRESHOLD)), 0.0)
+    score = np.minimum(score, 100.0)
+
+    active = tx_count > 0
+    round_count = np.bincount(day_idx, weights=flags["round_amount"], minlength=n_days)
+    burst_count = np.bincount(day_idx, weights=flags["burst"], minlength=n_days)
+    night_count = np.bincount(day_idx, weights=flags["late_night"], minlength=n_days)
+    day_score = np.bincount(day_idx, weights=score, minlength=n_days)
+    daily = {
+        "day": (np.arange(n_days)[active] + day0),
+        "tx_count": tx_count[active],
+        "volume": volume[active],
+        "volume_z": volume_z[active],
+        "round_ratio": round_count[active] / tx_count[active],
+        "burst_count": burst_count[active],
+        "night_count": night_count[active],
+        "score": day_score[active],
+    }
+    return {"ids": ids, "score": score, "flags": flags}, daily
+
+def score_suspect(db, suspect_id: int):
+    """Score the suspect's transactions and days; returns the rows for store_scores().
+
+    Only reads, so the scoring runs outside the writer and the write itself stays short.
+    """
+    frame = analytics.frame_cache.get(db, suspect_id)
+    per_tx, daily = score_frame(frame)
+
+    # Only flagged rows are stored; the index then pages straight through them
+    flagged = np.nonzero(per_tx["score"] > 0)[0]
+    names = list(FLAG_WEIGHTS)
+    # Encode the flag set as a bitmask so each distinct combination is joined into a string once
+    bits = np.zeros(per_tx["score"].size, dtype=np.int64)
+    for bit, name in enumerate(names):
+        bits |= per_tx["flags"][name].astype(np.int64) << bit
+    labels = {}
+    for mask in np.unique(bits[flagged]).tolist():
+        labels[mask] = ",".join(name for bit, name in enumerate(names) if mask >> bit & 1)
+    rows = [
+        {"transaction_pk": pk, "suspect_id": suspect_id, "score": round(score, 2), "flags": labels[mask]}
+        for pk, score, mask in zip(
+            per_tx["ids"][flagged].tolist(), per_tx["score"][flagged].tolist(), bits[flagged].tolist()
+        )
+    ]
+    day_rows = []
+    if daily is not None:
+        labels = np.datetime_as_string(daily["day"].astype("datetime64[D]"), unit="D").tolist()
+        day_rows = [
+            {
+                "suspect_id": suspect_id,
+                "day": labels[i],
+                "tx_count": int(daily["tx_count"][i]),
+                "volume": round(float(daily["volume"][i]), 2),
+                "volume_z": round(float(daily["volume_z"][i]), 3),
+                "round_ratio": round(float(daily["round_ratio"][i]), 4),
+                "burst_count": int(daily["burst_count"][i]),
+                "night_count": int(daily["night_count"][i]),
+                "score": round(float(daily["score"][i]), 2),
+            }
+            for i in range(len(labels))
+        ]
+    return {"data_version": frame.data_version, "scored": len(frame), "rows": rows, "day_rows": day_rows}
+
+def store_scores(db, suspect_id: int, scores: dict):
+    """Writer op: replace the suspect's stored scores with the output of score_suspect()."""
+    current = db.query(models.Suspect.data_version).filter(models.Suspect.id == suspect_id).scalar() or 0
+    if current != scores["data_version"]:
+        # Rows changed since scoring; the stage run that change queued stores fresh scores
+        return {"scored": scores["scored"], "flagged": len(scores["rows"]), "stale": True}
+    remove_suspect(db, suspect_id)
+    if scores["rows"]:
+        db.execute(insert(models.TransactionScore.__table__), scores["rows"])
+    if scores["day_rows"]:
+        db.execute(insert(models.DailyScore.__table__), scores["day_rows"])
+    db.query(models.Suspect).filter(models.Suspect.id == suspect_id).update(
+        {models.Suspect.anomaly_version: scores["data_version"]}, synchronize_session=False
+    )
+    return {"scored": scores["scored"], "flagged": len(scores["rows"])}
+
+def remove_suspect(db, suspect_id: int):
+    db.query(models.TransactionScore).filter(models.TransactionScore.suspect_id == suspect_id).delete(
+        synchronize_session=False
+    )
+    db.query(models.DailyScore).filter(models.DailyScore.suspect_id == suspect_id).delete(synchronize_session=False)
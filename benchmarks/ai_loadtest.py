@@ -0,0 +1,231 @@
+"""Load-test the AI analysis path against a stand-in Ollama server.
+
+Usage:
+    python benchmarks/ai_loadtest.py --requests 200 --clients 20 --distinct 10 \\
+        --latency 0.5 --token-rate 40 --tokens 80 --error-rate 0.05 --ai-concurrency 2
+
+Starts a fake Ollama (/api/generate, /api/ps) and the app on local ports, both against a
+scratch SQLite database in a temp directory, never bill_app.db. `--distinct` is the number of
+different date filters the requests cycle through, so it controls how many can be served by
+the cache or by joining a generation already in flight.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_analytics import _seed, _setup_env
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Just enough of Ollama's API: streamed NDJSON /api/generate and /api/ps."""
+
+    protocol_version = "HTTP/1.1"
+    model = "bench-model"
+    latency = 0.5
+    token_rate = 40.0
+    tokens = 80
+    error_rate = 0.0
+    rng = random.Random(7)
+    lock = threading.Lock()
+    generations = 0
+    warmups = 0
+    failures = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, event: dict):
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._send_json(200, {"models": [{"name": self.model, "model": self.model}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        cls = type(self)
+        if not payload.get("prompt"):
+            with cls.lock:
+                cls.warmups += 1
+            self._send_json(200, {"model": self.model, "response": "", "done": True})
+            return
+        with cls.lock:
+            cls.generations += 1
+            fail = cls.rng.random() < cls.error_rate
+            if fail:
+                cls.failures += 1
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            # Time to first token stands in for prompt evaluation
+            time.sleep(self.latency)
+            self._chunk({"model": self.model, "response": "<think>bench</think>\n\n", "done": False})
+            for i in range(self.tokens):
+                if fail and i == self.tokens // 2:
+                    self._chunk({"error": "fake generation failure"})
+                    break
+                self._chunk({"model": self.model, "response": f"字{i} ", "done": False})
+                time.sleep(1 / self.token_rate)
+            else:
+                self._chunk({"model": self.model, "response": "", "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The app closed the stream, which is how it cancels a generation
+            pass
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _percentile(samples, q: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def _ms(seconds):
+    return f"{seconds * 1000:>9.1f}ms" if seconds is not None else f"{'-':>11}"
+
+async def _drive(base_url: str, suspect_id: int, args):
+    import httpx
+
+    first_day = date(2021, 1, 1)
+    windows = [(first_day + timedelta(days=7 * k)).isoformat() for k in range(args.distinct)]
+    work: asyncio.Queue = asyncio.Queue()
+    for i in range(args.requests):
+        work.put_nowait(windows[i % len(windows)])
+    results = []
+
+    async def client_loop(http):
+        while not work.empty():
+            start_date = work.get_nowait()
+            t0 = time.perf_counter()
+            try:
+                resp = await http.get("/stats/ai-analysis", params={"suspect_id": suspect_id, "start_date": start_date})
+                ok = resp.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            results.append((ok, time.perf_counter() - t0))
+
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as http:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client_loop(http) for _ in range(args.clients)))
+        wall = time.perf_counter() - t0
+        stats = (await http.get("/api/admin/analytics/stats")).json()
+    return results, wall, stats
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--clients", type=int, default=20, help="concurrent HTTP clients")
+    ap.add_argument("--distinct", type=int, default=10, help="distinct date filters to cycle through")
+    ap.add_argument("--latency", type=float, default=0.5, help="fake time to first token, seconds")
+    ap.add_argument("--token-rate", type=float, default=40, help="fake tokens per second")
+    ap.add_argument("--tokens", type=int, default=80, help="fake tokens per answer")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of generations that fail midway")
+    ap.add_argument("--ai-concurrency", type=int, default=2, help="AI_CONCURRENCY for the app")
+    ap.add_argument("--read-timeout", type=float, default=120, help="OLLAMA_READ_TIMEOUT for the app")
+    ap.add_argument("--rows", type=int, default=20000)
+    args = ap.parse_args()
+
+    FakeOllama.latency = args.latency
+    FakeOllama.token_rate = args.token_rate
+    FakeOllama.tokens = args.tokens
+    FakeOllama.error_rate = args.error_rate
+    fake = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    fake.daemon_threads = True
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix="ai_loadtest_")
+    # The app reads these at import time
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{fake.server_address[1]}"
+    os.environ["OLLAMA_MODEL"] = FakeOllama.model
+    os.environ["OLLAMA_READ_TIMEOUT"] = str(args.read_timeout)
+    os.environ["OLLAMA_WARMUP_IDLE_SECONDS"] = "0"
+    os.environ["AI_CONCURRENCY"] = str(args.ai_concurrency)
+    os.environ["AI_BACKGROUND_ANALYSIS"] = "0"
+    _setup_env(workdir)
+
+    import uvicorn
+    import database
+    import models
+    import main as app_main
+
+    database.ensure_schema()
+    db = database.SessionLocal()
+    print(f"seeding {args.rows} rows into {workdir} ...")
+    suspect_id = _seed(db, models, args.rows)
+    db.close()
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app_main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    print(
+        f"{args.requests} requests from {args.clients} clients over {args.distinct} filters; "
+        f"fake model: {args.latency}s to first token, {args.token_rate} tok/s x {args.tokens}, "
+        f"error rate {args.error_rate}; AI_CONCURRENCY={args.ai_concurrency}"
+    )
+    results, wall, stats = asyncio.run(_drive(f"http://127.0.0.1:{port}", suspect_id, args))
+    server.should_exit = True
+    fake.shutdown()
+
+    ok = [latency for success, latency in results if success]
+    failed = len(results) - len(ok)
+    print(f"wall {wall:.2f}s, {len(results) / wall:.1f} req/s, {len(ok)} ok, {failed} failed")
+    print(f"{'latency':<12}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}")
+    for name, samples in (("ok", ok), ("all", [latency for _, latency in results])):
+        print(
+            f"{name:<12}{_ms(_percentile(samples, 0.5))}{_ms(_percentile(samples, 0.95))}"
+            f"{_ms(_percentile(samples, 0.99))}{_ms(max(samples) if samples else None)}"
+        )
+
+    wait = stats["ai_queue"]["wait"]["interactive"]
+    print(
+        f"queue wait: p50 {_ms(wait['p50_seconds']).strip()}, p95 {_ms(wait['p95_seconds']).strip()}, "
+        f"max {_ms(wait['max_seconds']).strip()} over {wait['samples']} generations"
+    )
+    cache = stats["ai_cache"]
+    lookups = cache["hits"] + cache["misses"]
+    flights = stats["ai_flights"]
+    print(
+        f"cache: {cache['hits']}/{lookups} hits ({cache['hits'] / lookups:.1%}); "
+        f"single-flight: {flights['started']} started, {flights['joined']} joined"
+        if lookups else "cache: no lookups"
+    )
+    print(
+        f"fake ollama: {FakeOllama.generations} generations, {FakeOllama.failures} failed, "
+        f"{FakeOllama.warmups} warm-ups"
+    )
+
+if __name__ == "__main__":
+    main()
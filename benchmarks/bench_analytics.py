@@ -0,0 +1,130 @@
+"""Compare the SQL and columnar stats paths on a synthetic suspect.
+
+Usage:
+    python benchmarks/bench_analytics.py --rows 200000 --repeat 20
+
+Runs against a scratch SQLite database in a temp directory, never bill_app.db.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+def _setup_env(workdir: str):
+    os.environ["BILL_APP_DB_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # main.py mounts ./static relative to the working directory
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+def _seed(db, models, rows: int):
+    suspect = models.Suspect(name="bench", password="bench")
+    db.add(suspect)
+    db.commit()
+
+    rng = random.Random(42)
+    counterparties = [f"对象{i}" for i in range(2000)] + ["美团", "滴滴出行", "超市", ""]
+    types = ["转账", "商户消费", "微信红包", "扫二维码付款", "零钱提现"]
+    methods = ["零钱", "银行卡", "零钱通", "信用卡"]
+    base = datetime(2021, 1, 1)
+    epoch = datetime(1970, 1, 1)
+    span_minutes = 3 * 365 * 24 * 60
+
+    batch = []
+    for i in range(rows):
+        tx_time = base + timedelta(minutes=rng.randrange(span_minutes))
+        batch.append(
+            {
+                "suspect_id": suspect.id,
+                "transaction_id": f"bench{i}",
+                "transaction_time": tx_time,
+                # bulk inserts skip the mapper hook that fills transaction_ts
+                "transaction_ts": int((tx_time - epoch).total_seconds()),
+                "transaction_type": rng.choice(types),
+                "category": rng.choice(["收入", "支出", "支出", "其他"]),
+                "method": rng.choice(methods),
+                "amount": round(rng.lognormvariate(4, 1.2), 2),
+                "counterparty": rng.choice(counterparties),
+                "merchant_id": "",
+                "source_file": f"bill_{i % 4}.pdf",
+            }
+        )
+        if len(batch) >= 20000:
+            db.bulk_insert_mappings(models.Transaction, batch)
+            db.commit()
+            batch = []
+    if batch:
+        db.bulk_insert_mappings(models.Transaction, batch)
+        db.commit()
+    return suspect.id
+
+def _time_calls(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), max(samples)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_analytics_")
+    _setup_env(workdir)
+
+    import database
+    import models
+    import analytics
+    import main as app_main
+
+    database.ensure_schema()
+    db = database.SessionLocal()
+    print(f"seeding {args.rows} rows into {workdir} ...")
+    suspect_id = _seed(db, models, args.rows)
+
+    t0 = time.perf_counter()
+    frame = analytics.frame_cache.get(db, suspect_id)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    # Separate build for the memory peak: tracemalloc slows allocation-heavy code down a lot
+    analytics.frame_cache.invalidate(suspect_id)
+    tracemalloc.start()
+    analytics.frame_cache.get(db, suspect_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"frame build: {build_ms:.1f} ms, resident {frame.nbytes / 1e6:.1f} MB, build peak {peak / 1e6:.1f} MB")
+
+    cases = {
+        "summary": lambda: app_main.get_summary(suspect_id=suspect_id, db=db),
+        "summary night+range": lambda: app_main.get_summary(
+            suspect_id=suspect_id, start_date="2022-01-01", end_date="2022-12-31", time_range="night", db=db
+        ),
+        "by-counterparty": lambda: app_main.get_stats_by_counterparty(limit=20, suspect_id=suspect_id, db=db),
+        "by-counterparty 收入": lambda: app_main.get_stats_by_counterparty(
+            limit=20, category="收入", suspect_id=suspect_id, db=db
+        ),
+        "by-date": lambda: app_main.get_stats_by_date(suspect_id=suspect_id, db=db),
+    }
+
+    print(f"{'case':<24}{'sql p50':>10}{'sql max':>10}{'col p50':>10}{'col max':>10}{'speedup':>10}")
+    for name, fn in cases.items():
+        analytics.ANALYTICS_ENGINE = "sql"
+        sql_p50, sql_max = _time_calls(fn, args.repeat)
+        analytics.ANALYTICS_ENGINE = "columnar"
+        col_p50, col_max = _time_calls(fn, args.repeat)
+        speedup = sql_p50 / col_p50 if col_p50 else float("inf")
+        print(f"{name:<24}{sql_p50:>9.1f}ms{sql_max:>8.1f}ms{col_p50:>8.1f}ms{col_max:>8.1f}ms{speedup:>9.1f}x")
+
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
-from sqlalchemy import create_engine, event
+import os
+
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./bill_app.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("BILL_APP_DB_URL", "sqlite:///./bill_app.db")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -17,8 +19,42 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The writer thread's own engine. It wraps each op in a SAVEPOINT, which pysqlite's implicit
+# transactions don't support (no BEGIN is sent before it), so transactions are begun explicitly
+writer_engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+
+@event.listens_for(writer_engine, "connect")
+def set_writer_pragma(dbapi_connection, connection_record):
+    set_sqlite_pragma(dbapi_connection, connection_record)
+    dbapi_connection.isolation_level = None
+
+@event.listens_for(writer_engine, "begin")
+def begin_immediate(conn):
+    # Take the write lock up front instead of upgrading from a read lock halfway through a batch
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+WriterSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=writer_engine)
+
 Base = declarative_base()
 
+def ensure_schema():
+    # create_all only creates missing tables, so bring existing databases up to date
+    # with columns and indexes that were added to the models later on.
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,117 @@
+import os
+from difflib import SequenceMatcher
+
+import numpy as np
+
+import entities
+import models
+
+# Text-fallback rows can be off by a little when the time column was split across cells
+DEDUP_TIME_TOLERANCE_SECONDS = int(os.getenv("DEDUP_TIME_TOLERANCE_SECONDS", "120"))
+DEDUP_MIN_SIMILARITY = float(os.getenv("DEDUP_MIN_SIMILARITY", "0.6"))
+SYNTHETIC_PREFIX = "synthetic_"
+
+def normalized_similarity(na, nb):
+    if not na or not nb:
+        # A blank side is common in text-fallback rows; it neither confirms nor rules out
+        return 1.0 if na == nb else 0.5
+    if na == nb:
+        return 1.0
+    if na.startswith(nb) or nb.startswith(na) or entities.mask_compatible(na, nb) or entities.mask_compatible(nb, na):
+        return 0.9
+    return SequenceMatcher(None, na, nb).ratio()
+
+def synthetic_ids(db, suspect_id: int):
+    rows = db.query(models.Transaction.id).filter(
+        models.Transaction.suspect_id == suspect_id,
+        models.Transaction.transaction_id.like(f"{SYNTHETIC_PREFIX}%"),
+    )
+    return np.fromiter((r[0] for r in rows), dtype=np.int64)
+
+def find_duplicates(frame, synthetic_pks, tolerance: int = DEDUP_TIME_TOLERANCE_SECONDS, min_similarity: float = DEDUP_MIN_SIMILARITY):
+    """Pairs (kept row, duplicate row, similarity) across different source files.
+
+    A pair needs at least one synthetic-ID side: two real WeChat IDs are never the same payment.
+    Rows are sorted by (amount, 收/支, time) so every synthetic row's candidates are one
+    contiguous slice found by binary search: O(n log n) plus the size of those slices.
+    """
+    synthetic = np.isin(frame.ids, synthetic_pks)
+    if not synthetic.any():
+        return []
+
+    idx = np.flatnonzero(frame.has_time)
+    if idx.size == 0:
+        return []
+    order = idx[np.lexsort((frame.times[idx], frame.category_codes[idx], frame.amounts[idx]))]
+    amounts = frame.amounts[order]
+    cats = frame.category_codes[order].astype(np.int64)
+    times = frame.times[order]
+    # Dense id per (amount, category) run, folded into one sortable key together with time
+    new_group = np.concatenate(([True], (amounts[1:] != amounts[:-1]) | (cats[1:] != cats[:-1])))
+    group = np.cumsum(new_group) - 1
+    span = int(times.max() - times.min()) + 2 * tolerance + 1
+    key = group * span + (times - times.min())
+
+    probe = np.flatnonzero(synthetic[order])
+    lo = np.searchsorted(key, key[probe] - tolerance, side="left")
+    hi = np.searchsorted(key, key[probe] + tolerance, side="right")
+
+    sources = frame.source_codes[order].tolist()
+    is_synth = synthetic[order].tolist()
+    cp_codes = frame.counterparty_codes[order].tolist()
+    norms = [entities.normalize_name(v) for v in frame.counterparties]
+    similarity = {}
+    candidates = []
+    for p, a, b in zip(probe.tolist(), lo.tolist(), hi.tolist()):
+        for q in range(a, b):
+            if q == p or sources[q] == sources[p]:
+                continue
+            # Pairs of two synthetic rows are seen from both ends; keep one
+            if is_synth[q] and q < p:
+                continue
+            codes = (cp_codes[p], cp_codes[q])
+            sim = similarity.get(codes)
+            if sim is None:
+                sim = similarity[codes] = normalized_similarity(norms[codes[0]], norms[codes[1]])
+            if sim >= min_similarity:
+                candidates.append((sim, abs(int(times[q] - times[p])), p, q))
+
+    # One-to-one: best similarity first, then closest in time
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2], c[3]))
+    used = set()
+    pairs = []
+    for sim, _, p, q in candidates:
+        if p in used or q in used:
+            continue
+        used.update((p, q))
+        # p is always synthetic: keep q if it has a real ID, else whichever row was inserted first
+        if is_synth[q] and frame.ids[order[p]] < frame.ids[order[q]]:
+            keep, drop = order[p], order[q]
+        else:
+            keep, drop = order[q], order[p]
+        pairs.append((int(keep), int(drop), round(sim, 3)))
+    return pairs
+
+def _row(frame, i: int):
+    return {
+        "id": int(frame.ids[i]),
+        "time": str(np.datetime64(int(frame.times[i]), "s")).replace("T", " "),
+        "amount": int(frame.amounts[i]) / 100,
+        "category": frame.categories[frame.category_codes[i]],
+        "counterparty": frame.counterparties[frame.counterparty_codes[i]],
+        "source_file": frame.sources[frame.source_codes[i]],
+    }
+
+def duplicates_report(frame, synthetic_pks):
+    pairs = find_duplicates(frame, synthetic_pks)
+    items = [
+        {"keep": _row(frame, keep), "duplicate": _row(frame, drop), "similarity": sim}
+        for keep, drop, sim in pairs
+    ]
+    items.sort(key=lambda item: item["duplicate"]["time"], reverse=True)
+    return {
+        "total": len(items),
+        "duplicate_amount": round(sum(item["duplicate"]["amount"] for item in items), 2),
+        "duplicate_ids": [item["duplicate"]["id"] for item in items],
+        "pairs": items,
+    }
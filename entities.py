@@ -0,0 +1,263 @@
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import func, insert, select
+
+import linkage
+import models
+
+# Blocks bigger than this come from very common keys (e.g. the "有限" bigram); comparing inside them
+# would drift towards all-pairs, so they are skipped
+BLOCK_MAX = 200
+NGRAM_JACCARD = 0.8
+# Names up to this length are treated as person names: only exact or mask-compatible matches
+PERSON_NAME_MAX_LEN = 4
+MERCHANT_SUFFIXES = (
+    "股份有限公司", "有限责任公司", "有限公司", "分公司", "公司", "个体工商户", "个体户",
+    "旗舰店", "专营店", "专卖店", "经营部", "商行", "商户", "门店", "店",
+)
+
+def normalize_name(raw):
+    """Canonical form used for matching; returns "" for placeholders like "/"."""
+    if not linkage.normalize_counterparty(raw):
+        return ""
+    s = unicodedata.normalize("NFKC", str(raw))
+    s = re.sub(r"\s+", "", s)
+    # WeChat shows transfers as "昵称(**实名)"; keep the nickname, fall back to the bracket content
+    m = re.match(r"^(.*?)[(（\[【](.*?)[)）\]】]$", s)
+    if m:
+        s = m.group(1) or m.group(2)
+    s = s.lower()
+    stripped = True
+    while stripped:
+        stripped = False
+        s = s.rstrip("-_·.、,")
+        for suffix in MERCHANT_SUFFIXES:
+            if len(s) > len(suffix) + 1 and s.endswith(suffix):
+                s = s[: -len(suffix)]
+                stripped = True
+                break
+    return s
+
+def _bigrams(s):
+    return {s[i : i + 2] for i in range(len(s) - 1) if "*" not in s[i : i + 2]}
+
+def blocking_keys(norm):
+    keys = []
+    n = len(norm)
+    if n <= PERSON_NAME_MAX_LEN:
+        # Masked person names keep either the surname or the last character
+        if norm[0] != "*":
+            keys.append(("first", n, norm[0]))
+        if norm[-1] != "*":
+            keys.append(("last", n, norm[-1]))
+    if n >= PERSON_NAME_MAX_LEN:
+        keys.extend(("gram", g) for g in _bigrams(norm))
+    return keys
+
+def mask_compatible(masked, plain):
+    if len(masked) != len(plain) or "*" in plain:
+        return False
+    shown = [(a, b) for a, b in zip(masked, plain) if a != "*"]
+    return bool(shown) and all(a == b for a, b in shown)
+
+def similar_plain(a, b, ga=None, gb=None):
+    if min(len(a), len(b)) < PERSON_NAME_MAX_LEN:
+        return False
+    if a in b or b in a:
+        return True
+    ga = _bigrams(a) if ga is None else ga
+    gb = _bigrams(b) if gb is None else gb
+    return bool(ga and gb) and len(ga & gb) / len(ga | gb) >= NGRAM_JACCARD
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # Keep the older (smaller) id so existing entity ids stay stable
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+def _representative(pairs):
+    # Prefer an unmasked spelling, then the shortest (least decorated) one
+    return min(pairs, key=lambda p: ("*" in p[1], len(p[0]), p[0]))[0]
+
+def resolve_new(db, suspect_id: int):
+    """Writer op: assign entity ids to this suspect's counterparty names that have none yet.
+
+    Only the new names are compared, and only against names sharing a blocking key with them.
+    New ids continue from the largest one in use, so runs must not overlap; the writer
+    serializes them.
+    """
+    mapping = models.CounterpartyEntity
+    known = {
+        r.raw_name: r
+        for r in db.query(mapping).filter(mapping.suspect_id == suspect_id).all()
+    }
+    mapped = select(mapping.raw_name).where(mapping.suspect_id == suspect_id)
+    new_raw = [
+        r[0]
+        for r in db.query(models.Transaction.counterparty)
+        .filter(models.Transaction.suspect_id == suspect_id, models.Transaction.counterparty.notin_(mapped))
+        .distinct()
+        .all()
+    ]
+    new_norms = [(r, normalize_name(r)) for r in new_raw if r is not None]
+    new_norms = [(r, n) for r, n in new_norms if n]
+    if not new_norms:
+        return {"new_names": 0, "entities_touched": 0}
+
+    next_id = (db.query(func.max(mapping.entity_id)).scalar() or 0) + 1
+    records = []  # (raw, norm, entity id before this run)
+    for raw, row in known.items():
+        records.append((raw, normalize_name(raw), row.entity_id))
+    first_new = len(records)
+    for raw, norm in new_norms:
+        records.append((raw, norm, next_id))
+        next_id += 1
+
+    by_norm = defaultdict(list)
+    blocks = defaultdict(list)
+    masked_blocks = defaultdict(list)
+    grams = []
+    for i, (_, norm, _) in enumerate(records):
+        grams.append(_bigrams(norm))
+        if not norm:
+            continue
+        by_norm[norm].append(i)
+        for key in blocking_keys(norm):
+            blocks[key].append(i)
+            if "*" in norm:
+                masked_blocks[key].append(i)
+
+    uf = _UnionFind()
+    for _, _, eid in records:
+        uf.find(eid)
+
+    def usable_blocks(i):
+        return [key for key in blocking_keys(records[i][1]) if len(blocks[key]) <= BLOCK_MAX]
+
+    masked_to_check = set()
+    for i in range(first_new, len(records)):
+        _, norm, eid = records[i]
+        for j in by_norm[norm]:
+            uf.union(eid, records[j][2])
+        if "*" in norm:
+            masked_to_check.add(i)
+            continue
+        keys = usable_blocks(i)
+        for key in keys:
+            masked_to_check.update(masked_blocks[key])
+        if len(norm) < PERSON_NAME_MAX_LEN:
+            continue
+
+        # Existing shorter names contained in this one: exact lookups of its substrings
+        for length in range(PERSON_NAME_MAX_LEN, len(norm)):
+            for start in range(len(norm) - length + 1):
+                for j in by_norm.get(norm[start : start + length], ()):
+                    uf.union(eid, records[j][2])
+
+        # Prefix filter: a name at Jaccard >= NGRAM_JACCARD with this one, or containing it, shares
+        # at least one of its rarest len - ceil(NGRAM_JACCARD * len) + 1 bigrams
+        ordered = sorted(grams[i], key=lambda g: (len(blocks[("gram", g)]), g))
+        probe = ordered[: len(ordered) - math.ceil(NGRAM_JACCARD * len(ordered)) + 1]
+        seen = set()
+        for g in probe:
+            members = blocks[("gram", g)]
+            if len(members) > BLOCK_MAX:
+                continue
+            for j in members:
+                # Pairs of new names are handled when the later one probes
+                if j in seen or j == i or (j > i and j >= first_new):
+                    continue
+                seen.add(j)
+                if similar_plain(norm, records[j][1], grams[i], grams[j]):
+                    uf.union(eid, records[j][2])
+
+    # A masked name is linked only when exactly one entity could be behind it ("张*" with both
+    # "张三" and "张四" around stays on its own), and never away from an entity it already shares
+    # with an unmasked spelling
+    plain_roots = {uf.find(eid) for _, norm, eid in records if norm and "*" not in norm}
+    for i in masked_to_check:
+        _, norm, eid = records[i]
+        root = uf.find(eid)
+        if root in plain_roots:
+            continue
+        matches = {
+            uf.find(records[j][2])
+            for key in usable_blocks(i)
+            for j in blocks[key]
+            if mask_compatible(norm, records[j][1])
+        }
+        matches.discard(root)
+        if len(matches) == 1:
+            uf.union(eid, matches.pop())
+
+    members = defaultdict(list)
+    for raw, norm, eid in records:
+        members[uf.find(eid)].append((raw, norm))
+    names = {root: _representative(pairs) for root, pairs in members.items()}
+
+    touched = set()
+    new_rows = []
+    for i, (raw, _, eid) in enumerate(records):
+        root = uf.find(eid)
+        name = names[root]
+        if i >= first_new:
+            new_rows.append({"suspect_id": suspect_id, "raw_name": raw, "entity_id": root, "entity_name": name})
+            touched.add(root)
+        else:
+            row = known[raw]
+            if row.entity_id != root or row.entity_name != name:
+                row.entity_id = root
+                row.entity_name = name
+                touched.add(root)
+    db.execute(insert(mapping.__table__), new_rows)
+    return {"new_names": len(new_norms), "entities_touched": len(touched)}
+
+def remove_suspect(db, suspect_id: int):
+    db.query(models.CounterpartyEntity).filter(models.CounterpartyEntity.suspect_id == suspect_id).delete(
+        synchronize_session=False
+    )
+
+def unbuilt_suspects(db):
+    # resolve_new() is a no-op for suspects with every name mapped, so this is simply all of them
+    return [r[0] for r in db.query(models.Transaction.suspect_id).distinct().all()]
+
+def entity_map(db, suspect_id: int):
+    """raw counterparty name -> (entity_id, entity_name)"""
+    mapping = models.CounterpartyEntity
+    return {
+        raw: (eid, name)
+        for raw, eid, name in db.query(mapping.raw_name, mapping.entity_id, mapping.entity_name).filter(
+            mapping.suspect_id == suspect_id
+        )
+    }
+
+def frame_groups(frame, emap):
+    """Map a SuspectFrame's counterparty codes onto entities for SuspectFrame.by_counterparty."""
+    group_of = np.empty(len(frame.counterparties), dtype=np.int64)
+    labels = []
+    index = {}
+    for code, raw in enumerate(frame.counterparties):
+        eid, name = emap.get(raw, (None, raw))
+        key = eid if eid is not None else ("raw", raw)
+        if key not in index:
+            index[key] = len(labels)
+            labels.append(name)
+        group_of[code] = index[key]
+    return group_of, labels
@@ -0,0 +1,214 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+import models
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXPORT_HEADERS = ["交易单号", "交易时间", "交易类型", "收/支/其他", "交易方式", "金额(元)", "交易对方", "商户单号", "来源文件"]
+
+EXPORT_COLUMNS = (
+    models.Transaction.transaction_id,
+    models.Transaction.transaction_time,
+    models.Transaction.transaction_type,
+    models.Transaction.category,
+    models.Transaction.method,
+    models.Transaction.amount,
+    models.Transaction.counterparty,
+    models.Transaction.merchant_id,
+    models.Transaction.source_file,
+)
+
+# Rows fetched from the cursor per round trip; also the interval the output is flushed at
+EXPORT_BATCH_SIZE = 1000
+
+# Spreadsheet apps treat text starting with these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# Control characters XML 1.0 doesn't allow, even escaped
+_XML_ILLEGAL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_SHEET_NAME = "交易明细"
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{_XLSX_SHEET_NAME}" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        "</Relationships>"
+    ),
+    # Cell formats referenced by the s attribute: 0 default, 1 date-time, 2 amount (built-in "#,##0.00")
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        "</cellXfs>"
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        "</styleSheet>"
+    ),
+}
+_XLSX_DATE_STYLE = 1
+_XLSX_AMOUNT_STYLE = 2
+# Widths (in characters) so dates and long ids aren't shown as ####
+_XLSX_COLUMN_WIDTHS = (34, 20, 14, 10, 16, 14, 24, 34, 24)
+# Excel stores times as days since this epoch (it counts the non-existent 1900-02-29)
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+def content_disposition(filename: str):
+    # Suspect names are usually Chinese, so send an ASCII fallback plus the RFC 5987 form
+    ascii_name = filename.encode("ascii", errors="ignore").decode("ascii").strip() or "export"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+def _format_row(row):
+    values = list(row)
+    tx_time = values[1]
+    if isinstance(tx_time, datetime):
+        values[1] = tx_time.strftime("%Y-%m-%d %H:%M:%S")
+    return ["" if v is None else v for v in values]
+
+def _csv_safe(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the UTF-8 file with the right encoding
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_HEADERS)
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    pending = 0
+    for row in rows:
+        writer.writerow([_csv_safe(v) for v in _format_row(row)])
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    if pending:
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable file that hands out what was written to it; zipfile then streams its entries."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _xlsx_row(values, styles=()):
+    cells = []
+    for i, v in enumerate(values):
+        style = styles[i] if i < len(styles) else None
+        if isinstance(v, datetime):
+            serial = (v - _EXCEL_EPOCH).total_seconds() / 86400
+            cells.append(f'<c s="{_XLSX_DATE_STYLE}"><v>{serial!r}</v></c>')
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            cells.append(f'<c s="{style}"><v>{v}</v></c>' if style else f"<c><v>{v}</v></c>")
+        else:
+            # Inline strings are never evaluated, so no formula escaping is needed here
+            text = escape(_XML_ILLEGAL.sub("", str(v)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return "<row>" + "".join(cells) + "</row>"
+
+def iter_xlsx(rows):
+    # The workbook is written part by part into a zip on an unseekable sink, so bytes go out
+    # every EXPORT_BATCH_SIZE rows instead of after the whole file is built
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_PARTS.items():
+            zf.writestr(name, xml)
+        yield sink.take()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            cols = "".join(
+                f'<col min="{i}" max="{i}" width="{w}" customWidth="1"/>' for i, w in enumerate(_XLSX_COLUMN_WIDTHS, 1)
+            )
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                + f"<cols>{cols}</cols><sheetData>".encode("utf-8")
+            )
+            sheet.write(_xlsx_row(EXPORT_HEADERS).encode("utf-8"))
+            # Times stay datetimes here so they are written as real dates, not text
+            styles = (None, None, None, None, None, _XLSX_AMOUNT_STYLE)
+            pending = []
+            for row in rows:
+                pending.append(_xlsx_row(["" if v is None else v for v in row], styles))
+                if len(pending) >= EXPORT_BATCH_SIZE:
+                    sheet.write("".join(pending).encode("utf-8"))
+                    pending.clear()
+                    # Empty while the compressor is still buffering
+                    data = sink.take()
+                    if data:
+                        yield data
+            sheet.write("".join(pending).encode("utf-8") + b"</sheetData></worksheet>")
+    yield sink.take()
+
+def stream_export(fmt: str, rows):
+    if fmt == "xlsx":
+        return iter_xlsx(rows)
+    return iter_csv(rows)
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+from sqlalchemy import and_, case, func, true
+
+import analytics
+import anomaly
+import linkage
+import models
+
+# Transactions at or above this amount (yuan) count as large in the AI prompt
+AI_LARGE_AMOUNT = float(os.getenv("AI_LARGE_AMOUNT", "5000"))
+TOP_COUNTERPARTIES = 10
+
+# Per-counterparty columns both extractors produce, amounts in yuan
+COLUMNS = (
+    "count", "total", "income", "expense",
+    "day_income", "day_expense", "night_income", "night_expense",
+    "timed_count", "night_count", "large_count", "large_total",
+)
+
+def frame_columns(frame, mask):
+    """Per-counterparty aggregates of the masked rows, plus each counterparty's first time over all rows."""
+    n = len(frame.counterparties)
+    codes = frame.counterparty_codes[mask]
+    cents = frame.amounts[mask]
+    cats = frame.category_codes[mask]
+    timed = frame.has_time[mask]
+    hours = frame.hours()[mask]
+    income = cats == frame.code_of(frame.categories, analytics.INCOME)
+    expense = cats == frame.code_of(frame.categories, analytics.EXPENSE)
+    day = timed & analytics.time_range_mask(hours, "day")
+    night = timed & analytics.time_range_mask(hours, "night")
+    large = np.abs(cents) >= int(round(AI_LARGE_AMOUNT * 100))
+
+    def total(weights):
+        return np.bincount(codes, weights=weights, minlength=n)
+
+    yuan = cents / 100.0
+    cols = {
+        "count": np.bincount(codes, minlength=n),
+        "total": total(yuan),
+        "income": total(yuan * income),
+        "expense": total(yuan * expense),
+        "day_income": total(yuan * (day & income)),
+        "day_expense": total(yuan * (day & expense)),
+        "night_income": total(yuan * (night & income)),
+        "night_expense": total(yuan * (night & expense)),
+        "timed_count": total(timed),
+        "night_count": total(night),
+        "large_count": total(large),
+        "large_total": total(np.abs(yuan) * large),
+    }
+    # Frame rows are time-sorted, so the first occurrence of a code is its first transaction
+    first_ts = np.full(n, analytics.NO_TIME, dtype=np.int64)
+    timed_all = frame.has_time
+    uniq, first_idx = np.unique(frame.counterparty_codes[timed_all], return_index=True)
+    first_ts[uniq] = frame.times[timed_all][first_idx]
+    return list(frame.counterparties), cols, first_ts
+
+def sql_columns(db, suspect_id: int, window=None):
+    """Same as frame_columns from one grouped scan; `window` is the filter as a SQL condition.
+
+    The window goes into the CASE expressions instead of WHERE so that the same scan also sees
+    each counterparty's first transaction before the window.
+    """
+    tx = models.Transaction
+    ts = tx.transaction_ts
+    in_window = window if window is not None else true()
+    hour = (ts // analytics.SECONDS_PER_HOUR) % 24
+    day = and_(ts.isnot(None), analytics.time_range_mask(hour, "day"))
+    night = and_(ts.isnot(None), analytics.time_range_mask(hour, "night"))
+    income = tx.category == analytics.INCOME
+    expense = tx.category == analytics.EXPENSE
+    large = func.abs(tx.amount) >= AI_LARGE_AMOUNT
+
+    def when(cond, value):
+        return func.sum(case((and_(in_window, cond), value), else_=0))
+
+    aggregates = (
+        when(true(), 1),
+        when(true(), tx.amount),
+        when(income, tx.amount),
+        when(expense, tx.amount),
+        when(and_(day, income), tx.amount),
+        when(and_(day, expense), tx.amount),
+        when(and_(night, income), tx.amount),
+        when(and_(night, expense), tx.amount),
+        when(ts.isnot(None), 1),
+        when(night, 1),
+        when(large, 1),
+        when(large, func.abs(tx.amount)),
+    )
+    rows = (
+        db.query(tx.counterparty, func.min(ts), *aggregates)
+        .filter(tx.suspect_id == suspect_id)
+        .group_by(tx.counterparty)
+        .all()
+    )
+    names = [r[0] for r in rows]
+    first_ts = np.array([r[1] if r[1] is not None else analytics.NO_TIME for r in rows], dtype=np.int64)
+    cols = {
+        name: np.array([float(r[2 + i] or 0) for r in rows], dtype=np.float64)
+        for i, name in enumerate(COLUMNS)
+    }
+    return names, cols, first_ts
+
+def summarize(names, cols, first_ts, window_start_ts=None):
+    """Prompt features from per-counterparty columns."""
+    active = cols["count"] > 0
+    if not active.any():
+        return None
+    named = np.array([bool(linkage.normalize_counterparty(v)) for v in names], dtype=bool) & active
+
+    # "New" = first seen inside the window, and not merely because history starts there
+    timed_first = first_ts[first_ts != analytics.NO_TIME]
+    history_start = int(timed_first.min()) if timed_first.size else 0
+    new_after = history_start + anomaly.MIN_HISTORY_DAYS * analytics.SECONDS_PER_DAY
+    if window_start_ts is not None:
+        new_after = max(new_after, window_start_ts)
+    new = named & (first_ts != analytics.NO_TIME) & (first_ts >= new_after)
+
+    def s(name, where=active):
+        return float(cols[name][where].sum())
+
+    order = [i for i in np.argsort(-cols["total"], kind="stable") if named[i]][:TOP_COUNTERPARTIES]
+    timed = s("timed_count")
+    counterparty_count = int(named.sum())
+    return {
+        "tx_count": int(s("count")),
+        "counterparty_count": counterparty_count,
+        "total_income": round(s("income"), 2),
+        "total_expense": round(s("expense"), 2),
+        "day_income": round(s("day_income"), 2),
+        "day_expense": round(s("day_expense"), 2),
+        "night_income": round(s("night_income"), 2),
+        "night_expense": round(s("night_expense"), 2),
+        "night_ratio": round(s("night_count") / timed, 4) if timed else 0.0,
+        "large_threshold": AI_LARGE_AMOUNT,
+        "large_count": int(s("large_count")),
+        "large_total": round(s("large_total"), 2),
+        "new_counterparty_count": int(new.sum()),
+        "new_counterparty_rate": round(int(new.sum()) / counterparty_count, 4) if counterparty_count else 0.0,
+        "top_counterparties": [
+            {"name": names[i], "total": round(float(cols["total"][i]), 2), "count": int(cols["count"][i])}
+            for i in order
+        ],
+    }
@@ -0,0 +1,139 @@
+import numpy as np
+
+import analytics
+
+DEFAULT_WINDOW_MINUTES = 30
+DEFAULT_TOLERANCE = 0.05
+DEFAULT_MIN_AMOUNT = 100.0
+
+def _time_label(ts: int):
+    return str(np.datetime64(int(ts), "s")).replace("T", " ")
+
+def find_pass_through(frame, window_minutes: int, tolerance: float, min_amount: float):
+    """Match each 收入 with the earliest unmatched 支出 of similar size that follows within the window.
+
+    Inflows are swept in time order; since their windows only move forward, the outflows inside
+    the current window are kept in a min-segment-tree over amount rank holding outflow positions.
+    "Earliest outflow with amount in [low, high]" is then one range-min query, and a match is
+    popped by clearing its leaf: O(n log n) overall, whatever the windows contain.
+    """
+    valid = frame.has_time
+    income_mask = valid & frame.category_mask(analytics.INCOME)
+    expense_mask = valid & frame.category_mask(analytics.EXPENSE)
+    min_cents = int(round(min_amount * 100))
+    income_mask &= frame.amounts >= min_cents
+
+    in_idx = np.nonzero(income_mask)[0]
+    out_idx = np.nonzero(expense_mask)[0]
+    if in_idx.size == 0 or out_idx.size == 0:
+        return []
+
+    out_t = frame.times[out_idx]
+    out_amt = frame.amounts[out_idx]
+    window = int(window_minutes) * 60
+    lo = np.searchsorted(out_t, frame.times[in_idx], side="left")
+    hi = np.searchsorted(out_t, frame.times[in_idx] + window, side="right")
+    in_amt = frame.amounts[in_idx]
+    low_bound = np.floor(in_amt * (1 - tolerance)).astype(np.int64)
+    high_bound = np.ceil(in_amt * (1 + tolerance)).astype(np.int64)
+
+    # Leaf of every outflow in amount order, and each inflow's acceptable amounts as a leaf range
+    by_amount = np.lexsort((np.arange(out_amt.size), out_amt))
+    leaf_of = np.empty(out_amt.size, dtype=np.int64)
+    leaf_of[by_amount] = np.arange(out_amt.size)
+    sorted_amt = out_amt[by_amount]
+    first_leaf = np.searchsorted(sorted_amt, low_bound, side="left")
+    last_leaf = np.searchsorted(sorted_amt, high_bound, side="right")
+
+    # Plain lists: the tree is walked a few entries at a time, where NumPy indexing is slow
+    lo, hi = lo.tolist(), hi.tolist()
+    first_leaf, last_leaf = first_leaf.tolist(), last_leaf.tolist()
+    in_rows, out_rows = in_idx.tolist(), out_idx.tolist()
+    size = 1 << max(0, (out_amt.size - 1).bit_length())
+    leaf_of = [leaf + size for leaf in leaf_of.tolist()]
+    empty = len(out_rows)
+    tree = [empty] * (2 * size)
+
+    def insert(node, value):
+        # Outflows enter in position order, so a new one only lowers ancestors whose subtree was empty
+        while node and tree[node] > value:
+            tree[node] = value
+            node >>= 1
+
+    def pop(node):
+        tree[node] = empty
+        node >>= 1
+        while node:
+            left, right = tree[2 * node], tree[2 * node + 1]
+            value = left if left < right else right
+            if tree[node] == value:
+                break
+            tree[node] = value
+            node >>= 1
+
+    added = removed = 0
+    chains = []
+    for k in range(len(in_rows)):
+        while added < hi[k]:
+            insert(leaf_of[added], added)
+            added += 1
+        # Outflows before this inflow can't match it or any later one
+        while removed < lo[k]:
+            if tree[leaf_of[removed]] != empty:
+                pop(leaf_of[removed])
+            removed += 1
+        left, right = first_leaf[k] + size, last_leaf[k] + size
+        if removed >= added or left >= right:
+            continue
+        best = empty
+        while left < right:
+            if left & 1:
+                if tree[left] < best:
+                    best = tree[left]
+                left += 1
+            if right & 1:
+                right -= 1
+                if tree[right] < best:
+                    best = tree[right]
+            left >>= 1
+            right >>= 1
+        if best != empty:
+            pop(leaf_of[best])
+            chains.append((in_rows[k], out_rows[best]))
+    return chains
+
+def _row(frame, i: int):
+    return {
+        "id": int(frame.ids[i]),
+        "time": _time_label(frame.times[i]),
+        "amount": int(frame.amounts[i]) / 100,
+        "counterparty": frame.counterparties[frame.counterparty_codes[i]],
+    }
+
+def pass_through_report(frame, window_minutes: int, tolerance: float, min_amount: float):
+    chains = find_pass_through(frame, window_minutes, tolerance, min_amount)
+    items = []
+    pairs: dict[tuple, dict] = {}
+    total_in = 0
+    for i_row, o_row in chains:
+        inflow = _row(frame, i_row)
+        outflow = _row(frame, o_row)
+        delay = int(frame.times[o_row] - frame.times[i_row])
+        items.append({"inflow": inflow, "outflow": outflow, "delay_seconds": delay})
+        total_in += int(frame.amounts[i_row])
+        key = (inflow["counterparty"], outflow["counterparty"])
+        pair = pairs.setdefault(key, {"from": key[0], "to": key[1], "count": 0, "amount": 0})
+        pair["count"] += 1
+        pair["amount"] += int(frame.amounts[i_row])
+
+    items.reverse()  # newest first
+    top_pairs = sorted(pairs.values(), key=lambda p: (-p["amount"], -p["count"]))
+    for p in top_pairs:
+        p["amount"] = p["amount"] / 100
+    return {
+        "params": {"window_minutes": window_minutes, "tolerance": tolerance, "min_amount": min_amount},
+        "total": len(items),
+        "total_amount": total_in / 100,
+        "pairs": top_pairs,
+        "chains": items,
+    }
@@ -0,0 +1,200 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import parser
+
+# Bill files parsed at once, each in its own process; pdfplumber is pure Python, so threads don't help
+PARSE_WORKERS = max(1, int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+
+_progress = None
+
+def _init_worker(progress_queue):
+    global _progress
+    _progress = progress_queue
+
+def _parse_file(job_id: str, index: int, filename: str, path: str):
+    def on_page(page: int, pages: int):
+        _progress.put((job_id, index, filename, page, pages))
+
+    return parser.parse_bill_file(path, on_page)
+
+class _FileTask:
+    __slots__ = ("job_id", "suspect_id", "index", "filename", "path", "future", "on_start")
+
+    def __init__(self, job_id, suspect_id, index, filename, path, future, on_start):
+        self.job_id = job_id
+        self.suspect_id = suspect_id
+        self.index = index
+        self.filename = filename
+        self.path = path
+        self.future = future
+        self.on_start = on_start
+
+class ParseScheduler:
+    """Parses uploaded bill files in a process pool, sharing it fairly between suspects.
+
+    Each suspect has its own FIFO of files; free workers take the next file from the suspects in
+    round-robin order, so one large batch upload can't hold up everyone else's. Cancelling a job
+    drops its queued files and abandons the ones being parsed: the process finishes the file,
+    but nobody collects the result.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = None
+        self._progress_queue = None
+        self._loop = None
+        self._queues: dict[int, deque] = {}
+        self._order: deque = deque()
+        self._jobs: dict[str, list] = {}
+        self._cancelled: set[str] = set()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.on_progress = None
+        self._closed = False
+
+    def _ensure_pool(self):
+        if self._pool is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        # spawn: forking a process that runs an event loop and threads is not safe
+        self._ctx = multiprocessing.get_context("spawn")
+        self._progress_queue = self._ctx.Queue()
+        self._new_pool()
+        threading.Thread(target=self._drain_progress, args=(self._progress_queue,), daemon=True).start()
+
+    def _new_pool(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=self._ctx, initializer=_init_worker, initargs=(self._progress_queue,)
+        )
+
+    def _drain_progress(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if self.on_progress is not None:
+                try:
+                    self.on_progress(*item)
+                except Exception:
+                    pass
+
+    def submit(self, job_id: str, suspect_id: int, files: list[tuple[str, str]], on_start=None):
+        """Queue (filename, path) pairs; returns one future per file with its parsed rows.
+
+        `on_start(index, filename)` is called on the event loop when a file reaches a worker.
+        """
+        self._ensure_pool()
+        futures = []
+        queue = self._queues.get(suspect_id)
+        if queue is None:
+            queue = self._queues[suspect_id] = deque()
+            self._order.append(suspect_id)
+        for index, (filename, path) in enumerate(files):
+            future = self._loop.create_future()
+            queue.append(_FileTask(job_id, suspect_id, index, filename, path, future, on_start))
+            futures.append(future)
+        self._jobs.setdefault(job_id, []).extend(futures)
+        self._dispatch()
+        return futures
+
+    def _dispatch(self):
+        while self.running < self.workers and self._order:
+            suspect_id = self._order.popleft()
+            queue = self._queues[suspect_id]
+            task = queue.popleft()
+            if queue:
+                self._order.append(suspect_id)
+            else:
+                del self._queues[suspect_id]
+            if task.future.done():
+                continue
+            self.running += 1
+            if task.on_start is not None:
+                task.on_start(task.index, task.filename)
+            args = (_parse_file, task.job_id, task.index, task.filename, task.path)
+            try:
+                work = self._pool.submit(*args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory) and took the pool with it; files that were
+                # running fail, the rest go to a fresh pool
+                self._pool.shutdown(wait=False)
+                self._new_pool()
+                work = self._pool.submit(*args)
+            work.add_done_callback(lambda w, task=task: self._work_done(task, w))
+
+    def _work_done(self, task: _FileTask, work):
+        # Runs in the pool's thread; a parse that outlives shutdown() has no loop left to report to
+        if self._closed or self._loop.is_closed():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._finish, task, work)
+        except RuntimeError:
+            # The loop closed between the check and the call
+            pass
+
+    def _finish(self, task: _FileTask, work):
+        self.running -= 1
+        if not task.future.done():
+            error = work.exception()
+            if error is None:
+                self.completed += 1
+                task.future.set_result(work.result())
+            else:
+                self.failed += 1
+                task.future.set_exception(error)
+        self._dispatch()
+
+    def cancel(self, job_id: str):
+        """Cancel the job's remaining files; False if the scheduler has nothing left for it."""
+        futures = [f for f in self._jobs.get(job_id, []) if not f.done()]
+        if not futures:
+            return False
+        self._cancelled.add(job_id)
+        for future in futures:
+            future.cancel()
+        # Drop its queued files now so stats stop counting them
+        for suspect_id in list(self._queues):
+            queue = self._queues[suspect_id]
+            kept = deque(task for task in queue if task.job_id != job_id)
+            if kept:
+                self._queues[suspect_id] = kept
+            else:
+                del self._queues[suspect_id]
+                self._order.remove(suspect_id)
+        self.cancelled += 1
+        return True
+
+    def is_cancelled(self, job_id: str):
+        return job_id in self._cancelled
+
+    def release(self, job_id: str):
+        """Forget a finished job."""
+        self._jobs.pop(job_id, None)
+        self._cancelled.discard(job_id)
+
+    def shutdown(self):
+        self._closed = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._progress_queue.put(None)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": {suspect_id: len(queue) for suspect_id, queue in self._queues.items()},
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled_jobs": self.cancelled,
+        }
+
+scheduler = ParseScheduler(PARSE_WORKERS)
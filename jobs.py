@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import database
+import models
+import writer
+
+# Finished (done, error or cancelled) upload jobs are deleted after this many hours
+UPLOAD_JOB_RETENTION_HOURS = float(os.getenv("UPLOAD_JOB_RETENTION_HOURS", "72"))
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ("queued", "processing")
+FINISHED = ("done", "error", "cancelled")
+
+# Events a slow subscriber can fall behind by before its backlog is collapsed
+EVENT_QUEUE_SIZE = 16
+
+class JobEvents:
+    """Fans each job's state changes out to its SSE subscribers.
+
+    A job with subscribers has one entry here, its publisher; nothing is kept for jobs nobody
+    watches. Every event is the job's whole state, so when a subscriber's bounded queue is full
+    its backlog is replaced by the newest state instead of blocking the job or growing memory.
+    publish() may be called from worker threads; delivery always happens on the event loop.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._latest: dict[str, dict] = {}
+        self._loop = None
+        self.published = 0
+        self.coalesced = 0
+
+    def subscribe(self, job_id: str):
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[job_id]
+            self._latest.pop(job_id, None)
+
+    def watched(self, job_id: str):
+        return job_id in self._subscribers
+
+    def publish(self, job_id: str, state: dict):
+        if job_id not in self._subscribers or self._loop is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._deliver(job_id, state)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, job_id, state)
+
+    def latest(self, job_id: str):
+        return self._latest.get(job_id)
+
+    def _deliver(self, job_id: str, state: dict):
+        subscribers = self._subscribers.get(job_id)
+        if not subscribers:
+            return
+        self._latest[job_id] = state
+        self.published += 1
+        for queue in subscribers:
+            if queue.full():
+                while not queue.empty():
+                    queue.get_nowait()
+                self.coalesced += 1
+            queue.put_nowait(state)
+
+    def stats(self):
+        return {
+            "jobs_watched": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "coalesced": self.coalesced,
+        }
+
+events = JobEvents(EVENT_QUEUE_SIZE)
+
+def _stamp():
+    return datetime.now().isoformat(timespec="seconds")
+
+async def create(job_id: str, kind: str, suspect_id: int, state: dict, payload: dict):
+    now = datetime.now()
+    state = {"status": "queued", "suspect_id": suspect_id, "created_at": _stamp(), "updated_at": _stamp(), **state}
+
+    def insert(db):
+        db.add(
+            models.UploadJob(
+                id=job_id,
+                kind=kind,
+                suspect_id=suspect_id,
+                status=state["status"],
+                payload=json.dumps(payload, ensure_ascii=False, default=str),
+                state=json.dumps(state, ensure_ascii=False, default=str),
+                created_at=now,
+                updated_at=now,
+            )
+        )
+
+    # Waited for, so the job exists before its id is handed to the client
+    await writer.run_async(insert)
+
+def merge(db, job_id: str, patch: dict):
+    """Writer op: merge `patch` into the job's stored state; returns (state, finished) for notify().
+
+    Lets a caller commit a state change together with its own writes, e.g. a file's result with
+    the file's rows.
+    """
+    row = db.get(models.UploadJob, job_id)
+    if row is None:
+        return None, False
+    state = json.loads(row.state or "{}")
+    state.update(patch or {})
+    now = datetime.now()
+    state["updated_at"] = now.isoformat(timespec="seconds")
+    status = state.get("status")
+    finished = False
+    if status == "processing" and row.status != "processing":
+        state["started_at"] = state["updated_at"]
+    if status in FINISHED and row.finished_at is None:
+        state["finished_at"] = state["updated_at"]
+        if state.get("started_at"):
+            elapsed = datetime.fromisoformat(state["finished_at"]) - datetime.fromisoformat(state["started_at"])
+            state["seconds"] = int(elapsed.total_seconds())
+        row.finished_at = now
+        finished = True
+    row.status = status
+    row.state = json.dumps(state, ensure_ascii=False, default=str)
+    row.updated_at = now
+    return state, finished
+
+def notify(job_id: str, state: dict, finished: bool = False):
+    """Tell subscribers about a state merge() committed."""
+    if state is None:
+        return
+    events.publish(job_id, state)
+    if finished:
+        purge_expired()
+
+def update(job_id: str, patch: dict):
+    """Merge `patch` into the job's state; moving to done/error/cancelled records the finish time.
+
+    Queued on the writer without waiting: updates apply in the order they were made, and
+    subscribers are told once the new state is committed.
+    """
+    if not job_id:
+        return
+
+    def committed(future):
+        error = future.exception()
+        if error is not None:
+            logger.error("upload job %s: state update %s failed: %r", job_id, list(patch or {}), error)
+            return
+        notify(job_id, *future.result())
+
+    writer.submit(lambda db: merge(db, job_id, patch)).add_done_callback(committed)
+
+def progress(job_id: str, patch: dict):
+    """Push a fine-grained progress update (e.g. the page being parsed) to subscribers only.
+
+    Not persisted: these are too frequent to write, and the stored state already says which
+    file the job is on.
+    """
+    if not events.watched(job_id):
+        return
+    base = events.latest(job_id) or get(job_id) or {}
+    events.publish(job_id, {**base, **patch})
+
+def get(job_id: str, kind: str = None):
+    db = database.SessionLocal()
+    try:
+        row = db.get(models.UploadJob, job_id)
+        if row is None or (kind is not None and row.kind != kind):
+            return None
+        return json.loads(row.state or "{}")
+    finally:
+        db.close()
+
+def unfinished():
+    """(job_id, kind, suspect_id, state, payload) for jobs a restart interrupted, oldest first."""
+    db = database.SessionLocal()
+    try:
+        rows = (
+            db.query(models.UploadJob)
+            .filter(models.UploadJob.status.in_(ACTIVE))
+            .order_by(models.UploadJob.created_at)
+            .all()
+        )
+        return [
+            (r.id, r.kind, r.suspect_id, json.loads(r.state or "{}"), json.loads(r.payload or "{}"))
+            for r in rows
+        ]
+    finally:
+        db.close()
+
+def purge_expired():
+    cutoff = datetime.now() - timedelta(hours=UPLOAD_JOB_RETENTION_HOURS)
+
+    def purge(db):
+        return (
+            db.query(models.UploadJob)
+            .filter(models.UploadJob.status.in_(FINISHED), models.UploadJob.finished_at < cutoff)
+            .delete(synchronize_session=False)
+        )
+
+    return writer.submit(purge)
@@ -0,0 +1,215 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+
+# Values the bill exports use for "no counterparty"; they would otherwise link every suspect together
+PLACEHOLDER_COUNTERPARTIES = {"", "/", "-", "--", "无", "未知", "null", "none"}
+
+def normalize_counterparty(name):
+    if name is None:
+        return ""
+    s = unicodedata.normalize("NFKC", str(name))
+    s = re.sub(r"\s+", "", s).lower()
+    if s in PLACEHOLDER_COUNTERPARTIES:
+        return ""
+    return s
+
+def group_items(items):
+    """Aggregate raw transaction dicts into (counterparty, category, count, sum) rows."""
+    grouped = defaultdict(lambda: [0, 0.0])
+    for item in items:
+        key = (item.get("counterparty"), item.get("category"))
+        grouped[key][0] += 1
+        grouped[key][1] += float(item.get("amount") or 0)
+    return [(cp, cat, cnt, total) for (cp, cat), (cnt, total) in grouped.items()]
+
+def grouped_for_query(query):
+    """Same shape as group_items, computed in SQL for rows about to be deleted."""
+    return (
+        query.with_entities(
+            models.Transaction.counterparty,
+            models.Transaction.category,
+            func.count(models.Transaction.id),
+            func.sum(models.Transaction.amount),
+        )
+        .group_by(models.Transaction.counterparty, models.Transaction.category)
+        .all()
+    )
+
+def apply_delta(db, suspect_id: int, grouped_rows, sign: int = 1):
+    per_key: dict[str, dict] = {}
+    for counterparty, category, count, total in grouped_rows:
+        key = normalize_counterparty(counterparty)
+        if not key:
+            continue
+        acc = per_key.setdefault(
+            key,
+            {"display_name": str(counterparty).strip(), "tx_count": 0, "amount_sum": 0.0, "income_sum": 0.0, "expense_sum": 0.0},
+        )
+        total = float(total or 0)
+        acc["tx_count"] += int(count or 0)
+        acc["amount_sum"] += total
+        if category == "收入":
+            acc["income_sum"] += total
+        elif category == "支出":
+            acc["expense_sum"] += total
+
+    if not per_key:
+        return
+
+    table = models.CounterpartyIndex.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.counterparty_key, table.c.suspect_id],
+        set_={
+            "tx_count": table.c.tx_count + stmt.excluded.tx_count,
+            "amount_sum": table.c.amount_sum + stmt.excluded.amount_sum,
+            "income_sum": table.c.income_sum + stmt.excluded.income_sum,
+            "expense_sum": table.c.expense_sum + stmt.excluded.expense_sum,
+        },
+    )
+    db.execute(
+        stmt,
+        [
+            {
+                "counterparty_key": key,
+                "suspect_id": suspect_id,
+                "display_name": acc["display_name"],
+                "tx_count": sign * acc["tx_count"],
+                "amount_sum": sign * acc["amount_sum"],
+                "income_sum": sign * acc["income_sum"],
+                "expense_sum": sign * acc["expense_sum"],
+            }
+            for key, acc in per_key.items()
+        ],
+    )
+
+    if sign < 0:
+        db.query(models.CounterpartyIndex).filter(
+            models.CounterpartyIndex.suspect_id == suspect_id,
+            models.CounterpartyIndex.tx_count <= 0,
+        ).delete(synchronize_session=False)
+
+def remove_suspect(db, suspect_id: int):
+    db.query(models.CounterpartyIndex).filter(models.CounterpartyIndex.suspect_id == suspect_id).delete(
+        synchronize_session=False
+    )
+
+def rebuild_for_suspect(db, suspect_id: int):
+    remove_suspect(db, suspect_id)
+    query = db.query(models.Transaction).filter(models.Transaction.suspect_id == suspect_id)
+    apply_delta(db, suspect_id, grouped_for_query(query), 1)
+
+def unbuilt_suspects(db):
+    # Suspects whose transactions predate the index need rebuild_for_suspect(); afterwards
+    # inserts/deletes keep it current
+    indexed = {r[0] for r in db.query(models.CounterpartyIndex.suspect_id).distinct().all()}
+    with_rows = {r[0] for r in db.query(models.Transaction.suspect_id).distinct().all()}
+    return sorted(with_rows - indexed)
+
+def shared_counterparties(db, suspect_ids: list[int], min_suspects: int = 2, limit: int = 200):
+    suspects = db.query(models.Suspect.id, models.Suspect.name).filter(models.Suspect.id.in_(suspect_ids)).all()
+    names = {sid: name for sid, name in suspects}
+    ids = [sid for sid in suspect_ids if sid in names]
+
+    idx = models.CounterpartyIndex
+    shared_keys = (
+        db.query(idx.counterparty_key)
+        .filter(idx.suspect_id.in_(ids))
+        .group_by(idx.counterparty_key)
+        .having(func.count(idx.suspect_id) >= max(2, min_suspects))
+        .order_by(func.count(idx.suspect_id).desc(), func.sum(idx.amount_sum).desc())
+        .limit(limit)
+        .subquery()
+    )
+    rows = (
+        db.query(idx)
+        .filter(idx.suspect_id.in_(ids), idx.counterparty_key.in_(select(shared_keys.c.counterparty_key)))
+        .all()
+    )
+
+    by_key: dict[str, list] = defaultdict(list)
+    for r in rows:
+        by_key[r.counterparty_key].append(r)
+
+    position = {sid: i for i, sid in enumerate(ids)}
+    shared_count = [[0] * len(ids) for _ in ids]
+    shared_amount = [[0.0] * len(ids) for _ in ids]
+    counterparties = []
+    edges = []
+    for key, entries in by_key.items():
+        entries.sort(key=lambda e: position[e.suspect_id])
+        for a in range(len(entries)):
+            ia = position[entries[a].suspect_id]
+            for b in range(a + 1, len(entries)):
+                ib = position[entries[b].suspect_id]
+                # Money both suspects moved through this counterparty, bounded by the smaller side
+                amount = min(entries[a].amount_sum, entries[b].amount_sum)
+                shared_count[ia][ib] += 1
+                shared_count[ib][ia] += 1
+                shared_amount[ia][ib] += amount
+                shared_amount[ib][ia] += amount
+        counterparties.append(
+            {
+                "key": key,
+                "name": entries[0].display_name,
+                "suspect_count": len(entries),
+                "total_amount": round(sum(e.amount_sum for e in entries), 2),
+                "suspects": [
+                    {
+                        "suspect_id": e.suspect_id,
+                        "tx_count": e.tx_count,
+                        "amount": round(e.amount_sum, 2),
+                        "income": round(e.income_sum, 2),
+                        "expense": round(e.expense_sum, 2),
+                    }
+                    for e in entries
+                ],
+            }
+        )
+        for e in entries:
+            edges.append(
+                {
+                    "source": f"suspect:{e.suspect_id}",
+                    "target": f"counterparty:{key}",
+                    "tx_count": e.tx_count,
+                    "income": round(e.income_sum, 2),
+                    "expense": round(e.expense_sum, 2),
+                }
+            )
+
+    counterparties.sort(key=lambda c: (-c["suspect_count"], -c["total_amount"]))
+
+    # Direct flows: a selected suspect appears as a counterparty in another suspect's bill
+    name_keys = {normalize_counterparty(names[sid]): sid for sid in ids if normalize_counterparty(names[sid])}
+    direct = []
+    if name_keys:
+        for r in db.query(idx).filter(idx.suspect_id.in_(ids), idx.counterparty_key.in_(list(name_keys))).all():
+            other = name_keys[r.counterparty_key]
+            if other == r.suspect_id:
+                continue
+            direct.append(
+                {
+                    "source": f"suspect:{r.suspect_id}",
+                    "target": f"suspect:{other}",
+                    "tx_count": r.tx_count,
+                    "income": round(r.income_sum, 2),
+                    "expense": round(r.expense_sum, 2),
+                }
+            )
+
+    return {
+        "suspects": [{"id": sid, "name": names[sid]} for sid in ids],
+        "matrix": {
+            "shared_counterparties": shared_count,
+            "shared_amount": [[round(v, 2) for v in row] for row in shared_amount],
+        },
+        "counterparties": counterparties,
+        "edges": edges,
+        "direct_edges": direct,
+    }
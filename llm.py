@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+import httpx
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen3:1.7b")
+# How long Ollama keeps the model in memory after a request; "-1" keeps it loaded
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Longest silence allowed between two streamed chunks (model load counts towards the first one)
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+# Load the model at startup and again after this long without any request; 0 disables it
+OLLAMA_WARMUP_IDLE_SECONDS = float(os.getenv("OLLAMA_WARMUP_IDLE_SECONDS", "900"))
+OLLAMA_HEALTH_INTERVAL_SECONDS = float(os.getenv("OLLAMA_HEALTH_INTERVAL_SECONDS", "60"))
+
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
+def normalize_host(host: str):
+    # Ensure scheme is present
+    if not host.startswith("http://") and not host.startswith("https://"):
+        host = "http://" + host
+    # Fix for Windows: cannot connect to 0.0.0.0 directly
+    return host.replace("0.0.0.0", "127.0.0.1").rstrip("/")
+
+def strip_think(text: str):
+    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
+
+class ThinkFilter:
+    """Drops <think>...</think> sections from a token stream as it arrives.
+
+    Tags can be split across chunks, so a tail that might be the start of a tag is held back
+    until the next chunk decides it.
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self.pending = ""
+        self.started = False
+
+    def _held_back(self, text: str, tag: str):
+        for k in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:k]):
+                return k
+        return 0
+
+    def feed(self, chunk: str):
+        text = self.pending + chunk
+        self.pending = ""
+        out = []
+        while text:
+            tag = CLOSE_TAG if self.in_think else OPEN_TAG
+            pos = text.find(tag)
+            if pos >= 0:
+                if not self.in_think:
+                    out.append(text[:pos])
+                text = text[pos + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            keep = self._held_back(text, tag)
+            if not self.in_think:
+                out.append(text[: len(text) - keep])
+            self.pending = text[len(text) - keep:]
+            break
+        visible = "".join(out)
+        if not self.started:
+            # The model usually follows </think> with blank lines; don't lead with them
+            visible = visible.lstrip()
+            self.started = bool(visible)
+        return visible
+
+    def flush(self):
+        rest = "" if self.in_think else self.pending
+        self.pending = ""
+        return rest
+
+class OllamaClient:
+    """One pooled HTTP client for every call to Ollama.
+
+    Connections are reused across requests, every request carries keep_alive so the model stays
+    loaded, and a maintenance task probes health and re-warms the model after idle periods.
+    Cancelling the task that iterates stream_generate closes its connection, which makes Ollama
+    stop generating.
+    """
+
+    def __init__(self, host: str, model: str):
+        self.base_url = normalize_host(host)
+        self.model = model
+        self._client = None
+        self._maintenance = None
+        self.last_used = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.warmups = 0
+        self.health = {"ok": None, "checked_at": None}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def stream_generate(self, prompt: str, model: str = None):
+        """Yield visible text chunks from Ollama's NDJSON /api/generate stream."""
+        self.requests += 1
+        self.last_used = time.monotonic()
+        payload = {"model": model or self.model, "prompt": prompt, "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE}
+        think = ThinkFilter()
+        try:
+            async with self.client.stream("POST", "/api/generate", json=payload) as resp:
+                if resp.status_code != 200:
+                    raise RuntimeError(f"AI 服务响应错误: {resp.status_code}")
+                async for line in resp.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event.get("error"):
+                        raise RuntimeError(f"AI 服务响应错误: {event['error']}")
+                    visible = think.feed(event.get("response", ""))
+                    if visible:
+                        yield visible
+                    if event.get("done"):
+                        break
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.last_used = time.monotonic()
+        if think.in_think:
+            # Cut off inside the reasoning (e.g. by a token limit): there is no answer to keep
+            self.errors += 1
+            raise RuntimeError("AI 响应在思考阶段被截断，未生成分析内容")
+        tail = think.flush()
+        if tail:
+            yield tail
+
+    async def warm_up(self):
+        """An empty prompt makes Ollama load the model without generating anything."""
+        self.warmups += 1
+        self.last_used = time.monotonic()
+        resp = await self.client.post("/api/generate", json={"model": self.model, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE})
+        resp.raise_for_status()
+
+    async def probe(self):
+        started = time.monotonic()
+        result = {"ok": False, "checked_at": time.strftime("%Y-%m-%d %H:%M:%S"), "model": self.model}
+        try:
+            resp = await self.client.get("/api/ps", timeout=OLLAMA_CONNECT_TIMEOUT)
+            resp.raise_for_status()
+            loaded = [m.get("name") or m.get("model") for m in resp.json().get("models", [])]
+            result.update(ok=True, model_loaded=self.model in loaded)
+        except Exception as e:
+            result["error"] = str(e)
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        self.health = result
+        return result
+
+    async def _maintain(self):
+        first = True
+        while True:
+            health = await self.probe()
+            idle = time.monotonic() - self.last_used
+            if health["ok"] and OLLAMA_WARMUP_IDLE_SECONDS > 0 and (first or (idle >= OLLAMA_WARMUP_IDLE_SECONDS and not health.get("model_loaded"))):
+                try:
+                    await self.warm_up()
+                    first = False
+                except Exception:
+                    pass
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL_SECONDS)
+
+    def start(self):
+        if self._maintenance is None:
+            self._maintenance = asyncio.get_running_loop().create_task(self._maintain())
+
+    async def close(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "requests": self.requests,
+            "errors": self.errors,
+            "warmups": self.warmups,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+            "health": self.health,
+        }
+
+client = OllamaClient(OLLAMA_HOST, OLLAMA_MODEL)
@@ -1,15 +1,14 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query, Form, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query, Form, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, FileResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, FileResponse, HTMLResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy import func, and_, or_, cast, case, Integer, literal
 from typing import List, Optional
 import shutil
 import os
 import mimetypes
 import uvicorn
-import requests
 import re
 import asyncio
 import subprocess
@@ -19,14 +18,83 @@ import json
 import threading
 import aiofiles
 import tempfile
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 
-import models, database, parser
+import models, database, parser, exporter, analytics, linkage, anomaly, flows, amounts, periodicity, entities, dedup, profiles, llm, ai_cache, ai_queue, features, jobs, ingest, writer
 
-models.Base.metadata.create_all(bind=database.engine)
+def _backfill_transaction_ts(db: Session):
+    # Rows imported before transaction_ts existed; new rows get it from the models' insert hook
+    db.query(models.Transaction).filter(
+        models.Transaction.transaction_ts.is_(None),
+        models.Transaction.transaction_time.isnot(None),
+    ).update(
+        {models.Transaction.transaction_ts: cast(func.strftime("%s", models.Transaction.transaction_time), Integer)},
+        synchronize_session=False,
+    )
+
+def _ensure_derived_indexes():
+    # One writer op per suspect, so a large backfill doesn't hold the write lock in one go
+    db = database.SessionLocal()
+    try:
+        for module in (linkage, amounts):
+            for suspect_id in module.unbuilt_suspects(db):
+                writer.run(lambda w, module=module, suspect_id=suspect_id: module.rebuild_for_suspect(w, suspect_id))
+        for suspect_id in entities.unbuilt_suspects(db):
+            writer.run(lambda w, suspect_id=suspect_id: entities.resolve_new(w, suspect_id))
+    finally:
+        db.close()
+
+def _prepare_database():
+    # Called from the lifespan, not at import: parse workers are spawned processes that re-import
+    # this module as __mp_main__ when the app is started with `python main.py`
+    database.ensure_schema()
+    writer.run(_backfill_transaction_ts)
+    _ensure_derived_indexes()
+
+# The event loop only keeps weak references to tasks; upload jobs and their follow-up stages are
+# held here until they finish so they can't be garbage-collected mid-run
+_job_tasks: set[asyncio.Task] = set()
+
+def _start_job_task(coro):
+    task = asyncio.create_task(coro)
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return task
+
+def _resume_upload_jobs():
+    """Re-enqueue upload jobs a restart interrupted, as long as their uploaded files are still on disk."""
+    jobs.purge_expired()
+    lost = "任务在服务重启时中断，上传文件已丢失，请重新上传"
+    for job_id, kind, suspect_id, state, payload in jobs.unfinished():
+        if kind == "bill":
+            # Each file's result is committed with its rows, in upload order, so the results say
+            # exactly which files are done; a pending file missing from disk ends up as an error result
+            pending = (payload.get("files") or [])[len(state.get("results") or []):]
+            if state.get("results") or any(os.path.exists(f.get("path") or "") for f in pending):
+                _start_job_task(_process_bill_upload_job(job_id, suspect_id, pending, payload.get("job_dir")))
+            else:
+                jobs.update(job_id, {"status": "error", "detail": lost})
+        elif kind == "report" and os.path.exists(payload.get("archive_path") or ""):
+            _start_job_task(
+                _process_report_upload_job(job_id, suspect_id, payload["archive_path"], payload["work_dir"])
+            )
+        else:
+            jobs.update(job_id, {"status": "error", "detail": lost})
 
-app = FastAPI()
+@asynccontextmanager
+async def _lifespan(app):
+    await asyncio.to_thread(_prepare_database)
+    ingest.scheduler.on_progress = _on_parse_progress
+    _resume_upload_jobs()
+    # Health probes and model warm-up for the LLM backend
+    llm.client.start()
+    yield
+    await llm.client.close()
+    ingest.scheduler.shutdown()
+
+app = FastAPI(lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -52,67 +120,99 @@ REPORT_ACCESS_LOG_PATH = os.path.join(REPORTS_DIR, "report_access.json")
 REPORT_ACCESS_LOCK = threading.Lock()
 ARCHIVE_EXTRACT_TIMEOUT_SECONDS = int(os.getenv("ARCHIVE_EXTRACT_TIMEOUT_SECONDS", "500"))
 
-REPORT_UPLOAD_JOBS: dict[str, dict] = {}
-REPORT_UPLOAD_JOBS_LOCK = threading.Lock()
-
-BILL_UPLOAD_SEMAPHORE = asyncio.Semaphore(int(os.getenv("BILL_UPLOAD_CONCURRENCY", "1")))
-BILL_UPLOAD_JOBS: dict[str, dict] = {}
-BILL_UPLOAD_JOBS_LOCK = threading.Lock()
-
-def _write_json_atomic(path: str, payload: dict):
-    os.makedirs(os.path.dirname(os.path.abspath(path)) or ".", exist_ok=True)
-    tmp_path = path + ".tmp"
-    with open(tmp_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
-    os.replace(tmp_path, path)
-
-def _write_bill_job_result(job_id: str, suspect_id: int, job: dict):
-    safe_job_id = re.sub(r"[^a-zA-Z0-9_-]", "_", str(job_id or ""))
-    safe_suspect_id = re.sub(r"[^0-9]", "", str(suspect_id or "0")) or "0"
-    filename = f"bill_upload_result_{safe_suspect_id}_{safe_job_id}.json"
-    path = os.path.abspath(os.path.join(os.getcwd(), filename))
-    _write_json_atomic(path, job or {})
-    return filename
-
-def _set_report_job(job_id: str, patch: dict):
-    if not job_id:
-        return
-    with REPORT_UPLOAD_JOBS_LOCK:
-        current = REPORT_UPLOAD_JOBS.get(job_id) or {}
-        merged = dict(current)
-        merged.update(patch or {})
-        REPORT_UPLOAD_JOBS[job_id] = merged
-
-def _get_report_job(job_id: str):
-    with REPORT_UPLOAD_JOBS_LOCK:
-        job = REPORT_UPLOAD_JOBS.get(job_id)
-        if not job:
-            return None
-        return dict(job)
-
-def _set_bill_job(job_id: str, patch: dict):
-    if not job_id:
-        return
-    with BILL_UPLOAD_JOBS_LOCK:
-        current = BILL_UPLOAD_JOBS.get(job_id) or {}
-        merged = dict(current)
-        merged.update(patch or {})
-        BILL_UPLOAD_JOBS[job_id] = merged
-
-def _get_bill_job(job_id: str):
-    with BILL_UPLOAD_JOBS_LOCK:
-        job = BILL_UPLOAD_JOBS.get(job_id)
-        if not job:
-            return None
-        return dict(job)
-
 def _chunk_list(items: list, size: int):
     if size <= 0:
         size = 1
     for i in range(0, len(items), size):
         yield items[i : i + size]
 
+def _bump_data_version(db: Session, suspect_id: int):
+    db.query(models.Suspect).filter(models.Suspect.id == suspect_id).update(
+        {models.Suspect.data_version: func.coalesce(models.Suspect.data_version, 0) + 1},
+        synchronize_session=False,
+    )
+
+def _on_transactions_added(db: Session, suspect_id: int, items: list[dict]):
+    linkage.apply_delta(db, suspect_id, linkage.group_items(items), 1)
+    amounts.apply_delta(db, suspect_id, amounts.group_items(items), 1)
+    _bump_data_version(db, suspect_id)
+
+def _on_transactions_removing(db: Session, suspect_id: int, query):
+    # Called with the query selecting the rows, before they are deleted
+    linkage.apply_delta(db, suspect_id, linkage.grouped_for_query(query), -1)
+    amounts.apply_delta(db, suspect_id, amounts.grouped_for_query(query), -1)
+    db.query(models.TransactionScore).filter(
+        models.TransactionScore.transaction_pk.in_(query.with_entities(models.Transaction.id).scalar_subquery())
+    ).delete(synchronize_session=False)
+    _bump_data_version(db, suspect_id)
+
+def _stage_anomaly_scores(db: Session, suspect_id: int):
+    scores = anomaly.score_suspect(db, suspect_id)
+    return writer.run(lambda w: anomaly.store_scores(w, suspect_id, scores))
+
+def _recurring_for_suspect(db: Session, suspect_id: int):
+    frame = analytics.frame_cache.get(db, suspect_id)
+    return analytics.result_cache.get_or_compute(frame, ("recurring",), lambda: periodicity.detect_recurring(frame))
+
+def _stage_recurring(db: Session, suspect_id: int):
+    # Warms the result cache for the new data version so the first request is instant
+    groups = _recurring_for_suspect(db, suspect_id)
+    return {"groups": len(groups), "periodic": sum(1 for g in groups if g["pattern"] != "irregular")}
+
+def _stage_entities(db: Session, suspect_id: int):
+    result = writer.run(lambda w: entities.resolve_new(w, suspect_id))
+    if result["entities_touched"]:
+        # Entity-grouped results are cached per data_version, which resolving doesn't bump
+        analytics.result_cache.invalidate(suspect_id)
+    return result
+
+def _duplicates_for_suspect(db: Session, suspect_id: int):
+    frame = analytics.frame_cache.get(db, suspect_id)
+    return analytics.result_cache.get_or_compute(
+        frame, ("duplicates",), lambda: dedup.duplicates_report(frame, dedup.synthetic_ids(db, suspect_id))
+    )
+
+def _stage_duplicates(db: Session, suspect_id: int):
+    report = _duplicates_for_suspect(db, suspect_id)
+    return {"duplicates": report["total"], "duplicate_amount": report["duplicate_amount"]}
+
+# Derived analyses refreshed after a suspect's transactions change, in order
+ANALYSIS_STAGES = [
+    ("entities", _stage_entities),
+    ("duplicates", _stage_duplicates),
+    ("anomaly", _stage_anomaly_scores),
+    ("recurring", _stage_recurring),
+]
+
+def _run_analysis_stages(suspect_id: int):
+    # Stages read through this session and hand their writes to the writer; call from a worker thread
+    report = {}
+    db = database.SessionLocal()
+    try:
+        for name, stage in ANALYSIS_STAGES:
+            started = datetime.now()
+            try:
+                result = stage(db, suspect_id)
+                report[name] = {"status": "done", "result": result}
+            except Exception as e:
+                db.rollback()
+                report[name] = {"status": "error", "detail": str(e)}
+            report[name]["seconds"] = round((datetime.now() - started).total_seconds(), 3)
+    finally:
+        db.close()
+    return report
+
+async def _run_post_upload_stages(job_id: str, suspect_id: int):
+    jobs.update(job_id, {"analysis_status": "processing"})
+    report = await asyncio.to_thread(_run_analysis_stages, suspect_id)
+    jobs.update(job_id, {"analysis_status": "done", "analysis": report})
+    try:
+        _schedule_background_ai(suspect_id)
+    except Exception:
+        pass
+
 def _insert_transactions_for_suspect(db: Session, suspect_id: int, source_filename: str, data: list[dict]):
+    """Writer op: add the rows whose transaction_id the suspect doesn't have yet; returns how many."""
     tx_ids = []
     for item in data:
         tid = item.get("transaction_id") if isinstance(item, dict) else None
@@ -132,6 +232,7 @@ def _insert_transactions_for_suspect(db: Session, suspect_id: int, source_filena
                 existing.add(str(r[0]))
 
     to_insert = []
+    inserted_items = []
     for item in data:
         if not isinstance(item, dict):
             continue
@@ -141,105 +242,121 @@ def _insert_transactions_for_suspect(db: Session, suspect_id: int, source_filena
         if str(tid) in existing:
             continue
         to_insert.append(models.Transaction(**item, source_file=source_filename, suspect_id=suspect_id))
+        inserted_items.append(item)
 
     if to_insert:
         db.add_all(to_insert)
-    db.commit()
+        _on_transactions_added(db, suspect_id, inserted_items)
     return len(to_insert)
 
+def _parsed_file_result(filename: str, data: list[dict], inserted: int):
+    times = []
+    for item in data or []:
+        if isinstance(item, dict):
+            t = item.get("transaction_time")
+            if t:
+                times.append(t)
+    min_time = min(times) if times else None
+    max_time = max(times) if times else None
+    distinct_days = set()
+    for t in times:
+        try:
+            distinct_days.add(t.date().isoformat())
+        except Exception:
+            continue
+    return {
+        "filename": filename,
+        "parsed_count": len(data or []),
+        "inserted_count": inserted,
+        "min_time": min_time.isoformat(timespec="seconds") if min_time else None,
+        "max_time": max_time.isoformat(timespec="seconds") if max_time else None,
+        "distinct_days": len(distinct_days),
+        "diagnostics_file": None,
+    }
+
+def _on_parse_progress(job_id: str, index: int, filename: str, page: int, pages: int):
+    # Called from the scheduler's progress thread; only subscribers see page-level progress
+    jobs.progress(job_id, {"current_filename": filename, "current_page": page, "total_pages": pages})
+
 async def _process_bill_upload_job(job_id: str, suspect_id: int, stored_files: list[dict], job_dir: str):
-    _set_bill_job(job_id, {"status": "queued", "updated_at": datetime.now().isoformat(timespec="seconds")})
-    await BILL_UPLOAD_SEMAPHORE.acquire()
+    """Parse the job's files in the process pool, then insert them in upload order through the writer."""
+    jobs.update(job_id, {"status": "queued"})
     try:
-        _set_bill_job(job_id, {"status": "processing", "updated_at": datetime.now().isoformat(timespec="seconds")})
         db = database.SessionLocal()
         try:
-            suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
-            if not suspect:
-                _set_bill_job(job_id, {"status": "error", "detail": "Suspect not found", "updated_at": datetime.now().isoformat(timespec="seconds")})
-                return
+            suspect_exists = db.query(models.Suspect.id).filter(models.Suspect.id == suspect_id).first() is not None
+        finally:
+            db.close()
+        if not suspect_exists:
+            jobs.update(job_id, {"status": "error", "detail": "Suspect not found"})
+            return
+
+        # A job resumed after a restart keeps the results of the files it already finished
+        results = list((jobs.get(job_id) or {}).get("results") or [])
+        done_before = len(results)
+        files = [
+            ((f.get("filename") or "").strip(), (f.get("path") or "").strip())
+            for f in stored_files or []
+            if isinstance(f, dict)
+        ]
+        jobs.update(job_id, {"total_files": done_before + len(files)})
 
-            results = []
-            total_files = len(stored_files or [])
-            for idx, f in enumerate(stored_files or []):
-                filename = (f.get("filename") or "").strip() if isinstance(f, dict) else ""
-                fpath = (f.get("path") or "").strip() if isinstance(f, dict) else ""
-                _set_bill_job(
-                    job_id,
-                    {
-                        "current_filename": filename,
-                        "current_file_index": idx + 1,
-                        "total_files": total_files,
-                        "updated_at": datetime.now().isoformat(timespec="seconds"),
-                    },
-                )
+        started_at = {}
 
-                try:
-                    data = await asyncio.to_thread(parser.parse_bill_file, fpath)
-                    times = []
-                    for item in data or []:
-                        if isinstance(item, dict):
-                            t = item.get("transaction_time")
-                            if t:
-                                times.append(t)
-                    min_time = min(times) if times else None
-                    max_time = max(times) if times else None
-                    distinct_days = set()
-                    for t in times:
-                        try:
-                            distinct_days.add(t.date().isoformat())
-                        except Exception:
-                            continue
-                    inserted = _insert_transactions_for_suspect(db, suspect_id, filename, data or [])
-                    results.append(
-                        {
-                            "filename": filename,
-                            "parsed_count": len(data or []),
-                            "inserted_count": inserted,
-                            "min_time": min_time.isoformat(timespec="seconds") if min_time else None,
-                            "max_time": max_time.isoformat(timespec="seconds") if max_time else None,
-                            "distinct_days": len(distinct_days),
-                            "diagnostics_file": None,
-                        }
-                    )
-                except Exception as e:
-                    db.rollback()
-                    results.append({"filename": filename, "error": str(e)})
-                finally:
-                    try:
-                        if fpath and os.path.exists(fpath):
-                            os.remove(fpath)
-                    except Exception:
-                        pass
-
-                _set_bill_job(job_id, {"results": list(results), "updated_at": datetime.now().isoformat(timespec="seconds")})
-
-            _set_bill_job(
+        def on_start(index: int, filename: str):
+            started_at[index] = datetime.now()
+            jobs.update(
                 job_id,
-                {
-                    "status": "done",
-                    "results": list(results),
-                    "updated_at": datetime.now().isoformat(timespec="seconds"),
-                },
+                {"status": "processing", "current_filename": filename, "current_file_index": done_before + index + 1},
             )
+
+        futures = ingest.scheduler.submit(job_id, suspect_id, files, on_start)
+        for index, ((filename, fpath), future) in enumerate(zip(files, futures)):
+            error = None
+            try:
+                data = await future
+            except asyncio.CancelledError:
+                if not ingest.scheduler.is_cancelled(job_id):
+                    raise
+                break
+            except Exception as e:
+                data, error = None, str(e)
+
+            def ingest_file(db, index=index, filename=filename, data=data, error=error):
+                if error is None:
+                    inserted = _insert_transactions_for_suspect(db, suspect_id, filename, data or [])
+                    result = _parsed_file_result(filename, data, inserted)
+                else:
+                    result = {"filename": filename, "error": error}
+                result["seconds"] = round((datetime.now() - started_at.get(index, datetime.now())).total_seconds(), 3)
+                # Committed with the rows: a restart can neither lose this result nor insert the file again
+                return result, jobs.merge(db, job_id, {"results": results + [result]})
+
+            try:
+                result, merged = await writer.run_async(ingest_file)
+            except Exception as e:
+                # The rows were rolled back with the op; record the failure on its own
+                result = {"filename": filename, "error": str(e)}
+                merged = await writer.run_async(lambda db: jobs.merge(db, job_id, {"results": results + [result]}))
+            results.append(result)
+            jobs.notify(job_id, *merged)
+            # Only once its result is stored: until then the file is what a resumed job parses again
             try:
-                final_job = _get_bill_job(job_id) or {}
-                out_file = _write_bill_job_result(job_id, suspect_id, final_job)
-                _set_bill_job(job_id, {"output_file": out_file, "updated_at": datetime.now().isoformat(timespec="seconds")})
+                if fpath and os.path.exists(fpath):
+                    os.remove(fpath)
             except Exception:
                 pass
-        finally:
-            db.close()
+
+        if ingest.scheduler.is_cancelled(job_id):
+            jobs.update(job_id, {"status": "cancelled", "detail": "任务已取消", "results": list(results)})
+        else:
+            jobs.update(job_id, {"status": "done", "results": list(results)})
+        if any(r.get("inserted_count") for r in results):
+            _start_job_task(_run_post_upload_stages(job_id, suspect_id))
     except Exception as e:
-        _set_bill_job(job_id, {"status": "error", "detail": str(e), "updated_at": datetime.now().isoformat(timespec="seconds")})
-        try:
-            final_job = _get_bill_job(job_id) or {}
-            out_file = _write_bill_job_result(job_id, suspect_id, final_job)
-            _set_bill_job(job_id, {"output_file": out_file, "updated_at": datetime.now().isoformat(timespec="seconds")})
-        except Exception:
-            pass
+        jobs.update(job_id, {"status": "error", "detail": str(e)})
     finally:
-        BILL_UPLOAD_SEMAPHORE.release()
+        ingest.scheduler.release(job_id)
         try:
             await asyncio.to_thread(_delete_tree, job_dir)
         except Exception:
@@ -356,6 +473,10 @@ class SuspectRead(BaseModel):
 class AdminPurgeReportsRequest(BaseModel):
     confirm: str
 
+class DuplicateMergeRequest(BaseModel):
+    # Duplicate row ids to remove; None merges every detected pair
+    ids: Optional[List[int]] = None
+
 class ReportsStatsResponse(BaseModel):
     suspect_dirs: int
     report_versions: int
@@ -425,11 +546,10 @@ def _get_reports_stats():
     }
 
 def _purge_all_reports(background_tasks: BackgroundTasks, db: Session):
-    db.query(models.Suspect).update({
+    writer.run(lambda w: w.query(models.Suspect).update({
         models.Suspect.report_path: None,
         models.Suspect.report_filename: None,
-    })
-    db.commit()
+    }))
 
     with REPORT_ACCESS_LOCK:
         _write_report_access_unlocked({})
@@ -614,10 +734,13 @@ def create_suspect(
     if existing:
         raise HTTPException(status_code=400, detail="Suspect with this name already exists")
         
-    db_suspect = models.Suspect(name=suspect.name, password=suspect.password)
-    db.add(db_suspect)
-    db.commit()
-    db.refresh(db_suspect)
+    def insert(w: Session):
+        row = models.Suspect(name=suspect.name, password=suspect.password)
+        w.add(row)
+        w.flush()
+        return row.id
+
+    db_suspect = db.get(models.Suspect, writer.run(insert))
 
     if background_tasks:
         background_tasks.add_task(_cleanup_stale_reports, 30)
@@ -681,29 +804,82 @@ async def upload_file(
 
         stored_files.append({"filename": filename, "path": file_path})
 
-    _set_bill_job(
+    await jobs.create(
         job_id,
-        {
-            "status": "queued",
-            "suspect_id": suspect_id,
-            "created_at": datetime.now().isoformat(timespec="seconds"),
-            "updated_at": datetime.now().isoformat(timespec="seconds"),
-            "total_files": len(stored_files),
-            "current_file_index": 0,
-            "current_filename": None,
-            "results": [],
-        },
+        "bill",
+        suspect_id,
+        {"total_files": len(stored_files), "current_file_index": 0, "current_filename": None, "results": []},
+        {"files": stored_files, "job_dir": job_dir},
     )
-    asyncio.create_task(_process_bill_upload_job(job_id, suspect_id, stored_files, job_dir))
+    _start_job_task(_process_bill_upload_job(job_id, suspect_id, stored_files, job_dir))
     return {"status": "accepted", "job_id": job_id}
 
 @app.get("/api/bill/upload_status")
 def bill_upload_status(job_id: str = Query(...)):
-    job = _get_bill_job(job_id)
+    job = jobs.get(job_id, "bill")
     if not job:
         raise HTTPException(status_code=404, detail="job not found")
     return job
 
+def _job_event_stream(request: Request, job_id: str, kind: str):
+    """SSE of a job's state: the current state first, then every change until it is done or failed.
+
+    Events are named `progress` while queued or processing, then `done`, `error` or `cancelled`; each carries
+    the same JSON as the upload_status endpoint.
+    """
+    # Subscribe before reading the state so no change can slip in between
+    queue = jobs.events.subscribe(job_id)
+    job = jobs.get(job_id, kind)
+    if not job:
+        jobs.events.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail="job not found")
+
+    def event(state: dict):
+        status = state.get("status")
+        return _sse(status if status in jobs.FINISHED else "progress", state)
+
+    async def stream():
+        try:
+            yield event(job)
+            if job.get("status") in jobs.FINISHED:
+                return
+            while True:
+                try:
+                    state = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event(state)
+                if state.get("status") in jobs.FINISHED:
+                    return
+        finally:
+            jobs.events.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/bill/upload_cancel")
+def cancel_bill_upload(job_id: str = Query(...)):
+    """Cancel a queued or running bill job; files already inserted stay."""
+    job = jobs.get(job_id, "bill")
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    if job.get("status") in jobs.FINISHED:
+        raise HTTPException(status_code=400, detail="任务已结束，无法取消")
+    if not ingest.scheduler.cancel(job_id):
+        # Nothing left to parse: the job is inserting its last file and will finish on its own
+        raise HTTPException(status_code=400, detail="任务即将完成，无法取消")
+    return {"status": "cancelling", "job_id": job_id}
+
+@app.get("/api/bill/upload_events")
+async def bill_upload_events(request: Request, job_id: str = Query(...)):
+    return _job_event_stream(request, job_id, "bill")
+
 @app.post("/suspects/verify")
 def verify_suspect_password(verify: SuspectVerify, db: Session = Depends(database.get_db)):
     suspect = db.query(models.Suspect).filter(models.Suspect.id == verify.suspect_id).first()
@@ -719,12 +895,19 @@ def delete_suspect(suspect_id: int, db: Session = Depends(database.get_db)):
     if not suspect:
         raise HTTPException(status_code=404, detail="Suspect not found")
     
-    # Delete transactions first
-    db.query(models.Transaction).filter(models.Transaction.suspect_id == suspect_id).delete()
-    
-    # Delete suspect
-    db.delete(suspect)
-    db.commit()
+    def delete(w: Session):
+        # Delete transactions first
+        w.query(models.Transaction).filter(models.Transaction.suspect_id == suspect_id).delete()
+        linkage.remove_suspect(w, suspect_id)
+        anomaly.remove_suspect(w, suspect_id)
+        amounts.remove_suspect(w, suspect_id)
+        entities.remove_suspect(w, suspect_id)
+        ai_cache.remove_suspect(w, suspect_id)
+        w.query(models.Suspect).filter(models.Suspect.id == suspect_id).delete()
+
+    writer.run(delete)
+    analytics.frame_cache.invalidate(suspect_id)
+    analytics.result_cache.invalidate(suspect_id)
     return {"message": "Suspect deleted"}
 
 @app.get("/suspects/{suspect_id}/files")
@@ -736,13 +919,24 @@ def get_suspect_files(suspect_id: int, db: Session = Depends(database.get_db)):
     return [f[0] for f in files]
 
 @app.delete("/suspects/{suspect_id}/files")
-def delete_suspect_file(suspect_id: int, filename: str, db: Session = Depends(database.get_db)):
-    # Delete transactions for this file
-    result = db.query(models.Transaction).filter(
-        models.Transaction.suspect_id == suspect_id,
-        models.Transaction.source_file == filename
-    ).delete()
-    db.commit()
+def delete_suspect_file(
+    suspect_id: int,
+    filename: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db)
+):
+    def delete(w: Session):
+        # Delete transactions for this file
+        file_query = w.query(models.Transaction).filter(
+            models.Transaction.suspect_id == suspect_id,
+            models.Transaction.source_file == filename
+        )
+        _on_transactions_removing(w, suspect_id, file_query)
+        return file_query.delete()
+
+    result = writer.run(delete)
+    if result:
+        background_tasks.add_task(_run_analysis_stages, suspect_id)
     return {"message": f"Deleted {result} transactions from {filename}"}
 
 def parse_filter_time(time_str: str, is_end_of_range: bool = False):
@@ -777,12 +971,15 @@ def parse_filter_time(time_str: str, is_end_of_range: bool = False):
         
     return None
 
-@app.get("/transactions")
-def get_transactions(
-    skip: int = 0, 
-    limit: int = 100, 
+def _split_counterparty_keywords(counterparty: Optional[str]):
+    # Support multiple counterparties separated by comma (Chinese or English)
+    keywords = (counterparty or "").replace("，", ",").split(",")
+    return [k.strip() for k in keywords if k.strip()]
+
+def _apply_transaction_filters(
+    query,
     suspect_id: Optional[int] = None,
-    start_date: Optional[str] = None, 
+    start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     counterparty: Optional[str] = None,
     category: Optional[str] = None,
@@ -790,10 +987,7 @@ def get_transactions(
     method: Optional[str] = None,
     min_amount: Optional[float] = None,
     max_amount: Optional[float] = None,
-    db: Session = Depends(database.get_db)
 ):
-    query = db.query(models.Transaction)
-    
     if suspect_id:
         query = query.filter(models.Transaction.suspect_id == suspect_id)
     
@@ -806,9 +1000,7 @@ def get_transactions(
         if dt:
             query = query.filter(models.Transaction.transaction_time < dt)
     if counterparty:
-        # Support multiple counterparties separated by comma (Chinese or English)
-        keywords = counterparty.replace("，", ",").split(",")
-        keywords = [k.strip() for k in keywords if k.strip()]
+        keywords = _split_counterparty_keywords(counterparty)
         
         if len(keywords) > 0:
             # Create an OR condition for all keywords
@@ -825,6 +1017,35 @@ def get_transactions(
         query = query.filter(models.Transaction.amount >= min_amount)
     if max_amount is not None:
         query = query.filter(models.Transaction.amount <= max_amount)
+    return query
+
+@app.get("/transactions")
+def get_transactions(
+    skip: int = 0, 
+    limit: int = 100, 
+    suspect_id: Optional[int] = None,
+    start_date: Optional[str] = None, 
+    end_date: Optional[str] = None,
+    counterparty: Optional[str] = None,
+    category: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    method: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: Session = Depends(database.get_db)
+):
+    query = _apply_transaction_filters(
+        db.query(models.Transaction),
+        suspect_id=suspect_id,
+        start_date=start_date,
+        end_date=end_date,
+        counterparty=counterparty,
+        category=category,
+        transaction_type=transaction_type,
+        method=method,
+        min_amount=min_amount,
+        max_amount=max_amount,
+    )
         
     total = query.count()
     total_amount = query.with_entities(func.sum(models.Transaction.amount)).scalar() or 0
@@ -832,6 +1053,210 @@ def get_transactions(
     
     return {"total": total, "total_amount": total_amount, "data": transactions}
 
+@app.get("/transactions/facets")
+def get_transaction_facets(
+    suspect_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    counterparty: Optional[str] = None,
+    category: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    method: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: Session = Depends(database.get_db)
+):
+    if analytics.use_columnar(suspect_id):
+        frame = analytics.frame_cache.get(db, suspect_id)
+
+        def compute():
+            base = frame.build_mask(
+                start=parse_filter_time(start_date) if start_date else None,
+                end=parse_filter_time(end_date, is_end_of_range=True) if end_date else None,
+                counterparties=_split_counterparty_keywords(counterparty),
+                min_amount=min_amount,
+                max_amount=max_amount,
+            )
+            filter_masks = {}
+            if category:
+                filter_masks["category"] = frame.build_mask(category=category)
+            if transaction_type:
+                filter_masks["transaction_type"] = frame.build_mask(transaction_type=transaction_type)
+            if method:
+                filter_masks["method"] = frame.build_mask(method=method)
+            return frame.facets(base, filter_masks)
+
+        key = ("facets", start_date, end_date, counterparty, category, transaction_type, method, min_amount, max_amount)
+        return analytics.result_cache.get_or_compute(frame, key, compute)
+
+    return _sql_transaction_facets(
+        db,
+        suspect_id=suspect_id,
+        start_date=start_date,
+        end_date=end_date,
+        counterparty=counterparty,
+        category=category,
+        transaction_type=transaction_type,
+        method=method,
+        min_amount=min_amount,
+        max_amount=max_amount,
+    )
+
+def _sql_transaction_facets(db: Session, **filters):
+    # One UNION ALL statement; each branch drops the filter on its own dimension
+    tx = models.Transaction
+    dimensions = {
+        "category": tx.category,
+        "transaction_type": tx.transaction_type,
+        "method": tx.method,
+        "source_file": tx.source_file,
+        # Same hour-of-day as the columnar path: naive times are stored as UTC in transaction_ts
+        "hour": (tx.transaction_ts // analytics.SECONDS_PER_HOUR) % 24,
+    }
+    branches = []
+    for name, column in dimensions.items():
+        branch_filters = {k: (None if k == name else v) for k, v in filters.items()}
+        query = _apply_transaction_filters(
+            db.query(
+                literal(name).label("dimension"),
+                column.label("value"),
+                func.count(tx.id).label("count"),
+                func.sum(tx.amount).label("amount"),
+            ),
+            **branch_filters,
+        )
+        if name == "hour":
+            query = query.filter(tx.transaction_ts.isnot(None))
+        branches.append(query.group_by(column))
+
+    result = {name: [] for name in dimensions}
+    for dimension, value, count, amount in branches[0].union_all(*branches[1:]).all():
+        if dimension == "hour":
+            value = f"{int(value):02d}"
+        result[dimension].append({"value": value, "count": count, "amount": round(amount or 0, 2)})
+    for name, values in result.items():
+        values.sort(key=(lambda v: v["value"]) if name == "hour" else (lambda v: -v["count"]))
+    return result
+
+@app.get("/transactions/export")
+def export_transactions(
+    format: str = "csv",
+    suspect_id: Optional[int] = None,
+    start_date: Optional[str] = None, 
+    end_date: Optional[str] = None,
+    counterparty: Optional[str] = None,
+    category: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    method: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: Session = Depends(database.get_db)
+):
+    fmt = (format or "").strip().lower()
+    if fmt not in exporter.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="仅支持导出 csv 或 xlsx 格式")
+
+    base_name = "transactions"
+    if suspect_id:
+        suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+        if not suspect:
+            raise HTTPException(status_code=404, detail="Suspect not found")
+        base_name = f"{suspect.name}_transactions"
+
+    filters = {
+        "suspect_id": suspect_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "counterparty": counterparty,
+        "category": category,
+        "transaction_type": transaction_type,
+        "method": method,
+        "min_amount": min_amount,
+        "max_amount": max_amount,
+    }
+
+    def iter_rows():
+        # The request-scoped session is closed once the handler returns, so the
+        # generator owns a dedicated session for the lifetime of the stream.
+        stream_db = database.SessionLocal()
+        try:
+            query = _apply_transaction_filters(stream_db.query(*exporter.EXPORT_COLUMNS), **filters)
+            query = query.order_by(models.Transaction.transaction_time.desc())
+            for row in query.yield_per(exporter.EXPORT_BATCH_SIZE):
+                yield row
+        finally:
+            stream_db.close()
+
+    filename = f"{base_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        exporter.stream_export(fmt, iter_rows()),
+        media_type=exporter.EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": exporter.content_disposition(filename)},
+    )
+
+def _columnar_dashboard_mask(
+    frame,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    specific_amount: Optional[float],
+    time_range: Optional[str],
+    category: Optional[str] = None,
+):
+    return frame.build_mask(
+        start=parse_filter_time(start_date) if start_date else None,
+        end=parse_filter_time(end_date, is_end_of_range=True) if end_date else None,
+        category=category,
+        specific_amount=specific_amount,
+        time_range=time_range,
+    )
+
+def _filter_time_range(query, time_range: Optional[str]):
+    if time_range not in ("day", "night"):
+        return query
+    hour = (models.Transaction.transaction_ts // analytics.SECONDS_PER_HOUR) % 24
+    return query.filter(analytics.time_range_mask(hour, time_range))
+
+def _ts_filter_conditions(start_date: Optional[str], end_date: Optional[str], specific_amount: Optional[float], time_range: Optional[str]):
+    """Dashboard filters on the integer transaction_ts column, as a list of SQL conditions."""
+    ts = models.Transaction.transaction_ts
+    conditions = []
+    if start_date:
+        dt = parse_filter_time(start_date)
+        if dt:
+            conditions.append(ts >= models.epoch_seconds(dt))
+    if end_date:
+        dt = parse_filter_time(end_date, is_end_of_range=True)
+        if dt:
+            conditions.append(ts < models.epoch_seconds(dt))
+    if specific_amount is not None:
+        conditions.append(models.Transaction.amount == specific_amount)
+    if time_range in ("day", "night"):
+        conditions.append(analytics.time_range_mask((ts // analytics.SECONDS_PER_HOUR) % 24, time_range))
+    return conditions
+
+def _filter_ts_query(query, start_date: Optional[str], end_date: Optional[str], specific_amount: Optional[float], time_range: Optional[str]):
+    conditions = _ts_filter_conditions(start_date, end_date, specific_amount, time_range)
+    return query.filter(*conditions) if conditions else query
+
+@app.get("/api/admin/analytics/stats")
+def admin_analytics_stats(db: Session = Depends(database.get_db)):
+    return {
+        "engine": analytics.ANALYTICS_ENGINE,
+        **analytics.frame_cache.stats(),
+        "results": analytics.result_cache.stats(),
+        "ai_cache": ai_cache.stats(db),
+        "ai_flights": ai_cache.flights.stats(),
+        "ai_queue": ai_queue.scheduler.stats(),
+        "llm": llm.client.stats(),
+        "upload_events": jobs.events.stats(),
+        "parse_pool": ingest.scheduler.stats(),
+        "writer": writer.stats(),
+    }
+
+@app.get("/api/admin/ai/health")
+async def ai_health():
+    return await llm.client.probe()
+
 @app.get("/stats/summary")
 def get_summary(
     start_date: Optional[str] = None, 
@@ -841,6 +1266,11 @@ def get_summary(
     time_range: Optional[str] = None, # "day", "night", "all"
     db: Session = Depends(database.get_db)
 ):
+    if analytics.use_columnar(suspect_id):
+        frame = analytics.frame_cache.get(db, suspect_id)
+        mask = _columnar_dashboard_mask(frame, start_date, end_date, specific_amount, time_range)
+        return frame.summary(mask)
+
     query = db.query(models.Transaction)
     
     if suspect_id:
@@ -857,16 +1287,7 @@ def get_summary(
     if specific_amount is not None:
         query = query.filter(models.Transaction.amount == specific_amount)
     
-    if time_range == "day":
-        # 06:00 - 17:59
-        query = query.filter(func.strftime("%H", models.Transaction.transaction_time) >= "06")
-        query = query.filter(func.strftime("%H", models.Transaction.transaction_time) <= "17")
-    elif time_range == "night":
-        # 18:00 - 05:59 (Next Day) -> This means HOUR >= 18 OR HOUR <= 05
-        query = query.filter(
-            (func.strftime("%H", models.Transaction.transaction_time) >= "18") | 
-            (func.strftime("%H", models.Transaction.transaction_time) <= "05")
-        )
+    query = _filter_time_range(query, time_range)
 
     total_income = query.filter(models.Transaction.category == "收入").with_entities(func.sum(models.Transaction.amount)).scalar() or 0
     total_expense = query.filter(models.Transaction.category == "支出").with_entities(func.sum(models.Transaction.amount)).scalar() or 0
@@ -882,12 +1303,34 @@ def get_stats_by_counterparty(
     suspect_id: Optional[int] = None,
     specific_amount: Optional[float] = None,
     time_range: Optional[str] = None,
+    group_by: str = "name",
     db: Session = Depends(database.get_db)
 ):
-    query = db.query(
-        models.Transaction.counterparty, 
-        func.sum(models.Transaction.amount).label("total")
-    )
+    if group_by not in ("name", "entity"):
+        raise HTTPException(status_code=400, detail="group_by 仅支持 name 或 entity")
+
+    if analytics.use_columnar(suspect_id):
+        frame = analytics.frame_cache.get(db, suspect_id)
+        mask = _columnar_dashboard_mask(frame, start_date, end_date, specific_amount, time_range, category=category)
+        groups = None
+        if group_by == "entity":
+            groups = entities.frame_groups(frame, entities.entity_map(db, suspect_id))
+        return frame.by_counterparty(mask, limit, groups=groups)
+
+    if group_by == "entity":
+        entity = models.CounterpartyEntity
+        name_col = func.coalesce(entity.entity_name, models.Transaction.counterparty)
+        query = db.query(name_col, func.sum(models.Transaction.amount).label("total")).outerjoin(
+            entity,
+            (entity.suspect_id == models.Transaction.suspect_id) & (entity.raw_name == models.Transaction.counterparty),
+        )
+        group_cols = (entity.entity_id, name_col)
+    else:
+        query = db.query(
+            models.Transaction.counterparty, 
+            func.sum(models.Transaction.amount).label("total")
+        )
+        group_cols = (models.Transaction.counterparty,)
     
     if suspect_id:
         query = query.filter(models.Transaction.suspect_id == suspect_id)
@@ -912,18 +1355,9 @@ def get_stats_by_counterparty(
     if specific_amount is not None:
         query = query.filter(models.Transaction.amount == specific_amount)
         
-    if time_range == "day":
-        # 06:00 - 17:59
-        query = query.filter(func.strftime("%H", models.Transaction.transaction_time) >= "06")
-        query = query.filter(func.strftime("%H", models.Transaction.transaction_time) <= "17")
-    elif time_range == "night":
-        # 18:00 - 05:59
-        query = query.filter(
-            (func.strftime("%H", models.Transaction.transaction_time) >= "18") | 
-            (func.strftime("%H", models.Transaction.transaction_time) <= "05")
-        )
+    query = _filter_time_range(query, time_range)
 
-    results = query.group_by(models.Transaction.counterparty).order_by(func.sum(models.Transaction.amount).desc()).limit(limit).all()
+    results = query.group_by(*group_cols).order_by(func.sum(models.Transaction.amount).desc()).limit(limit).all()
     
     return [{"name": r[0], "value": r[1]} for r in results]
 
@@ -934,204 +1368,732 @@ def get_stats_by_date(
     suspect_id: Optional[int] = None,
     specific_amount: Optional[float] = None,
     time_range: Optional[str] = None,
+    bucket: str = "day", # "auto", "hour", "day", "week", "month"
+    target_points: int = analytics.TREND_TARGET_POINTS,
+    downsample: Optional[str] = None, # "lttb"
+    max_points: int = 500,
     db: Session = Depends(database.get_db)
 ):
-    query = db.query(
-        func.strftime("%Y-%m-%d", models.Transaction.transaction_time).label("date"),
-        models.Transaction.category,
-        func.sum(models.Transaction.amount)
+    bucket = (bucket or "day").strip().lower()
+    if bucket != "auto" and bucket not in analytics.BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket 仅支持 auto/hour/day/week/month")
+
+    if analytics.use_columnar(suspect_id):
+        frame = analytics.frame_cache.get(db, suspect_id)
+        mask = _columnar_dashboard_mask(frame, start_date, end_date, specific_amount, time_range)
+        series = frame.by_date(mask, bucket=bucket, target_points=target_points)
+    else:
+        series = _sql_trend_series(db, start_date, end_date, suspect_id, specific_amount, time_range, bucket, target_points)
+
+    if downsample == "lttb":
+        series = analytics.downsample_series(series, max(3, max_points))
+    return series
+
+def _sql_trend_series(
+    db: Session,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    suspect_id: Optional[int],
+    specific_amount: Optional[float],
+    time_range: Optional[str],
+    bucket: str,
+    target_points: int,
+):
+    ts = models.Transaction.transaction_ts
+
+    def apply_filters(query):
+        query = query.filter(ts.isnot(None))
+        if suspect_id:
+            query = query.filter(models.Transaction.suspect_id == suspect_id)
+        return _filter_ts_query(query, start_date, end_date, specific_amount, time_range)
+
+    if bucket == "auto":
+        min_ts, max_ts = apply_filters(db.query(func.min(ts), func.max(ts))).one()
+        bucket = analytics.choose_bucket(min_ts, max_ts, target_points) if min_ts is not None else "day"
+
+    # Group on an integer hour/day number; weeks and months are folded from days afterwards
+    unit = analytics.SECONDS_PER_HOUR if bucket == "hour" else analytics.SECONDS_PER_DAY
+    key = (ts // unit).label("k")
+    rows = apply_filters(
+        db.query(key, models.Transaction.category, func.sum(models.Transaction.amount))
+    ).group_by(key, models.Transaction.category).all()
+
+    return analytics.trend_from_grouped_rows(rows, unit, bucket)
+
+@app.get("/stats/heatmap")
+def get_stats_heatmap(
+    suspect_id: int,
+    x: str = "hour",
+    y: str = "weekday",
+    category: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    specific_amount: Optional[float] = None,
+    time_range: Optional[str] = None,
+    db: Session = Depends(database.get_db)
+):
+    if x not in analytics.HEATMAP_AXES or y not in analytics.HEATMAP_AXES:
+        raise HTTPException(status_code=400, detail="坐标轴仅支持 weekday/hour/amount_band/category")
+    if x == y:
+        raise HTTPException(status_code=400, detail="x 与 y 不能是同一个坐标轴")
+    if not db.query(models.Suspect.id).filter(models.Suspect.id == suspect_id).first():
+        raise HTTPException(status_code=404, detail="Suspect not found")
+
+    if analytics.use_columnar(suspect_id):
+        frame = analytics.frame_cache.get(db, suspect_id)
+        key = ("heatmap", x, y, category, start_date, end_date, specific_amount, time_range)
+
+        def compute():
+            mask = _columnar_dashboard_mask(frame, start_date, end_date, specific_amount, time_range, category=category)
+            return frame.heatmap(mask, x, y)
+
+        return analytics.result_cache.get_or_compute(frame, key, compute)
+
+    return _sql_heatmap(db, suspect_id, x, y, category, start_date, end_date, specific_amount, time_range)
+
+def _sql_heatmap(db: Session, suspect_id: int, x: str, y: str, category, start_date, end_date, specific_amount, time_range):
+    ts = models.Transaction.transaction_ts
+    categories = sorted(
+        r[0] for r in db.query(models.Transaction.category).filter(models.Transaction.suspect_id == suspect_id).distinct()
+        if r[0] is not None
     )
-    
-    if suspect_id:
-        query = query.filter(models.Transaction.suspect_id == suspect_id)
+    band_edges = analytics.AMOUNT_BANDS
+    band_expr = case(
+        *[(func.abs(models.Transaction.amount) < edge, i) for i, edge in enumerate(band_edges)],
+        else_=len(band_edges),
+    )
+    axes = {
+        "weekday": ((ts // analytics.SECONDS_PER_DAY + 3) % 7, analytics.WEEKDAY_LABELS),
+        "hour": ((ts // analytics.SECONDS_PER_HOUR) % 24, [f"{h:02d}" for h in range(24)]),
+        "amount_band": (band_expr, analytics.amount_band_labels()),
+        "category": (models.Transaction.category, categories),
+    }
+    x_expr, x_labels = axes[x]
+    y_expr, y_labels = axes[y]
 
-    if start_date:
-        dt = parse_filter_time(start_date)
-        if dt:
-            query = query.filter(models.Transaction.transaction_time >= dt)
-    if end_date:
-        dt = parse_filter_time(end_date, is_end_of_range=True)
-        if dt:
-            query = query.filter(models.Transaction.transaction_time < dt)
-    if specific_amount is not None:
-        query = query.filter(models.Transaction.amount == specific_amount)
+    query = db.query(x_expr, y_expr, func.count(models.Transaction.id), func.sum(models.Transaction.amount)).filter(
+        models.Transaction.suspect_id == suspect_id
+    )
+    if "weekday" in (x, y) or "hour" in (x, y):
+        query = query.filter(ts.isnot(None))
+    if category:
+        query = query.filter(models.Transaction.category == category)
+    query = _filter_ts_query(query, start_date, end_date, specific_amount, time_range)
 
-    if time_range == "day":
-        # 06:00 - 17:59
-        query = query.filter(func.strftime("%H", models.Transaction.transaction_time) >= "06")
-        query = query.filter(func.strftime("%H", models.Transaction.transaction_time) <= "17")
-    elif time_range == "night":
-        # 18:00 - 05:59
-        query = query.filter(
-            (func.strftime("%H", models.Transaction.transaction_time) >= "18") | 
-            (func.strftime("%H", models.Transaction.transaction_time) <= "05")
-        )
+    counts = [[0] * len(x_labels) for _ in y_labels]
+    amounts = [[0.0] * len(x_labels) for _ in y_labels]
+    for xv, yv, count, total in query.group_by(x_expr, y_expr).all():
+        if (x == "category" and xv is None) or (y == "category" and yv is None):
+            continue
+        i = categories.index(yv) if y == "category" else int(yv)
+        j = categories.index(xv) if x == "category" else int(xv)
+        counts[i][j] = count
+        amounts[i][j] = round(total or 0, 2)
+    return {
+        "x": {"axis": x, "labels": x_labels},
+        "y": {"axis": y, "labels": y_labels},
+        "count": counts,
+        "amount": amounts,
+    }
 
-    results = query.group_by("date", models.Transaction.category).all()
-    
-    # Process into structured format
-    data = {}
-    for r in results:
-        date = r[0]
-        cat = r[1]
-        amount = r[2]
-        if date not in data:
-            data[date] = {"income": 0, "expense": 0}
-        
-        if cat == "收入":
-            data[date]["income"] += amount
-        elif cat == "支出":
-            data[date]["expense"] += amount
-            
-    sorted_dates = sorted(data.keys())
+def _parse_id_list(raw: Optional[str]):
+    ids = []
+    for part in (raw or "").replace("，", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            ids.append(int(part))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的嫌疑人ID: {part}")
+    return list(dict.fromkeys(ids))
+
+@app.get("/linkage/shared-counterparties")
+def get_shared_counterparties(
+    suspect_ids: str,
+    min_suspects: int = 2,
+    limit: int = 200,
+    db: Session = Depends(database.get_db)
+):
+    ids = _parse_id_list(suspect_ids)
+    if len(ids) < 2:
+        raise HTTPException(status_code=400, detail="请至少选择两个嫌疑人")
+    return linkage.shared_counterparties(db, ids, min_suspects=min_suspects, limit=limit)
+
+@app.get("/stats/compare")
+def compare_suspects(
+    suspect_ids: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    specific_amount: Optional[float] = None,
+    time_range: Optional[str] = None,
+    bucket: str = "auto",
+    target_points: int = analytics.TREND_TARGET_POINTS,
+    top: int = 10,
+    db: Session = Depends(database.get_db)
+):
+    ids = _parse_id_list(suspect_ids)
+    if not ids:
+        raise HTTPException(status_code=400, detail="请至少选择一个嫌疑人")
+    bucket = (bucket or "auto").strip().lower()
+    if bucket != "auto" and bucket not in analytics.BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket 仅支持 auto/hour/day/week/month")
+    suspects = {s.id: s.name for s in db.query(models.Suspect.id, models.Suspect.name).filter(models.Suspect.id.in_(ids))}
+    missing = [i for i in ids if i not in suspects]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Suspect not found: {','.join(map(str, missing))}")
+
+    tx = models.Transaction
+    ts = tx.transaction_ts
+
+    def scoped(query):
+        return _filter_ts_query(query.filter(tx.suspect_id.in_(ids)), start_date, end_date, specific_amount, time_range)
+
+    # One pick of bucket size for all suspects, so their series share an axis
+    if bucket == "auto":
+        min_ts, max_ts = scoped(db.query(func.min(ts), func.max(ts)).filter(ts.isnot(None))).one()
+        bucket = analytics.choose_bucket(min_ts, max_ts, target_points) if min_ts is not None else "day"
+    unit = analytics.SECONDS_PER_HOUR if bucket == "hour" else analytics.SECONDS_PER_DAY
+    key = (ts // unit).label("k")
+    # Rows without a time land in a NULL bucket: left out of the series but kept in the totals,
+    # like /stats/summary does
+    rows = scoped(db.query(tx.suspect_id, key, tx.category, func.sum(tx.amount), func.count(tx.id))).group_by(
+        tx.suspect_id, key, tx.category
+    ).all()
+    trends = analytics.aligned_trends([r for r in rows if r[1] is not None], unit, bucket, ids)
+
+    summary = {sid: {"total_income": 0.0, "total_expense": 0.0, "tx_count": 0, "counterparty_count": 0} for sid in ids}
+    for sid, _, category, total, count in rows:
+        summary[sid]["tx_count"] += count
+        if category == "收入":
+            summary[sid]["total_income"] += total or 0
+        elif category == "支出":
+            summary[sid]["total_expense"] += total or 0
+    for item in summary.values():
+        item["total_income"] = round(item["total_income"], 2)
+        item["total_expense"] = round(item["total_expense"], 2)
+
+    top_counterparties = {sid: [] for sid in ids}
+    holders = {}
+    for sid, name, total in (
+        scoped(db.query(tx.suspect_id, tx.counterparty, func.sum(tx.amount)))
+        .group_by(tx.suspect_id, tx.counterparty)
+        .order_by(tx.suspect_id, func.sum(tx.amount).desc())
+        .all()
+    ):
+        key_name = linkage.normalize_counterparty(name)
+        if not key_name:
+            continue
+        summary[sid]["counterparty_count"] += 1
+        if len(top_counterparties[sid]) < top:
+            top_counterparties[sid].append({"name": name, "value": round(total or 0, 2)})
+        holders.setdefault(key_name, {"name": name, "suspect_ids": set()})["suspect_ids"].add(sid)
+
+    shared = sorted(
+        ({"name": h["name"], "suspect_ids": sorted(h["suspect_ids"])} for h in holders.values() if len(h["suspect_ids"]) > 1),
+        key=lambda h: (-len(h["suspect_ids"]), h["name"]),
+    )
     return {
-        "dates": sorted_dates,
-        "income": [data[d]["income"] for d in sorted_dates],
-        "expense": [data[d]["expense"] for d in sorted_dates]
+        "bucket": trends["bucket"],
+        "dates": trends["dates"],
+        "starts": trends["starts"],
+        "ends": trends["ends"],
+        "suspects": [
+            {
+                "suspect_id": sid,
+                "name": suspects[sid],
+                **summary[sid],
+                "net": round(summary[sid]["total_income"] - summary[sid]["total_expense"], 2),
+                **trends["series"][sid],
+                "top_counterparties": top_counterparties[sid],
+            }
+            for sid in ids
+        ],
+        "shared_counterparties": shared[:50],
     }
 
-from concurrent.futures import ThreadPoolExecutor
+@app.get("/lookup")
+def global_lookup(
+    transaction_id: Optional[str] = None,
+    merchant_id: Optional[str] = None,
+    counterparty: Optional[str] = None,
+    limit: int = 100,
+    db: Session = Depends(database.get_db)
+):
+    transaction_id = (transaction_id or "").strip()
+    merchant_id = (merchant_id or "").strip()
+    counterparty = (counterparty or "").strip()
+    if not (transaction_id or merchant_id or counterparty):
+        raise HTTPException(status_code=400, detail="请提供交易单号、商户单号或交易对象")
+
+    # Every condition is an equality on an indexed column, so cost does not grow with the number of suspects
+    query = db.query(models.Transaction, models.Suspect.name).join(
+        models.Suspect, models.Suspect.id == models.Transaction.suspect_id
+    )
+    if transaction_id:
+        query = query.filter(models.Transaction.transaction_id == parser.clean_id(transaction_id))
+    if merchant_id:
+        query = query.filter(models.Transaction.merchant_id == parser.clean_id(merchant_id))
+    if counterparty:
+        query = query.filter(models.Transaction.counterparty == counterparty)
 
-# Create a limited thread pool specifically for AI tasks
-# This prevents AI requests from starving the main thread pool used for uploads and other operations
-# Local LLM is CPU/VRAM bound, so limiting concurrency is also good for performance
-ai_executor = ThreadPoolExecutor(max_workers=2)
+    rows = query.order_by(models.Transaction.transaction_time.desc()).limit(max(1, min(limit, 1000))).all()
+    results = [
+        {
+            "suspect_id": tx.suspect_id,
+            "suspect_name": suspect_name,
+            "source_file": tx.source_file,
+            "id": tx.id,
+            "transaction_id": tx.transaction_id,
+            "transaction_time": tx.transaction_time,
+            "transaction_type": tx.transaction_type,
+            "category": tx.category,
+            "method": tx.method,
+            "amount": tx.amount,
+            "counterparty": tx.counterparty,
+            "merchant_id": tx.merchant_id,
+        }
+        for tx, suspect_name in rows
+    ]
+
+    response = {"total": len(results), "data": results}
+    if counterparty:
+        # Per-suspect totals under the normalized name, which also catches spacing/width variants
+        key = linkage.normalize_counterparty(counterparty)
+        summary = (
+            db.query(models.CounterpartyIndex, models.Suspect.name)
+            .join(models.Suspect, models.Suspect.id == models.CounterpartyIndex.suspect_id)
+            .filter(models.CounterpartyIndex.counterparty_key == key)
+            .all()
+        ) if key else []
+        response["suspects"] = [
+            {
+                "suspect_id": idx.suspect_id,
+                "suspect_name": name,
+                "tx_count": idx.tx_count,
+                "income": round(idx.income_sum, 2),
+                "expense": round(idx.expense_sum, 2),
+            }
+            for idx, name in summary
+        ]
+    return response
 
-def call_ollama_sync(prompt, ollama_host):
-    # Ensure scheme is present
-    if not ollama_host.startswith("http://") and not ollama_host.startswith("https://"):
-        ollama_host = "http://" + ollama_host
-        
-    # Fix for Windows: cannot connect to 0.0.0.0 directly
-    if "0.0.0.0" in ollama_host:
-        ollama_host = ollama_host.replace("0.0.0.0", "127.0.0.1")
-        
-    ollama_url = f"{ollama_host}/api/generate"
-    
-    payload = {
-        "model": "qwen3:1.7b",
-        "prompt": prompt,
-        "stream": False
+@app.get("/suspects/{suspect_id}/anomalies")
+def get_anomalies(
+    suspect_id: int,
+    skip: int = 0,
+    limit: int = 50,
+    min_score: float = 0,
+    flag: Optional[str] = None,
+    db: Session = Depends(database.get_db)
+):
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+
+    query = db.query(models.TransactionScore, models.Transaction).join(
+        models.Transaction, models.Transaction.id == models.TransactionScore.transaction_pk
+    ).filter(models.TransactionScore.suspect_id == suspect_id)
+    if min_score:
+        query = query.filter(models.TransactionScore.score >= min_score)
+    if flag:
+        query = query.filter(models.TransactionScore.flags.contains(flag))
+
+    total = query.count()
+    rows = query.order_by(models.TransactionScore.score.desc(), models.TransactionScore.transaction_pk).offset(skip).limit(limit).all()
+    return {
+        "total": total,
+        "stale": suspect.anomaly_version != (suspect.data_version or 0),
+        "data": [
+            {
+                "score": score.score,
+                "flags": [f for f in (score.flags or "").split(",") if f],
+                "transaction": tx,
+            }
+            for score, tx in rows
+        ],
     }
-    
-    try:
-        # Increased timeout to 120s because queuing might happen
-        resp = requests.post(ollama_url, json=payload, timeout=120)
-        if resp.status_code == 200:
-            raw_response = resp.json().get("response", "AI 分析服务暂无响应")
-            # Clean <think> tags
-            cleaned_response = re.sub(r'<think>.*?</think>', '', raw_response, flags=re.DOTALL).strip()
-            return {"success": True, "analysis": cleaned_response}
-        else:
-            return {"success": False, "error": f"AI 服务响应错误: {resp.status_code}"}
-    except Exception as e:
-        return {"success": False, "error": f"AI 分析连接失败: {str(e)}"}
 
-@app.get("/stats/ai-analysis")
-async def get_ai_analysis(
+@app.get("/suspects/{suspect_id}/anomalies/daily")
+def get_daily_anomalies(
     suspect_id: int,
-    start_date: Optional[str] = None, 
+    start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     db: Session = Depends(database.get_db)
 ):
+    query = db.query(models.DailyScore).filter(models.DailyScore.suspect_id == suspect_id)
+    if start_date:
+        query = query.filter(models.DailyScore.day >= start_date[:10])
+    if end_date:
+        query = query.filter(models.DailyScore.day <= end_date[:10])
+    return query.order_by(models.DailyScore.day).all()
+
+@app.post("/suspects/{suspect_id}/anomalies/rescore")
+async def rescore_anomalies(suspect_id: int, db: Session = Depends(database.get_db)):
     suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
     if not suspect:
         raise HTTPException(status_code=404, detail="Suspect not found")
+    return await asyncio.to_thread(_run_analysis_stages, suspect_id)
 
-    # 0. Check Cache (Only if no date filters, as date filters change the context)
-    # If users are filtering by date, we probably should re-analyze or just warn that analysis is based on full data.
-    # The requirement says "Unless bills appended". It implies analysis is usually on the whole dataset or the current view.
-    # Let's assume the "Signature" is based on the TOTAL number of transactions for this suspect.
-    # If the user is filtering, we might want to skip caching OR cache based on filter signature.
-    # For simplicity and robustness, let's cache based on the *current filter query* + *total data count*.
-    
-    total_tx_count = db.query(models.Transaction).filter(models.Transaction.suspect_id == suspect_id).count()
-    current_signature = f"{total_tx_count}_{start_date or 'ALL'}_{end_date or 'ALL'}"
-    
-    if suspect.analysis_signature == current_signature and suspect.ai_analysis:
-        return {"analysis": suspect.ai_analysis}
-
-    # 1. Fetch Top 10 Counterparties
-    cp_query = db.query(
-        models.Transaction.counterparty, 
-        func.sum(models.Transaction.amount).label("total")
-    ).filter(models.Transaction.suspect_id == suspect_id)
-    
-    if start_date:
-        cp_query = cp_query.filter(models.Transaction.transaction_time >= datetime.strptime(start_date, "%Y-%m-%d"))
-    if end_date:
-        end_dt = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
-        cp_query = cp_query.filter(models.Transaction.transaction_time < end_dt)
-        
-    top_cps = cp_query.group_by(models.Transaction.counterparty)\
-        .order_by(func.sum(models.Transaction.amount).desc())\
-        .limit(10).all()
-    
-    if not top_cps:
-        return {"analysis": "暂无足够交易数据进行分析。"}
+@app.get("/suspects/{suspect_id}/recurring")
+def get_recurring(
+    suspect_id: int,
+    pattern: Optional[str] = None,
+    category: Optional[str] = None,
+    min_score: float = 50,
+    limit: int = 50,
+    db: Session = Depends(database.get_db)
+):
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+
+    groups = _recurring_for_suspect(db, suspect_id)
+    rows = [
+        g for g in groups
+        if g["score"] >= min_score
+        and (not pattern or g["pattern"] == pattern)
+        and (not category or g["category"] == category)
+    ]
+    return {"total": len(rows), "data": rows[:limit]}
+
+@app.get("/suspects/{suspect_id}/entities")
+def get_counterparty_entities(
+    suspect_id: int,
+    merged_only: bool = True,
+    db: Session = Depends(database.get_db)
+):
+    grouped = {}
+    for raw, (eid, name) in entities.entity_map(db, suspect_id).items():
+        grouped.setdefault(eid, {"entity_id": eid, "name": name, "aliases": []})["aliases"].append(raw)
+    rows = [g for g in grouped.values() if not merged_only or len(g["aliases"]) > 1]
+    rows.sort(key=lambda g: (-len(g["aliases"]), g["entity_id"]))
+    return rows
+
+@app.get("/suspects/{suspect_id}/counterparties/{name:path}")
+def get_counterparty_profile(
+    suspect_id: int,
+    name: str,
+    group_by: str = "name",
+    top: int = 10,
+    db: Session = Depends(database.get_db)
+):
+    if group_by not in ("name", "entity"):
+        raise HTTPException(status_code=400, detail="group_by 仅支持 name 或 entity")
+    suspect = db.query(models.Suspect.data_version).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
 
-    top_cps_str = ", ".join([f"{name}({amount:.2f})" for name, amount in top_cps])
+    def compute():
+        names = [name]
+        if group_by == "entity":
+            # The pie shows entity names when merged; expand to every spelling of that entity
+            aliases = [raw for raw, (_, entity_name) in entities.entity_map(db, suspect_id).items() if entity_name == name]
+            names = sorted(set(names + aliases))
+        return profiles.counterparty_profile(db, suspect_id, names, top=max(1, min(top, 100)))
 
-    # 2. Day vs Night Stats
-    def get_period_stats(time_range):
-        q = db.query(
-            models.Transaction.category,
-            func.sum(models.Transaction.amount)
-        ).filter(models.Transaction.suspect_id == suspect_id)
-        
-        if start_date:
-            q = q.filter(models.Transaction.transaction_time >= datetime.strptime(start_date, "%Y-%m-%d"))
-        if end_date:
-            end_dt = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
-            q = q.filter(models.Transaction.transaction_time < end_dt)
-            
-        if time_range == "day":
-            q = q.filter(func.strftime("%H", models.Transaction.transaction_time) >= "06")
-            q = q.filter(func.strftime("%H", models.Transaction.transaction_time) <= "17")
-        elif time_range == "night":
-            q = q.filter(
-                (func.strftime("%H", models.Transaction.transaction_time) >= "18") | 
-                (func.strftime("%H", models.Transaction.transaction_time) <= "05")
+    profile = analytics.result_cache.get_or_compute_version(
+        suspect_id, suspect.data_version or 0, ("counterparty-profile", name, group_by, top), compute
+    )
+    if profile is None:
+        raise HTTPException(status_code=404, detail="未找到该交易对象的记录")
+    return profile
+
+@app.get("/suspects/{suspect_id}/duplicates")
+def get_duplicates(
+    suspect_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(database.get_db)
+):
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+    report = _duplicates_for_suspect(db, suspect_id)
+    return {**report, "pairs": report["pairs"][skip:skip + limit]}
+
+@app.post("/suspects/{suspect_id}/duplicates/merge")
+def merge_duplicates(
+    suspect_id: int,
+    request: DuplicateMergeRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db)
+):
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+
+    detected = _duplicates_for_suspect(db, suspect_id)["duplicate_ids"]
+    ids = detected if request.ids is None else list(dict.fromkeys(request.ids))
+    unknown = set(ids) - set(detected)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"以下记录不在重复检测结果中: {sorted(unknown)[:20]}")
+
+    def merge(w: Session):
+        removed = 0
+        for chunk in _chunk_list(ids, 500):
+            query = w.query(models.Transaction).filter(
+                models.Transaction.suspect_id == suspect_id, models.Transaction.id.in_(chunk)
             )
-            
-        res = q.group_by(models.Transaction.category).all()
-        income = 0
-        expense = 0
-        for cat, amt in res:
-            if cat == "收入": income = amt
-            elif cat == "支出": expense = amt
-        return income, expense
-
-    day_inc, day_exp = get_period_stats("day")
-    night_inc, night_exp = get_period_stats("night")
-
-    # 3. Call Ollama (Async via Executor)
+            _on_transactions_removing(w, suspect_id, query)
+            removed += query.delete(synchronize_session=False)
+        return removed
+
+    removed = writer.run(merge)
+    if removed:
+        background_tasks.add_task(_run_analysis_stages, suspect_id)
+    return {"merged": removed}
+
+@app.get("/suspects/{suspect_id}/amounts/top")
+def get_top_amounts(
+    suspect_id: int,
+    limit: int = 20,
+    min_count: int = 2,
+    db: Session = Depends(database.get_db)
+):
+    return amounts.top_amounts(db, suspect_id, limit=limit, min_count=min_count)
+
+@app.get("/suspects/{suspect_id}/amounts/bands")
+def get_amount_bands(suspect_id: int, db: Session = Depends(database.get_db)):
+    return amounts.percentile_bands(db, suspect_id)
+
+@app.get("/suspects/{suspect_id}/amounts/watchlist")
+def get_amount_watchlist(
+    suspect_id: int,
+    amounts_list: Optional[str] = Query(None, alias="amounts"),
+    hits_only: bool = False,
+    db: Session = Depends(database.get_db)
+):
+    watch = amounts.parse_amount_list(amounts_list if amounts_list is not None else amounts.AMOUNT_WATCHLIST)
+    if not watch:
+        raise HTTPException(status_code=400, detail="请至少提供一个有效金额")
+    rows = amounts.watchlist(db, suspect_id, watch)
+    if hits_only:
+        rows = [r for r in rows if r["tx_count"]]
+    return rows
+
+@app.get("/suspects/{suspect_id}/pass-through")
+def get_pass_through(
+    suspect_id: int,
+    window_minutes: int = flows.DEFAULT_WINDOW_MINUTES,
+    tolerance: float = flows.DEFAULT_TOLERANCE,
+    min_amount: float = flows.DEFAULT_MIN_AMOUNT,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(database.get_db)
+):
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+    if window_minutes <= 0 or not 0 <= tolerance < 1:
+        raise HTTPException(status_code=400, detail="时间窗口需大于0，金额容差需在0到1之间")
+
+    frame = analytics.frame_cache.get(db, suspect_id)
+    report = analytics.result_cache.get_or_compute(
+        frame,
+        ("pass_through", window_minutes, tolerance, min_amount),
+        lambda: flows.pass_through_report(frame, window_minutes, tolerance, min_amount),
+    )
+    return {**report, "chains": report["chains"][skip:skip + limit]}
+
+def _ai_features(db: Session, suspect_id: int, start_date: Optional[str], end_date: Optional[str]):
+    """Prompt inputs for one date range, from a single pass over the suspect's transactions."""
+    start_dt = parse_filter_time(start_date) if start_date else None
+    window_start = models.epoch_seconds(start_dt) if start_dt else None
+    if analytics.use_columnar(suspect_id):
+        frame = analytics.frame_cache.get(db, suspect_id)
+        mask = _columnar_dashboard_mask(frame, start_date, end_date, None, None)
+        columns = features.frame_columns(frame, mask)
+    else:
+        conditions = _ts_filter_conditions(start_date, end_date, None, None)
+        columns = features.sql_columns(db, suspect_id, and_(*conditions) if conditions else None)
+    return features.summarize(*columns, window_start_ts=window_start)
+
+def _build_ai_prompt(db: Session, suspect_id: int, start_date: Optional[str], end_date: Optional[str]):
+    """None when there is nothing to analyse."""
+    f = _ai_features(db, suspect_id, start_date, end_date)
+    if f is None or not f["top_counterparties"]:
+        return None
+
+    top_cps_str = ", ".join(f"{c['name']}({c['total']:.2f}, {c['count']}笔)" for c in f["top_counterparties"])
     prompt = f"""
     作为一名金融分析专家，请根据以下嫌疑人的交易数据进行简要分析，指出可能的可疑点。
     
     【数据概览】
+    - 交易笔数：{f["tx_count"]}，交易对象数：{f["counterparty_count"]}，总收入：{f["total_income"]:.2f}，总支出：{f["total_expense"]:.2f}
     - 交易对象TOP10：{top_cps_str}
     - 交易时间分析：
-      - 日间(06:00-18:00)总收入：{day_inc:.2f}，总支出：{day_exp:.2f}
-      - 夜间(18:00-06:00)总收入：{night_inc:.2f}，总支出：{night_exp:.2f}
+      - 日间({analytics.time_range_label("day")})总收入：{f["day_income"]:.2f}，总支出：{f["day_expense"]:.2f}
+      - 夜间({analytics.time_range_label("night")})总收入：{f["night_income"]:.2f}，总支出：{f["night_expense"]:.2f}
+      - 夜间交易笔数占比：{f["night_ratio"]:.1%}
+    - 大额交易（≥{f["large_threshold"]:.0f}元）：{f["large_count"]}笔，合计{f["large_total"]:.2f}
+    - 新出现的交易对象：{f["new_counterparty_count"]}个，占交易对象的{f["new_counterparty_rate"]:.1%}
     
     请用简练、犀利的口吻（类似于侦探或审计专家），简短地给出你的核心点评和风险提示（200字以内）。关注大额交易或频繁交易、以及异常的交易对象，排除正常的对象（如超市购物等）。
     """
-    
-    ollama_host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-    
-    # Run in separate thread pool to avoid blocking main loop and other requests
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(ai_executor, call_ollama_sync, prompt, ollama_host)
-    
-    if result["success"]:
-        # Save to cache
-        suspect.ai_analysis = result["analysis"]
-        suspect.analysis_signature = current_signature
-        db.commit()
-        return {"analysis": result["analysis"]}
-    else:
-        raise HTTPException(status_code=503, detail=result["error"])
+    return prompt
+
+# Bump when the prompt changes so old cached analyses stop matching
+AI_PROMPT_VERSION = "2"
+
+def _ai_cache_key(suspect, start_date: Optional[str], end_date: Optional[str]):
+    signature = f"{start_date or 'ALL'}_{end_date or 'ALL'}"
+    return (suspect.id, signature, suspect.data_version or 0, llm.client.model, AI_PROMPT_VERSION)
+
+async def _run_ai_flight(key: tuple, flight, prompt: str):
+    async def generate():
+        async for chunk in llm.client.stream_generate(prompt, model=key[3]):
+            flight.publish("token", chunk)
+
+    try:
+        # Everyone may have left while the job was queued
+        if flight.cancelled:
+            raise asyncio.CancelledError
+        # Its own task, so the last listener leaving cancels the generation and not the queue worker
+        flight.task = asyncio.get_running_loop().create_task(generate())
+        await flight.task
+        analysis = "".join(flight.parts).strip()
+        if not analysis:
+            raise RuntimeError("AI 未返回分析内容")
+        await writer.run_async(lambda db: ai_cache.store(db, key, analysis))
+        flight.publish("done", analysis)
+        flight.done.set_result(analysis)
+    except (Exception, asyncio.CancelledError) as e:
+        if isinstance(e, asyncio.CancelledError):
+            detail = "AI 分析已取消"
+        elif isinstance(e, RuntimeError):
+            detail = str(e)
+        else:
+            detail = f"AI 分析连接失败: {str(e)}"
+        flight.publish("error", detail)
+        flight.done.set_exception(RuntimeError(detail))
+        flight.done.exception()  # mark retrieved; listeners get the error through publish
+        if isinstance(e, asyncio.CancelledError) and not flight.cancelled:
+            raise
+    finally:
+        ai_cache.flights.finish(key, flight)
+
+def _ai_flight(
+    db: Session,
+    key: tuple,
+    suspect_id: int,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    priority: int = ai_queue.INTERACTIVE,
+):
+    """Join the generation already queued or running for `key`, or queue one; None if there is no data."""
+    flight = ai_cache.flights.current(key)
+    if flight is not None:
+        # Someone is waiting now: a queued background analysis moves to the front
+        ai_queue.scheduler.promote(key, priority)
+        return flight
+    prompt = _build_ai_prompt(db, suspect_id, start_date, end_date)
+    if prompt is None:
+        return None
+    flight = ai_cache.flights.start(key, keep_running=priority == ai_queue.BACKGROUND)
+    ai_queue.scheduler.submit(key, priority, lambda: _run_ai_flight(key, flight, prompt))
+    return flight
+
+def _schedule_background_ai(suspect_id: int):
+    """Queue a whole-range analysis so the first dashboard visit after an upload is a cache hit."""
+    if not ai_queue.AI_BACKGROUND_ANALYSIS:
+        return
+    db = database.SessionLocal()
+    try:
+        suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+        if not suspect:
+            return
+        key = _ai_cache_key(suspect, None, None)
+        if db.get(models.AIAnalysisCache, key) is None:
+            _ai_flight(db, key, suspect_id, None, None, priority=ai_queue.BACKGROUND)
+    finally:
+        db.close()
+
+@app.get("/stats/ai-analysis")
+async def get_ai_analysis(
+    suspect_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    db: Session = Depends(database.get_db)
+):
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+
+    key = _ai_cache_key(suspect, start_date, end_date)
+    cached = ai_cache.lookup(db, key)
+    if cached is not None:
+        return {"analysis": cached}
+    flight = _ai_flight(db, key, suspect_id, start_date, end_date)
+    if flight is None:
+        return {"analysis": "暂无足够交易数据进行分析。"}
+
+    listener = flight.subscribe()
+    try:
+        # shield: this request going away must not cancel the result other listeners wait for
+        return {"analysis": await asyncio.shield(flight.done)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    finally:
+        flight.unsubscribe(listener)
+
+def _sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/stats/ai-analysis/stream")
+async def stream_ai_analysis(
+    request: Request,
+    suspect_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    db: Session = Depends(database.get_db)
+):
+    """Same analysis as /stats/ai-analysis, sent as SSE `token` events while the model writes it."""
+    suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
+    if not suspect:
+        raise HTTPException(status_code=404, detail="Suspect not found")
+
+    key = _ai_cache_key(suspect, start_date, end_date)
+    cached = ai_cache.lookup(db, key)
+    flight = None if cached is not None else _ai_flight(db, key, suspect_id, start_date, end_date)
+
+    async def events():
+        if cached is not None:
+            yield _sse("done", {"analysis": cached, "cached": True})
+            return
+        if flight is None:
+            yield _sse("done", {"analysis": "暂无足够交易数据进行分析。", "cached": False})
+            return
+        # Subscribed here, where the finally below is sure to undo it: a client gone before the
+        # first iteration never runs the generator at all
+        listener = flight.subscribe()
+        try:
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(listener.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # Comment line keeps proxies from closing an idle connection while the model loads
+                    yield ": keep-alive\n\n"
+                    continue
+                if kind == "token":
+                    yield _sse("token", {"text": payload})
+                elif kind == "error":
+                    yield _sse("error", {"detail": payload})
+                    return
+                else:
+                    yield _sse("done", {"analysis": payload, "cached": False})
+                    return
+        finally:
+            # The last listener leaving stops the generation
+            flight.unsubscribe(listener)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 def _safe_extract_zip(archive_path: str, dest_dir: str):
     with zipfile.ZipFile(archive_path, "r") as zf:
@@ -1277,15 +2239,15 @@ def _is_within_reports_dir(path: str):
         return False
 
 async def _process_report_upload_job(job_id: str, suspect_id: int, archive_path: str, work_dir: str):
-    _set_report_job(job_id, {"status": "queued", "updated_at": datetime.now().isoformat(timespec="seconds")})
+    jobs.update(job_id, {"status": "queued"})
     await REPORT_UPLOAD_SEMAPHORE.acquire()
     try:
-        _set_report_job(job_id, {"status": "processing", "updated_at": datetime.now().isoformat(timespec="seconds")})
+        jobs.update(job_id, {"status": "processing"})
         db = database.SessionLocal()
         try:
             suspect = db.query(models.Suspect).filter(models.Suspect.id == suspect_id).first()
             if not suspect:
-                _set_report_job(job_id, {"status": "error", "detail": "Suspect not found", "updated_at": datetime.now().isoformat(timespec="seconds")})
+                jobs.update(job_id, {"status": "error", "detail": "Suspect not found"})
                 return
 
             await asyncio.to_thread(_extract_archive, archive_path, work_dir)
@@ -1295,9 +2257,11 @@ async def _process_report_upload_job(job_id: str, suspect_id: int, archive_path:
             main_rel = (await asyncio.to_thread(_find_main_html, report_root)).replace("\\", "/")
 
             old_report_root = suspect.report_path
-            suspect.report_path = report_root
-            suspect.report_filename = main_rel
-            db.commit()
+            await writer.run_async(
+                lambda w: w.query(models.Suspect)
+                .filter(models.Suspect.id == suspect_id)
+                .update({models.Suspect.report_path: report_root, models.Suspect.report_filename: main_rel})
+            )
 
             if old_report_root and old_report_root != report_root and _is_within_reports_dir(old_report_root):
                 await asyncio.to_thread(_remove_report_access, old_report_root)
@@ -1306,35 +2270,14 @@ async def _process_report_upload_job(job_id: str, suspect_id: int, archive_path:
 
             await asyncio.to_thread(_update_report_access, report_root)
 
-            _set_report_job(
-                job_id,
-                {
-                    "status": "done",
-                    "filename": main_rel,
-                    "updated_at": datetime.now().isoformat(timespec="seconds"),
-                },
-            )
+            jobs.update(job_id, {"status": "done", "filename": main_rel})
         finally:
             db.close()
     except HTTPException as e:
-        _set_report_job(
-            job_id,
-            {
-                "status": "error",
-                "detail": getattr(e, "detail", "服务器处理失败"),
-                "updated_at": datetime.now().isoformat(timespec="seconds"),
-            },
-        )
+        jobs.update(job_id, {"status": "error", "detail": getattr(e, "detail", "服务器处理失败")})
         await asyncio.to_thread(_delete_tree, work_dir)
     except Exception as e:
-        _set_report_job(
-            job_id,
-            {
-                "status": "error",
-                "detail": str(e),
-                "updated_at": datetime.now().isoformat(timespec="seconds"),
-            },
-        )
+        jobs.update(job_id, {"status": "error", "detail": str(e)})
         await asyncio.to_thread(_delete_tree, work_dir)
     finally:
         REPORT_UPLOAD_SEMAPHORE.release()
@@ -1370,25 +2313,21 @@ async def upload_report(
             await out.write(chunk)
 
     job_id = uuid.uuid4().hex
-    _set_report_job(
-        job_id,
-        {
-            "status": "queued",
-            "suspect_id": suspect_id,
-            "created_at": datetime.now().isoformat(timespec="seconds"),
-            "updated_at": datetime.now().isoformat(timespec="seconds"),
-        },
-    )
-    asyncio.create_task(_process_report_upload_job(job_id, suspect_id, archive_path, work_dir))
+    await jobs.create(job_id, "report", suspect_id, {}, {"archive_path": archive_path, "work_dir": work_dir})
+    _start_job_task(_process_report_upload_job(job_id, suspect_id, archive_path, work_dir))
     return {"status": "accepted", "job_id": job_id}
 
 @app.get("/api/report/upload_status")
 def report_upload_status(job_id: str = Query(...)):
-    job = _get_report_job(job_id)
+    job = jobs.get(job_id, "report")
     if not job:
         raise HTTPException(status_code=404, detail="job not found")
     return job
 
+@app.get("/api/report/upload_events")
+async def report_upload_events(request: Request, job_id: str = Query(...)):
+    return _job_event_stream(request, job_id, "report")
+
 @app.post("/api/set_report_path")
 def set_report_path(request: ReportPathRequest, db: Session = Depends(database.get_db)):
     raise HTTPException(status_code=400, detail="服务器部署场景不支持选择本地路径，请上传取证报告压缩包（zip/rar）")
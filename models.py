@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, Text, event
 from sqlalchemy.orm import relationship
 from database import Base
-from datetime import datetime
+from datetime import datetime, timedelta
 
 class Suspect(Base):
     __tablename__ = "suspects"
@@ -15,6 +15,11 @@ class Suspect(Base):
     ai_analysis = Column(String, nullable=True)
     analysis_signature = Column(String, nullable=True)
 
+    # Bumped whenever the suspect's transactions change; derived caches key on it
+    data_version = Column(Integer, default=0)
+    # data_version the stored anomaly scores were computed from
+    anomaly_version = Column(Integer, nullable=True)
+
     # Local Forensics Report Path
     report_path = Column(String, nullable=True)
     report_filename = Column(String, nullable=True)
@@ -28,12 +33,134 @@ class Transaction(Base):
     suspect_id = Column(Integer, ForeignKey("suspects.id"))
     transaction_id = Column(String, index=True) 
     transaction_time = Column(DateTime, index=True)
+    # transaction_time as integer epoch seconds, for bucketing with plain integer arithmetic
+    transaction_ts = Column(Integer)
     transaction_type = Column(String)
     category = Column(String) # 收/支/其他
     method = Column(String)
     amount = Column(Float)
     counterparty = Column(String, index=True)
-    merchant_id = Column(String)
+    merchant_id = Column(String, index=True)
     source_file = Column(String)
     
     suspect = relationship("Suspect", back_populates="transactions")
+
+    __table_args__ = (
+        Index("ix_transactions_suspect_time", "suspect_id", "transaction_time"),
+        Index("ix_transactions_suspect_ts", "suspect_id", "transaction_ts"),
+        Index("ix_transactions_suspect_counterparty_time", "suspect_id", "counterparty", "transaction_time"),
+    )
+
+class CounterpartyIndex(Base):
+    """Per-suspect totals for each normalized counterparty, maintained on insert/delete."""
+    __tablename__ = "counterparty_index"
+
+    counterparty_key = Column(String, primary_key=True)
+    suspect_id = Column(Integer, ForeignKey("suspects.id"), primary_key=True, index=True)
+    display_name = Column(String)
+    tx_count = Column(Integer, default=0)
+    amount_sum = Column(Float, default=0.0)
+    income_sum = Column(Float, default=0.0)
+    expense_sum = Column(Float, default=0.0)
+
+class AmountStat(Base):
+    """Per-suspect frequency of each exact amount (in cents), maintained on insert/delete."""
+    __tablename__ = "amount_stats"
+
+    suspect_id = Column(Integer, ForeignKey("suspects.id"), primary_key=True)
+    amount_cents = Column(Integer, primary_key=True)
+    tx_count = Column(Integer, default=0)
+    income_count = Column(Integer, default=0)
+    expense_count = Column(Integer, default=0)
+    counterparty_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_amount_stats_suspect_count", "suspect_id", "tx_count"),
+    )
+
+class AmountCounterparty(Base):
+    """Backs AmountStat.counterparty_count so deletes can tell when a counterparty drops out."""
+    __tablename__ = "amount_counterparties"
+
+    suspect_id = Column(Integer, ForeignKey("suspects.id"), primary_key=True)
+    amount_cents = Column(Integer, primary_key=True)
+    counterparty_key = Column(String, primary_key=True)
+    tx_count = Column(Integer, default=0)
+
+class CounterpartyEntity(Base):
+    """Per-suspect mapping of raw counterparty spellings to one resolved entity."""
+    __tablename__ = "counterparty_entities"
+
+    suspect_id = Column(Integer, ForeignKey("suspects.id"), primary_key=True)
+    raw_name = Column(String, primary_key=True)
+    entity_id = Column(Integer, index=True)
+    entity_name = Column(String)
+
+class AIAnalysisCache(Base):
+    """Generated AI analyses; rows age out least-recently-used first."""
+    __tablename__ = "ai_analysis_cache"
+
+    suspect_id = Column(Integer, ForeignKey("suspects.id"), primary_key=True)
+    filter_signature = Column(String, primary_key=True)
+    data_version = Column(Integer, primary_key=True)
+    model = Column(String, primary_key=True)
+    prompt_version = Column(String, primary_key=True)
+    analysis = Column(Text)
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, index=True)
+
+class UploadJob(Base):
+    """Bill and report upload jobs; unfinished ones are resumed at startup."""
+    __tablename__ = "upload_jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String)  # "bill" or "report"
+    suspect_id = Column(Integer, index=True)
+    status = Column(String)
+    # What is needed to run the job again: stored file paths, work directory
+    payload = Column(Text)
+    # What the upload_status endpoints return: progress, per-file results, timings
+    state = Column(Text)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_upload_jobs_status_finished", "status", "finished_at"),
+    )
+
+class TransactionScore(Base):
+    """Anomaly score of a flagged transaction; unflagged rows are not stored."""
+    __tablename__ = "transaction_scores"
+
+    transaction_pk = Column(Integer, ForeignKey("transactions.id"), primary_key=True)
+    suspect_id = Column(Integer, ForeignKey("suspects.id"))
+    score = Column(Float)
+    flags = Column(String)
+
+    __table_args__ = (
+        Index("ix_transaction_scores_suspect_score", "suspect_id", "score"),
+    )
+
+class DailyScore(Base):
+    __tablename__ = "daily_scores"
+
+    suspect_id = Column(Integer, ForeignKey("suspects.id"), primary_key=True)
+    day = Column(String, primary_key=True)
+    tx_count = Column(Integer)
+    volume = Column(Float)
+    volume_z = Column(Float)
+    round_ratio = Column(Float)
+    burst_count = Column(Integer)
+    night_count = Column(Integer)
+    score = Column(Float)
+
+def epoch_seconds(dt):
+    if dt is None:
+        return None
+    return (dt - datetime(1970, 1, 1)) // timedelta(seconds=1)
+
+@event.listens_for(Transaction, "before_insert")
+@event.listens_for(Transaction, "before_update")
+def _sync_transaction_ts(mapper, connection, target):
+    target.transaction_ts = epoch_seconds(target.transaction_time)
@@ -5,10 +5,11 @@ import re
 import os
 import hashlib
 
-def parse_bill_file(file_path):
+def parse_bill_file(file_path, on_page=None):
+    """`on_page(page, total)` is called as each PDF page starts parsing, for progress reporting."""
     ext = os.path.splitext(file_path)[1].lower()
     if ext == '.pdf':
-        return parse_pdf_bill(file_path)
+        return parse_pdf_bill(file_path, on_page)
     elif ext in ['.xlsx', '.xls']:
         return parse_excel_bill(file_path)
     elif ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif']:
@@ -355,10 +356,11 @@ def inspect_pdf_sample(file_path: str, max_samples: int = 12):
         result["error"] = str(e)
     return result
 
-def parse_pdf_bill(file_path):
+def parse_pdf_bill(file_path, on_page=None):
     transactions = []
     
     with pdfplumber.open(file_path) as pdf:
+        total_pages = len(pdf.pages)
         if len(pdf.pages) > 0:
             # Check if the PDF is scanned (image-only)
             first_page_text = pdf.pages[0].extract_text()
@@ -370,7 +372,9 @@ def parse_pdf_bill(file_path):
         is_wechat_pdf = ("微信支付交易明细证明" in first_page_text) or ("交易单号" in first_page_text and "交易时间" in first_page_text)
         if is_wechat_pdf:
             seen_ids = set()
-            for page in pdf.pages:
+            for page_no, page in enumerate(pdf.pages, 1):
+                if on_page:
+                    on_page(page_no, total_pages)
                 page_text = None
                 try:
                     page_text = page.extract_text() if page else None
@@ -385,7 +389,9 @@ def parse_pdf_bill(file_path):
             return transactions
 
         current_bill_type = None
-        for page in pdf.pages:
+        for page_no, page in enumerate(pdf.pages, 1):
+            if on_page:
+                on_page(page_no, total_pages)
             before_page = len(transactions)
             tables = _extract_tables_with_fallback(page)
             if not tables:
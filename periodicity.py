@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+
+import analytics
+import linkage
+
+# At least two events: a single one has no interval to measure
+RECURRING_MIN_OCCURRENCES = max(2, int(os.getenv("RECURRING_MIN_OCCURRENCES", "3")))
+DAY = analytics.SECONDS_PER_DAY
+
+# name, (min, max) median interval in days
+PATTERNS = (
+    ("daily", (0.8, 1.5)),
+    ("weekly", (6.0, 8.0)),
+    ("biweekly", (13.0, 15.5)),
+    ("monthly", (27.0, 32.0)),
+    ("quarterly", (85.0, 95.0)),
+)
+WEEKDAYS = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+
+def _group_starts(keys):
+    """Start offset of every run of equal values in a sorted key array."""
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+def _group_median(group, values, n_groups):
+    """Median of `values` per group (lower median for even counts); groups are 0..n_groups-1."""
+    if values.size == 0:
+        return np.zeros(n_groups, dtype=values.dtype)
+    order = np.lexsort((values, group))
+    counts = np.bincount(group, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    picked = values[order][np.minimum(starts + (counts - 1) // 2, values.size - 1)]
+    return np.where(counts > 0, picked, 0)
+
+def _slot_table(group, slot, n_groups, n_slots):
+    """Per-group histogram over calendar slots (weekday, day of month) and its most common slot."""
+    table = np.bincount(group * n_slots + slot, minlength=n_groups * n_slots).reshape(n_groups, n_slots)
+    return table, table.argmax(axis=1)
+
+def detect_recurring(frame):
+    """Rank (counterparty, 收/支) groups by how regular their timing and amounts are.
+
+    Transactions on the same day with the same counterparty are merged into one event first, so a
+    busy merchant does not look "daily" because of several purchases in one afternoon.
+    """
+    valid = frame.has_time
+    blank = [i for i, v in enumerate(frame.counterparties) if not linkage.normalize_counterparty(v)]
+    if blank:
+        valid &= ~np.isin(frame.counterparty_codes, blank)
+    idx = np.flatnonzero(valid)
+    if idx.size == 0:
+        return []
+
+    n_cat = max(len(frame.categories), 1)
+    raw_group = frame.counterparty_codes[idx].astype(np.int64) * n_cat + frame.category_codes[idx]
+    days = frame.times[idx] // DAY
+
+    # One event per (group, day); frame rows are time-sorted so days are non-decreasing within a group
+    order = np.argsort(raw_group, kind="stable")
+    g_sorted = raw_group[order]
+    d_sorted = days[order]
+    new_event = np.concatenate(([True], (g_sorted[1:] != g_sorted[:-1]) | (d_sorted[1:] != d_sorted[:-1])))
+    event_id = np.cumsum(new_event) - 1
+    ev_group_raw = g_sorted[new_event]
+    ev_day = d_sorted[new_event]
+    ev_amount = np.bincount(event_id, weights=np.abs(frame.amounts[idx][order]) / 100.0)
+
+    # Dense group ids over events, keeping only groups with enough events
+    group_keys, ev_group = np.unique(ev_group_raw, return_inverse=True)
+    n_groups = group_keys.size
+    ev_count = np.bincount(ev_group, minlength=n_groups)
+    keep_group = ev_count >= RECURRING_MIN_OCCURRENCES
+    if not keep_group.any():
+        return []
+
+    # Intervals between consecutive events of the same group
+    same = ev_group[1:] == ev_group[:-1]
+    iv_group = ev_group[1:][same]
+    iv_days = (ev_day[1:] - ev_day[:-1])[same].astype(np.float64)
+    iv_count = np.bincount(iv_group, minlength=n_groups)
+    median_iv = _group_median(iv_group, iv_days, n_groups).astype(np.float64)
+    abs_dev = np.abs(iv_days - median_iv[iv_group])
+    mad_iv = _group_median(iv_group, abs_dev, n_groups).astype(np.float64)
+    # Robust coefficient of variation; one skipped month should not make a monthly payment irregular
+    with np.errstate(invalid="ignore", divide="ignore"):
+        interval_cv = np.where(median_iv > 0, 1.4826 * mad_iv / median_iv, 1.0)
+    on_period = np.bincount(iv_group, weights=abs_dev <= np.maximum(1.0, 0.1 * median_iv[iv_group]), minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        on_period_ratio = np.where(iv_count > 0, on_period / np.maximum(iv_count, 1), 0.0)
+
+    amt_sum = np.bincount(ev_group, weights=ev_amount, minlength=n_groups)
+    amt_sq = np.bincount(ev_group, weights=ev_amount * ev_amount, minlength=n_groups)
+    amt_mean = amt_sum / np.maximum(ev_count, 1)
+    amt_std = np.sqrt(np.maximum(amt_sq / np.maximum(ev_count, 1) - amt_mean * amt_mean, 0.0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        amount_cv = np.where(amt_mean > 0, amt_std / amt_mean, 1.0)
+    amount_median = _group_median(ev_group, ev_amount, n_groups)
+
+    # Calendar alignment: share of events on the group's most common weekday / day of month
+    ev_dates = ev_day.astype("datetime64[D]")
+    weekday = ((ev_day + 3) % 7).astype(np.int64)  # 1970-01-01 was a Thursday
+    dom = (ev_dates - ev_dates.astype("datetime64[M]")).astype(np.int64)
+    wd_table, wd_mode = _slot_table(ev_group, weekday, n_groups, 7)
+    dom_table, dom_mode = _slot_table(ev_group, dom, n_groups, 31)
+    rows = np.arange(n_groups)
+    wd_share = wd_table[rows, wd_mode] / np.maximum(ev_count, 1)
+    # Day-of-month drifts by a day or two around weekends and month ends
+    dom_near = dom_table[rows, dom_mode]
+    dom_near = dom_near + dom_table[rows, np.maximum(dom_mode - 1, 0)] * (dom_mode > 0)
+    dom_near = dom_near + dom_table[rows, np.minimum(dom_mode + 1, 30)] * (dom_mode < 30)
+    dom_share = dom_near / np.maximum(ev_count, 1)
+
+    starts = _group_starts(ev_group)
+    first_day = ev_day[starts]
+    last_day = ev_day[np.concatenate((starts[1:], [ev_day.size])) - 1]
+
+    pattern = np.full(n_groups, "irregular", dtype=object)
+    for name, (lo, hi) in PATTERNS:
+        pattern[(median_iv >= lo) & (median_iv <= hi)] = name
+    calendar = np.where(
+        np.isin(pattern, ["monthly", "quarterly"]), dom_share,
+        np.where(np.isin(pattern, ["weekly", "biweekly"]), wd_share, on_period_ratio),
+    )
+
+    timing = np.clip(1.0 - interval_cv, 0.0, 1.0) * 0.5 + on_period_ratio * 0.5
+    stability = np.clip(1.0 - amount_cv, 0.0, 1.0)
+    support = np.clip(np.log(ev_count) / np.log(12), 0.0, 1.0)
+    score = 100.0 * (0.4 * timing + 0.25 * stability + 0.2 * calendar + 0.15 * support)
+    # Irregular groups and daily habits (meals, commuting) are rarely what an investigation is after
+    score = np.where(pattern == "irregular", score * 0.5, np.where(pattern == "daily", score * 0.7, score))
+
+    result = []
+    for g in np.flatnonzero(keep_group)[np.argsort(-score[keep_group], kind="stable")].tolist():
+        cp_code, cat_code = divmod(int(group_keys[g]), n_cat)
+        p = pattern[g]
+        typical = None
+        if p in ("monthly", "quarterly"):
+            typical = f"每月{int(dom_mode[g]) + 1}日"
+        elif p in ("weekly", "biweekly"):
+            typical = WEEKDAYS[int(wd_mode[g])]
+        period = float(median_iv[g])
+        next_expected = None
+        if p != "irregular" and period > 0:
+            next_expected = str(np.datetime64(int(last_day[g] + round(period)), "D"))
+        result.append(
+            {
+                "counterparty": frame.counterparties[cp_code],
+                "category": frame.categories[cat_code] if frame.categories else None,
+                "pattern": p,
+                "period_days": round(period, 1),
+                "typical_day": typical,
+                "occurrences": int(ev_count[g]),
+                "interval_cv": round(float(interval_cv[g]), 3),
+                "on_period_ratio": round(float(on_period_ratio[g]), 3),
+                "amount_median": round(float(amount_median[g]), 2),
+                "amount_cv": round(float(amount_cv[g]), 3),
+                "total_amount": round(float(amt_sum[g]), 2),
+                "first_date": str(np.datetime64(int(first_day[g]), "D")),
+                "last_date": str(np.datetime64(int(last_day[g]), "D")),
+                "next_expected": next_expected,
+                "score": round(float(score[g]), 1),
+            }
+        )
+    return result
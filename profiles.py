@@ -0,0 +1,82 @@
+import heapq
+
+import models
+
+def _time_label(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S") if dt else None
+
+def counterparty_profile(db, suspect_id: int, names: list[str], top: int = 10):
+    """First/last seen, totals, monthly series and largest transactions for one counterparty.
+
+    One ordered read over the (suspect_id, counterparty, transaction_time) index; every figure is
+    accumulated in the same loop.
+    """
+    tx = models.Transaction
+    rows = (
+        db.query(tx.id, tx.transaction_time, tx.category, tx.amount, tx.transaction_type, tx.method, tx.source_file, tx.counterparty)
+        .filter(tx.suspect_id == suspect_id, tx.counterparty.in_(names))
+        .order_by(tx.transaction_time)
+    )
+
+    count = 0
+    first = last = None
+    totals = {"收入": [0, 0.0], "支出": [0, 0.0], "其他": [0, 0.0]}
+    months = {}
+    methods = {}
+    largest = []  # min-heap of (abs amount, id, row)
+    for r in rows.yield_per(2000):
+        count += 1
+        amount = r.amount or 0
+        if r.transaction_time is not None:
+            first = first or r.transaction_time
+            last = r.transaction_time
+            month = months.setdefault(r.transaction_time.strftime("%Y-%m"), {"count": 0, "income": 0.0, "expense": 0.0})
+            month["count"] += 1
+            if r.category == "收入":
+                month["income"] += amount
+            elif r.category == "支出":
+                month["expense"] += amount
+        acc = totals.get(r.category, totals["其他"])
+        acc[0] += 1
+        acc[1] += amount
+        if r.method:
+            methods[r.method] = methods.get(r.method, 0) + 1
+        entry = (abs(amount), -r.id, r)
+        if len(largest) < top:
+            heapq.heappush(largest, entry)
+        elif entry[:2] > largest[0][:2]:
+            heapq.heapreplace(largest, entry)
+
+    if not count:
+        return None
+    largest.sort(key=lambda e: e[:2], reverse=True)
+    return {
+        "names": names,
+        "count": count,
+        "first_seen": _time_label(first),
+        "last_seen": _time_label(last),
+        "income_count": totals["收入"][0],
+        "income_total": round(totals["收入"][1], 2),
+        "expense_count": totals["支出"][0],
+        "expense_total": round(totals["支出"][1], 2),
+        "other_count": totals["其他"][0],
+        "net": round(totals["收入"][1] - totals["支出"][1], 2),
+        "methods": sorted(({"name": k, "count": v} for k, v in methods.items()), key=lambda m: -m["count"]),
+        "monthly": [
+            {"month": k, "count": v["count"], "income": round(v["income"], 2), "expense": round(v["expense"], 2)}
+            for k, v in months.items()
+        ],
+        "largest": [
+            {
+                "id": r.id,
+                "time": _time_label(r.transaction_time),
+                "category": r.category,
+                "amount": r.amount,
+                "transaction_type": r.transaction_type,
+                "method": r.method,
+                "counterparty": r.counterparty,
+                "source_file": r.source_file,
+            }
+            for _, _, r in largest
+        ],
+    }
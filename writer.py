@@ -0,0 +1,145 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import database
+
+# Most writes committed together; everything that queued up while the last commit ran goes in the next
+WRITER_MAX_BATCH = max(1, int(os.getenv("WRITER_MAX_BATCH", "64")))
+
+class _Op:
+    __slots__ = ("fn", "future", "enqueued_at")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class Writer:
+    """The one thread that writes to SQLite while the app is serving.
+
+    SQLite allows a single writer, so instead of sessions racing for the lock (and failing with
+    "database is locked"), writes are queued here as `fn(db)` callables and run one after another
+    on a dedicated session. Ops that queue up while a commit is in progress are run together and
+    committed once (group commit). An op must not commit; it may flush, and later ops in the same
+    batch see its changes. It should return plain values: the session is closed once it commits.
+    Each op runs in its own SAVEPOINT, so one that fails is rolled back alone and reports its
+    error, and nothing is ever run twice.
+    """
+
+    def __init__(self, max_batch: int):
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.ops = 0
+        self.failed = 0
+        self.max_queue = 0
+        self._commit_ms = deque(maxlen=200)
+        self._wait_ms = deque(maxlen=200)
+        self._batch_sizes = deque(maxlen=200)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self._thread.start()
+
+    def submit(self, fn):
+        """Queue `fn(db)`; the returned Future holds its result once committed."""
+        self._ensure_thread()
+        op = _Op(fn)
+        self._queue.put(op)
+        self.max_queue = max(self.max_queue, self._queue.qsize())
+        return op.future
+
+    def run(self, fn):
+        """Submit and wait; for sync code running in a worker thread, never on the event loop."""
+        return self.submit(fn).result()
+
+    async def run_async(self, fn):
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.monotonic()
+            for op in batch:
+                self._wait_ms.append((started - op.enqueued_at) * 1000)
+            self._commit(batch)
+            self.batches += 1
+            self._batch_sizes.append(len(batch))
+
+    def _commit(self, batch):
+        """Run `batch` in one transaction, each op in a savepoint, and resolve every op's future."""
+        db = database.WriterSessionLocal()
+        outcomes = []  # (op, succeeded, result or exception)
+        try:
+            for op in batch:
+                savepoint = db.begin_nested()
+                try:
+                    result = op.fn(db)
+                    db.flush()
+                    savepoint.commit()
+                    outcomes.append((op, True, result))
+                except BaseException as e:
+                    # BaseException too: anything escaping here would kill the thread and hang every caller
+                    savepoint.rollback()
+                    outcomes.append((op, False, e))
+            started = time.monotonic()
+            db.commit()
+            self._commit_ms.append((time.monotonic() - started) * 1000)
+        except BaseException as e:
+            # The commit itself failed, so none of the batch was stored
+            db.rollback()
+            outcomes = [(op, False, e) for op in batch]
+        finally:
+            db.close()
+        for op, succeeded, value in outcomes:
+            if succeeded:
+                self.ops += 1
+                op.future.set_result(value)
+            else:
+                self.failed += 1
+                op.future.set_exception(value)
+
+    def stats(self):
+        def percentiles(samples):
+            ordered = sorted(samples)
+            if not ordered:
+                return {"p50": None, "p95": None, "max": None}
+            return {
+                "p50": round(ordered[len(ordered) // 2], 2),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+                "max": round(ordered[-1], 2),
+            }
+
+        sizes = list(self._batch_sizes)
+        return {
+            "queue_length": self._queue.qsize(),
+            "max_queue_length": self.max_queue,
+            "batches": self.batches,
+            "ops": self.ops,
+            "failed": self.failed,
+            "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else None,
+            "commit_ms": percentiles(self._commit_ms),
+            "queue_wait_ms": percentiles(self._wait_ms),
+        }
+
+_writer = Writer(WRITER_MAX_BATCH)
+
+submit = _writer.submit
+run = _writer.run
+run_async = _writer.run_async
+stats = _writer.stats